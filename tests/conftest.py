@@ -0,0 +1,86 @@
+# Pruebas sin navegador sobre el servidor simulado (tyba_mock_server.py). Los módulos del proyecto
+# son scripts en la raíz del repositorio, así que se añaden al path.
+import os
+import sys
+import urllib.parse
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tyba_downloader as td
+from tyba_mock_server import MockConfig, MockTyba
+
+RADICADO = "11001310300120230012300"
+
+@pytest.fixture(autouse=True, scope="session")
+def _debug_log(tmp_path_factory):
+    # debug_log.txt va a una carpeta temporal, no al directorio de trabajo
+    td.logger.configure(log_file=str(tmp_path_factory.mktemp("registro") / "debug_log.txt"))
+    yield
+    td.logger.close()
+
+@pytest.fixture
+def make_mock():
+    """Levanta servidores simulados sin latencia; se cierran al terminar la prueba."""
+    servers = []
+    def start(**options):
+        options = {"latencia": 0.0, "latencia_pdf": 0.0, **options}
+        mock = MockTyba(MockConfig(**options)).start()
+        servers.append(mock)
+        return mock
+    yield start
+    for mock in servers:
+        mock.close()
+
+def session_client(mock):
+    """HttpClient con una cookie de sesión ASP.NET válida para el servidor simulado."""
+    client = td.HttpClient("pytest")
+    host = urllib.parse.urlsplit(mock.url).hostname
+    client.set_cookies([{"name": "ASP.NET_SessionId", "value": "prueba", "domain": host, "path": "/"}])
+    return client
+
+def document_url(mock, doc_id):
+    return mock.url.rsplit("/", 1)[0] + f"/Descargando.aspx?idDocumento={doc_id}"
+
+def open_case(mock, radicado=RADICADO):
+    """Hace por HTTP lo que el navegador hace en _search_case y devuelve la PostbackSession del detalle."""
+    client = td.HttpClient("pytest")
+    response = client.request("GET", mock.url)
+    session = td.PostbackSession(client, mock.url, response.read().decode("utf-8"))
+    session.fields = [(k, radicado if k.endswith("txtCodigoProceso") else v) for k, v in session.fields]
+    session.submit("MainContent_btnConsultar")
+    session.submit("MainContent_grdProceso_imgbConsultarGrilla_0")
+    return session
+
+class _DetailPage:
+    """La página del navegador tras la búsqueda: el motor HTTP solo lee su URL y su HTML."""
+    def __init__(self, session):
+        self.url = session.url
+        self._html = session.html
+
+    def content(self):
+        return self._html
+
+class _CookieContext:
+    """Lo que el motor HTTP usa del BrowserContext: las cookies de la sesión ASP.NET."""
+    def __init__(self, client):
+        self._client = client
+
+    def cookies(self):
+        return list(self._client.cookies)
+
+def run_http_case(downloader, mock, radicado=RADICADO, skip_notifications=True):
+    """Descarga un expediente con el motor HTTP desde el detalle ya abierto, como _run_case tras la búsqueda."""
+    detail = open_case(mock, radicado)
+    state = downloader._new_case_state(radicado, skip_notifications)
+    with td.logger.case(radicado, state.case_dir), state.metrics.activate():
+        try:
+            downloader._process_case_http(_DetailPage(detail), _CookieContext(detail.http), state, skip_notifications)
+            state.completed = True
+        finally:
+            downloader._drain_pipeline(state)
+            downloader._save_doc_list(state)
+            state.http.close()
+            detail.http.close()
+    return state
@@ -0,0 +1,30 @@
+# Modo lote: lectura y validación de radicados antes de abrir el navegador.
+import tyba_downloader as td
+from conftest import RADICADO
+
+def test_read_radicados_skips_comments_and_blank_lines(tmp_path):
+    path = tmp_path / "radicados.txt"
+    path.write_text(f"# Juzgado 1\n{RADICADO}\n\n  05001400302220220045600  # urgente\n", encoding="utf-8")
+    assert td._read_radicados(str(path)) == [RADICADO, "05001400302220220045600"]
+
+def test_lote_rejects_invalid_radicados_before_launching_the_browser(tmp_path, capsys):
+    args = td._build_arg_parser().parse_args(["lote", "-o", str(tmp_path), RADICADO, "1100131030012023"])
+    assert td._run_cli(args) == 2
+    assert "'1100131030012023'" in capsys.readouterr().out
+    assert not (tmp_path / RADICADO).exists()
+
+def test_batch_without_valid_radicados_does_nothing(tmp_path):
+    downloader = td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0)
+    try:
+        assert downloader.download_batch(["123", "123", " "]) == [None]
+    finally:
+        downloader.close()
+
+def test_each_case_gets_its_own_state(tmp_path):
+    downloader = td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0)
+    first = downloader._new_case_state(RADICADO)
+    second = downloader._new_case_state("05001400302220220045600")
+    assert first.case_dir != second.case_dir
+    assert first.http is not second.http and first.documents is not second.documents
+    first.http.close()
+    second.http.close()
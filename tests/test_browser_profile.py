@@ -0,0 +1,67 @@
+# Perfiles del navegador (--perfil-navegador): qué recursos se descartan en cada preajuste.
+import pytest
+
+import tyba_downloader as td
+from conftest import RADICADO
+
+PORTAL = "procesojudicial.ramajudicial.gov.co"
+FORM = f"https://{PORTAL}/Justicia21/Administracion/Ciudadanos/frmConsulta.aspx"
+
+def test_visible_loads_everything():
+    profile = td.BrowserProfile("visible")
+    assert not profile.headless and profile.slow_mo
+    assert profile.allows("https://www.google-analytics.com/analytics.js", "script", PORTAL)
+    assert profile.allows(f"https://{PORTAL}/logo.png", "image", PORTAL)
+
+@pytest.mark.parametrize("url,resource_type,allowed", [
+    (f"https://{PORTAL}/logo.png", "image", False),
+    (f"https://{PORTAL}/Scripts/jquery.js", "script", True),
+    (f"https://{PORTAL}/Content/site.css", "stylesheet", True),
+    ("https://cdn.jsdelivr.net/npm/bootstrap.min.css", "stylesheet", True),
+    ("https://fonts.googleapis.com/css?family=Roboto", "xhr", False),
+    ("https://www.googletagmanager.com/gtm.js", "script", False),
+    ("https://archivos.ramajudicial.gov.co/doc.pdf", "fetch", True), # mismo sitio que el portal
+    # Lo que pide el CAPTCHA siempre pasa, aunque sea una imagen o venga de otro dominio
+    (f"https://{PORTAL}/Captcha.aspx?id=1", "image", True),
+    ("https://www.gstatic.com/recaptcha/api2/logo_48.png", "image", True),
+])
+def test_ligero_blocks_heavy_and_third_party_resources(url, resource_type, allowed):
+    assert td.BrowserProfile("ligero").allows(url, resource_type, PORTAL) is allowed
+
+def test_minimo_also_drops_stylesheets():
+    profile = td.BrowserProfile("minimo", slow_mo=50)
+    assert profile.slow_mo == 50
+    assert not profile.allows(f"https://{PORTAL}/Content/site.css", "stylesheet", PORTAL)
+    assert profile.allows(f"https://{PORTAL}/frmConsulta.aspx", "document", PORTAL)
+    with pytest.raises(ValueError):
+        td.BrowserProfile("rapido")
+
+class _Route:
+    def __init__(self, url, resource_type):
+        self.request = type("Request", (), {"url": url, "resource_type": resource_type})()
+        self.outcome = None
+
+    def continue_(self):
+        self.outcome = "continue"
+
+    def abort(self, reason):
+        self.outcome = reason
+
+class _Context:
+    def route(self, pattern, handler):
+        self.handler = handler
+
+def test_install_aborts_and_counts_blocked_requests():
+    context = _Context()
+    td.BrowserProfile("ligero").install(context, FORM)
+    metrics = td.CaseMetrics(RADICADO)
+    image, script = _Route(f"https://{PORTAL}/logo.png", "image"), _Route(f"https://{PORTAL}/app.js", "script")
+    with metrics.activate():
+        context.handler(image)
+        context.handler(script)
+    assert (image.outcome, script.outcome) == ("blockedbyclient", "continue")
+    assert metrics.counters == {"recursos_bloqueados": 1}
+    # Sin bloqueos no se instala ninguna ruta
+    untouched = _Context()
+    td.BrowserProfile("visible").install(untouched, FORM)
+    assert not hasattr(untouched, "handler")
@@ -0,0 +1,46 @@
+# Filtro de notificaciones en segundo plano (--filtro-paralelo), solo y junto al almacén (--almacen-unico).
+import os
+
+import pytest
+
+import tyba_downloader as td
+from conftest import run_http_case
+
+def _downloader(mock, tmp_path, **options):
+    return td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0, engine="http", pacing="agresivo",
+                             base_url=mock.url, **options)
+
+def _decisions(state):
+    return {key: record.decision for key, record in state.documents.records.items()}
+
+@pytest.fixture
+def mock(make_mock):
+    return make_mock(actuaciones=8, adjuntos=2, archivos=2, notificaciones=0.5, pdf_kb=2)
+
+def test_background_filter_matches_the_inline_filter(mock, tmp_path):
+    inline = _downloader(mock, tmp_path / "en_linea")
+    background = _downloader(mock, tmp_path / "segundo_plano", classify_workers=1)
+    try:
+        expected = _decisions(run_http_case(inline, mock))
+        state = run_http_case(background, mock)
+    finally:
+        inline.close()
+        background.close()
+    assert _decisions(state) == expected
+    assert "filtrado" in expected.values() and "conservado" in expected.values()
+    for (tab, name), decision in expected.items():
+        assert os.path.exists(os.path.join(state.case_dir, f"{name}.pdf")) == (decision == "conservado")
+
+def test_content_store_only_keeps_what_the_background_filter_kept(mock, tmp_path):
+    downloader = _downloader(mock, tmp_path, content_store=True, classify_workers=1)
+    try:
+        state = run_http_case(downloader, mock)
+    finally:
+        downloader.close()
+    kept = state.documents.kept()
+    assert kept and len(kept) < len(state.documents)
+    stored = {name[:-len(".pdf")] for _, _, names in os.walk(tmp_path / ".almacen") for name in names}
+    # Las notificaciones retiradas no dejan copia en .almacen
+    assert stored == {record.sha256 for record in kept}
+    for record in kept:
+        assert downloader.content_store.is_linked(os.path.join(state.case_dir, f"{record.name}.pdf"))
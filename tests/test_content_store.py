@@ -0,0 +1,39 @@
+# Almacén direccionado por contenido (--almacen-unico): un objeto por SHA-256 y enlaces con el nombre legible.
+import hashlib
+import os
+
+import tyba_downloader as td
+from conftest import run_http_case
+
+def _pdf(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+def test_same_content_is_stored_once_across_cases(tmp_path):
+    store = td.ContentStore(str(tmp_path / ".almacen"))
+    data = b"%PDF-1.4 mismo contenido"
+    digest = hashlib.sha256(data).hexdigest()
+    first = _pdf(tmp_path / "caso1" / "DEMANDA.pdf", data)
+    second = _pdf(tmp_path / "caso2" / "ANEXOS.pdf", data)
+    assert store.adopt(first, digest) == store.adopt(second, digest) == store.object_path(digest)
+    assert os.path.samefile(first, second) and store.is_linked(first)
+    # Volver a adoptar un archivo ya enlazado no cambia nada
+    assert store.adopt(first, digest) == store.object_path(digest)
+    assert [n for _, _, names in os.walk(tmp_path / ".almacen") for n in names] == [f"{digest}.pdf"]
+    assert (tmp_path / "caso2" / "ANEXOS.pdf").read_bytes() == data
+
+def test_duplicate_attachments_share_one_object(make_mock, tmp_path):
+    # Actuaciones con el mismo nombre traen adjuntos idénticos
+    mock = make_mock(actuaciones=8, adjuntos=2, archivos=2, notificaciones=0.5, pdf_kb=2)
+    downloader = td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0, engine="http", pacing="agresivo",
+                                   base_url=mock.url, content_store=True)
+    state = run_http_case(downloader, mock, skip_notifications=False)
+    kept = state.documents.kept()
+    digests = {r.sha256 for r in kept}
+    assert len(digests) < len(kept) and state.documents.duplicates()
+    stored = {n[:-len(".pdf")] for _, _, names in os.walk(tmp_path / ".almacen") for n in names}
+    assert stored == digests
+    for record in kept:
+        path = os.path.join(state.case_dir, f"{record.name}.pdf")
+        assert os.path.samefile(path, downloader.content_store.object_path(record.sha256))
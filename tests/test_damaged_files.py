@@ -0,0 +1,49 @@
+# Archivos dañados en disco: se detectan al volver a sincronizar, se descargan de nuevo y se anotan en el índice.
+import json
+import os
+
+import pytest
+
+import tyba_downloader as td
+from conftest import run_http_case
+
+@pytest.fixture
+def mock(make_mock):
+    return make_mock(actuaciones=4, adjuntos=1, archivos=2, notificaciones=0.0, pdf_kb=2)
+
+def _sync(mock, tmp_path, **options):
+    downloader = td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0, engine="http", pacing="agresivo",
+                                   base_url=mock.url, **options)
+    before = dict(mock.stats)
+    try:
+        state = run_http_case(downloader, mock)
+    finally:
+        downloader.close()
+    return state, {k: v - before.get(k, 0) for k, v in mock.stats.items()}
+
+def _truncate(path):
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) * 2 // 3)
+
+def test_truncated_files_are_downloaded_again(mock, tmp_path):
+    state, _ = _sync(mock, tmp_path)
+    damaged = [next(r.name for r in state.documents.kept() if r.tab == tab) for tab in ("actuacion", "archivo")]
+    for name in damaged:
+        _truncate(os.path.join(state.case_dir, f"{name}.pdf"))
+
+    again, second = _sync(mock, tmp_path, full_resync=True)
+    assert second["pdf"] == 2
+    assert again.metrics.counters["danados"] == 2
+    for name in damaged:
+        assert td.pdf_integrity_problem(os.path.join(again.case_dir, f"{name}.pdf")) is None
+    report = {d["nombre"]: d for d in again.documents.damaged_report()}
+    assert set(report) == set(damaged)
+    assert all(d["estado"] == "vuelto a descargar" and "truncado" in d["motivo"] for d in report.values())
+    with open(os.path.join(again.case_dir, "indice.json"), encoding="utf-8") as f:
+        assert {d["nombre"] for d in json.load(f)["danados"]} == set(damaged)
+
+def test_intact_files_are_not_downloaded_again(mock, tmp_path):
+    _sync(mock, tmp_path)
+    again, second = _sync(mock, tmp_path, full_resync=True)
+    assert second.get("pdf", 0) == 0
+    assert "danados" not in again.metrics.counters and again.documents.damaged_report() == []
@@ -0,0 +1,51 @@
+# Índice de documentos del expediente (indice.jsonl / indice.json) y sus huellas.
+import hashlib
+import json
+import threading
+
+import tyba_downloader as td
+
+def _journal(case_dir):
+    return [json.loads(line) for line in (case_dir / "indice.jsonl").read_text(encoding="utf-8").splitlines()]
+
+def test_rerun_keeps_the_journal_of_an_interrupted_run(tmp_path):
+    first = td.DocumentRegistry(str(tmp_path))
+    pdf = tmp_path / "Auto 1.pdf"
+    pdf.write_bytes(b"%PDF-1.4 contenido")
+    first.add("actuacion", "Auto 1", "2024-01-10", path=str(pdf))
+    first.close() # Proceso interrumpido: nunca llega a export()
+
+    second = td.DocumentRegistry(str(tmp_path))
+    # La huella de la ejecución interrumpida se reutiliza sin volver a leer el archivo
+    assert second._previous[("actuacion", "Auto 1")].sha256 == hashlib.sha256(pdf.read_bytes()).hexdigest()
+    second.add("archivo", "Demanda", "Sin fecha", size=10, digest="ab")
+    second.close()
+    assert [r["nombre"] for r in _journal(tmp_path)] == ["Auto 1", "Demanda"]
+
+def test_export_compacts_the_journal(tmp_path):
+    registry = td.DocumentRegistry(str(tmp_path))
+    registry.add("actuacion", "Auto 1", "2024-01-10", size=10, digest="aa", decision="pendiente")
+    registry.resolve("actuacion", "Auto 1", "conservado")
+    registry.add("actuacion", "Auto 2", "2024-01-11", size=10, digest="aa")
+    registry.export("11001310300120230012300")
+    assert [(r["nombre"], r["decision"]) for r in _journal(tmp_path)] == [("Auto 1", "conservado"), ("Auto 2", "conservado")]
+    assert [[r.name for r in group] for group in registry.duplicates()] == [["Auto 1", "Auto 2"]]
+
+    loaded = td.DocumentRegistry.load(str(tmp_path))
+    assert loaded.mark_filtered({"Auto 2"})
+    assert [r.name for r in loaded.kept()] == ["Auto 1"]
+
+def test_mark_filtered_runs_under_the_lock(tmp_path):
+    registry = td.DocumentRegistry(str(tmp_path))
+    for n in range(200):
+        registry.add("actuacion", f"Auto {n}", "Sin fecha", size=1, digest=str(n))
+    # Con el candado tomado por otro hilo, mark_filtered espera en lugar de recorrer el índice a medias
+    registry._lock.acquire()
+    worker = threading.Thread(target=registry.mark_filtered, args=({"Auto 3"},))
+    worker.start()
+    worker.join(0.2)
+    assert worker.is_alive() and registry.records[("actuacion", "Auto 3")].kept
+    registry._lock.release()
+    worker.join()
+    assert not registry.records[("actuacion", "Auto 3")].kept
+    registry.close()
@@ -0,0 +1,50 @@
+# De extremo a extremo con Chromium contra el servidor simulado. Se omite si no hay navegador instalado
+# (python -m playwright install chromium).
+import os
+
+import pytest
+
+import tyba_downloader as td
+from conftest import RADICADO
+from tyba_mock_server import ACTUACIONES_NOTIFICACION
+
+def _chromium_available():
+    try:
+        with td.sync_playwright() as p:
+            p.chromium.launch(headless=True).close()
+        return True
+    except Exception:
+        return False
+
+pytestmark = pytest.mark.skipif(not _chromium_available(), reason="Chromium de Playwright no disponible")
+
+@pytest.mark.parametrize("engine", ["sync", "http"])
+def test_download_case(make_mock, tmp_path, engine):
+    mock = make_mock(actuaciones=7, por_pagina=5, adjuntos=2, archivos=2, notificaciones=0.3, captcha=0.3)
+    downloader = td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0, engine=engine, pacing="agresivo",
+                                   base_url=mock.url, profile="ligero", slow_mo=False)
+    try:
+        state = downloader.download_case(RADICADO, skip_notifications=True)
+    finally:
+        downloader.close()
+
+    assert state.completed and not state.errors
+    case = mock.case(RADICADO)
+    notices = tuple(name for name, _ in ACTUACIONES_NOTIFICACION)
+    expected = {name for act in case.actuaciones for _, name in act["adjuntos"] if not act["nombre"].startswith(notices)}
+    expected |= {name for _, name in case.archivos}
+    kept = {os.path.splitext(f)[0] for f in os.listdir(state.case_dir) if f.endswith(".pdf")}
+    # Todo lo sustancial se conserva; las notificaciones las descarta el filtro
+    assert expected <= kept
+    for name in kept:
+        assert td.pdf_integrity_problem(os.path.join(state.case_dir, f"{name}.pdf")) is None
+
+    # Una segunda pasada no vuelve a abrir ninguna actuación (manifiesto)
+    details = mock.stats.get("detalles", 0)
+    downloader = td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0, engine=engine, pacing="agresivo",
+                                   base_url=mock.url, profile="ligero", slow_mo=False)
+    try:
+        assert downloader.download_case(RADICADO, skip_notifications=True).completed
+    finally:
+        downloader.close()
+    assert mock.stats.get("detalles", 0) == details
@@ -0,0 +1,37 @@
+# Caché de decisiones del filtro (FilterDecisionCache): por huella del PDF, nombre y versión de las reglas.
+import hashlib
+
+import pytest
+
+import tyba_downloader as td
+
+@pytest.fixture
+def cache(tmp_path):
+    db = td.FilterDecisionCache(str(tmp_path / "filtro.sqlite3"))
+    yield db
+    db.close()
+
+def test_decisions_are_scoped_by_ruleset(cache):
+    cache.put("abc", "OFICIO", True)
+    cache.put("abc", "OFICIO", False, ruleset="reglas-viejas")
+    assert cache.get("abc", "OFICIO") is True
+    assert cache.get("abc", "OTRO NOMBRE") is None
+    assert cache.invalidate() == 1
+    assert cache.get("abc", "OFICIO", ruleset="reglas-viejas") is None
+    assert cache.get("abc", "OFICIO") is True
+
+def test_digest_is_recomputed_only_when_the_file_changes(cache, tmp_path):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(b"%PDF-1.4 uno")
+    assert cache.digest_for(str(path)) == hashlib.sha256(b"%PDF-1.4 uno").hexdigest()
+    path.write_bytes(b"%PDF-1.4 dos, otro tamano")
+    assert cache.digest_for(str(path)) == hashlib.sha256(b"%PDF-1.4 dos, otro tamano").hexdigest()
+
+def test_cached_decision_skips_reading_the_pdf(cache, tmp_path):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(b"no es un PDF legible")
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()
+    # Sin caché, un PDF ilegible se juzga por el nombre (que aquí no indica nada)
+    assert td.classify_notification(str(path), "DOCUMENTO 1") is False
+    cache.put(digest, td._normalize_text("DOCUMENTO 1"), True)
+    assert td.classify_notification(str(path), "DOCUMENTO 1", cache=cache) is True
@@ -0,0 +1,50 @@
+# Vía rápida sin popup (GeneratorUrlTemplate): la URL de Descargando.aspx deducida del HTML de la fila.
+import tyba_downloader as td
+from conftest import run_http_case
+
+BASE = "https://tyba.example/Tyba/frmConsulta.aspx"
+
+def _row(doc_id, n):
+    return (f'<td><input type="image" id="MainContent_grdArchivosActuaciones_imgDescargaArchivos_{n}" />'
+            f'<input type="hidden" id="MainContent_grdArchivosActuaciones_hfIdDocumento_{n}" value="{doc_id}" /></td>')
+
+def _url(doc_id):
+    return f"https://tyba.example/Tyba/Descargando.aspx?idDocumento={doc_id}&tipo=pdf"
+
+def test_pattern_is_used_only_after_a_confirmed_prediction():
+    template = td.GeneratorUrlTemplate(BASE)
+    template.learn(_row("a1b2c3", 0), _url("a1b2c3"))
+    # Un solo ejemplo no basta: la predicción se comprueba contra el siguiente popup
+    assert template.guess(_row("d4e5f6", 1)) is None
+    assert template.guess(_row("d4e5f6", 1), require_confirmed=False) == _url("d4e5f6")
+    template.learn(_row("d4e5f6", 1), _url("d4e5f6"))
+    assert template.confirmed
+    assert template.guess(_row("0918ab", 2)) == _url("0918ab")
+
+def test_rejections_disable_the_fast_path():
+    template = td.GeneratorUrlTemplate(BASE)
+    for n, doc in enumerate(["a1b2c3", "d4e5f6"]):
+        template.learn(_row(doc, n), _url(doc))
+    template.reject()
+    assert template.guess(_row("0918ab", 2)) is None
+    template.learn(_row("0918ab", 2), _url("0918ab"))
+    assert template.confirmed
+    template.reject()
+    assert template.params is None and template.guess(_row("77aa88", 3), require_confirmed=False) is None
+
+def test_url_in_the_button_is_used_directly():
+    template = td.GeneratorUrlTemplate(BASE)
+    row = """<input type="image" onclick="window.open('Descargando.aspx?idDocumento=99&amp;tipo=pdf'); return false;" />"""
+    assert template.guess(row) == "https://tyba.example/Tyba/Descargando.aspx?idDocumento=99&tipo=pdf"
+
+def test_http_engine_skips_most_popups(make_mock, tmp_path):
+    popups = {}
+    for id_en_fila in (True, False):
+        mock = make_mock(actuaciones=4, adjuntos=3, archivos=0, pdf_kb=2, id_en_fila=id_en_fila)
+        downloader = td.TybaDownloader(output_base_dir=str(tmp_path / str(id_en_fila)), session_ttl=0, engine="http",
+                                       pacing="agresivo", base_url=mock.url)
+        state = run_http_case(downloader, mock, skip_notifications=False)
+        assert len(state.documents.kept()) == 12
+        popups[id_en_fila] = mock.stats["popups"]
+    # Con el id en la fila bastan dos popups para aprender y confirmar el patrón
+    assert popups == {True: 2, False: 12}
@@ -0,0 +1,27 @@
+# Lectura de grillas en una sola pasada: columnas por cabecera y filas con botón de acción.
+import tyba_downloader as td
+from conftest import open_case
+
+def test_grid_columns_follow_the_header():
+    # "Fecha Actuación" es la fecha; la descripción es la última columna de actuación, no la de registro
+    assert td.grid_columns(["", "Fecha Actuación", "Actuación", "Fecha Registro"]) == (1, 2)
+    assert td.grid_columns([" descripción "]) == (-1, 0)
+    assert td.grid_columns(["", "Nombre"]) == (-1, -1)
+
+def test_grid_row_reads_its_cells():
+    record = {"index": 3, "button_id": "btn_3", "cells": ["", " 2024-01-10 ", "AUTO ", "2024-01-11"],
+              "text": "", "html": "<tr></tr>", "visible": True}
+    row = td.GridRow(record, 1, 2)
+    assert (row.index, row.date, row.description) == (3, "2024-01-10", "AUTO")
+    assert td.GridRow(record, -1, 9).date is None and td.GridRow(record, -1, 9).description is None
+
+def test_actuaciones_grid_from_the_detail_page(make_mock):
+    mock = make_mock(actuaciones=4, adjuntos=1, archivos=1, notificaciones=0.0)
+    detail = open_case(mock)
+    rows = td.parse_grid_html(detail.html, "MainContent_grdActuaciones", "grdActuaciones_imgbConsultarGrilla")
+    assert [r.index for r in rows] == list(range(len(rows))) and rows
+    for row in rows:
+        assert row.button_id.endswith(f"_{row.index}") and row.visible
+        assert row.date and row.description and row.description in row.text
+    archivos = td.parse_grid_html(detail.html, "MainContent_grdArchivos", "grdArchivos_imgbConsultarGrillaArchivos")
+    assert archivos and all(r.date is None and r.description for r in archivos)
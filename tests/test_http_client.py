@@ -0,0 +1,102 @@
+# HttpClient y pdf_integrity_problem contra el servidor simulado.
+import hashlib
+
+import pytest
+
+import tyba_downloader as td
+from conftest import RADICADO, document_url, session_client
+from tyba_mock_server import make_pdf
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+@pytest.fixture
+def document(make_mock):
+    mock = make_mock(pdf_kb=20)
+    doc_id, _ = mock.case(RADICADO).archivos[0]
+    return mock, document_url(mock, doc_id), make_pdf(mock.document(doc_id), 20)
+
+def test_download_writes_the_exact_body(document, tmp_path):
+    mock, url, expected = document
+    path = str(tmp_path / "doc.pdf")
+    size, digest, kept = session_client(mock).download(url, path, require_pdf=True)
+    assert (size, digest, kept) == (len(expected), hashlib.sha256(expected).hexdigest(), True)
+    assert _read(path) == expected
+    assert list(tmp_path.iterdir()) == [tmp_path / "doc.pdf"]
+
+def test_rejected_document_is_not_written(document, tmp_path):
+    mock, url, expected = document
+    seen = []
+    def accept(body, digest):
+        seen.append((body, digest))
+        return False
+    path = str(tmp_path / "doc.pdf")
+    size, digest, kept = session_client(mock).download(url, path, accept=accept)
+    assert not kept and seen == [(expected, digest)]
+    assert list(tmp_path.iterdir()) == []
+
+def test_generator_errors(make_mock, tmp_path):
+    mock = make_mock(fallos=1.0)
+    doc_id, _ = mock.case(RADICADO).archivos[0]
+    client = session_client(mock)
+    with pytest.raises(td.HttpStatusError) as error:
+        client.download(document_url(mock, doc_id), str(tmp_path / "a.pdf"))
+    assert error.value.status == 500
+    with pytest.raises(td.HttpStatusError) as error:
+        client.download(document_url(mock, "inexistente"), str(tmp_path / "b.pdf"))
+    assert error.value.status == 404
+    assert td.RetryPolicy.classify(error.value) == td.RetryPolicy.PERMANENT
+    assert list(tmp_path.iterdir()) == []
+
+def test_missing_session_is_detected(document, tmp_path):
+    mock, url, _ = document
+    # Sin cookie el generador responde 200 con el aviso de sesión vencida, no con un PDF
+    with pytest.raises(td.SessionExpired):
+        td.HttpClient().download(url, str(tmp_path / "doc.pdf"))
+
+def test_cookies_and_keep_alive(make_mock):
+    mock = make_mock()
+    client = td.HttpClient()
+    client.request("GET", mock.url).read()
+    assert [c["name"] for c in client.cookies] == ["ASP.NET_SessionId"]
+    conn = next(iter(client._local.pool.values()))
+    client.request("GET", mock.url).read()
+    # La cookie se reenvía (el servidor no da otra) y la conexión se reutiliza
+    assert len(client.cookies) == 1
+    assert list(client._local.pool.values()) == [conn]
+
+def test_pdf_integrity_problem(tmp_path):
+    pdf = make_pdf(["PRUEBA"], 5)
+    assert td.pdf_integrity_problem(_write(tmp_path / "ok.pdf", pdf)) is None
+    assert td.pdf_integrity_problem(_write(tmp_path / "ok_deep.pdf", pdf), deep=True) is None
+    # Algo de basura tras %%EOF se tolera
+    assert td.pdf_integrity_problem(_write(tmp_path / "cola.pdf", pdf + b"\r\n\0\0")) is None
+    assert "truncado" in td.pdf_integrity_problem(_write(tmp_path / "cortado.pdf", pdf[:len(pdf) * 2 // 3]))
+    html = b"<html><body>" + b"Error generando el documento. " * 100 + b"</body></html>"
+    assert td.pdf_integrity_problem(_write(tmp_path / "html.pdf", html)) == "página HTML guardada como PDF"
+    assert td.pdf_integrity_problem(_write(tmp_path / "binario.pdf", b"\x00" * 5000)) == "sin cabecera %PDF-"
+    assert "demasiado pequeño" in td.pdf_integrity_problem(_write(tmp_path / "chico.pdf", pdf[:500]))
+    assert "no se pudo leer" in td.pdf_integrity_problem(str(tmp_path / "no_existe.pdf"))
+
+def test_failed_download_keeps_the_previous_file(make_mock, tmp_path):
+    mock = make_mock(fallos=1.0)
+    doc_id, _ = mock.case(RADICADO).archivos[0]
+    previous = make_pdf(["VERSION ANTERIOR"], 5)
+    path = _write(tmp_path / "doc.pdf", previous)
+    with pytest.raises(td.HttpStatusError):
+        session_client(mock).download(document_url(mock, doc_id), path)
+    # El destino solo se reemplaza con un cuerpo completo: el anterior sigue intacto
+    assert _read(path) == previous
+    assert list(tmp_path.iterdir()) == [tmp_path / "doc.pdf"]
+
+def test_atomic_write_replaces_without_leftovers(tmp_path):
+    path = _write(tmp_path / "indice.json", b"viejo")
+    td._atomic_write(path, b"nuevo")
+    assert _read(path) == b"nuevo"
+    assert list(tmp_path.iterdir()) == [tmp_path / "indice.json"]
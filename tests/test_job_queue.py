@@ -0,0 +1,68 @@
+# Cola persistente del servicio (JobQueue) y su API HTTP local.
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import tyba_downloader as td
+from conftest import RADICADO
+
+OTRO = "11001310300120230045600"
+
+@pytest.fixture
+def jobs(tmp_path):
+    queue = td.JobQueue(str(tmp_path / "cola.sqlite3"), max_attempts=2)
+    yield queue
+    queue.close()
+
+@pytest.fixture
+def api(jobs):
+    """La API del servicio en un puerto libre, sin navegador ni hilos de descarga."""
+    daemon = td.DownloadDaemon(None, jobs, port=0)
+    server = daemon._start_api()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def _post(url, data):
+    request = urllib.request.Request(url + "/trabajos", data=json.dumps(data).encode("utf-8"), method="POST",
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def test_submit_reuses_the_active_job(jobs):
+    first, new = jobs.submit(RADICADO)
+    again, new_again = jobs.submit(RADICADO, priority=5)
+    assert new and not new_again and again == first
+    assert jobs.get(first)["priority"] == 5
+    with pytest.raises(ValueError):
+        jobs.submit("123")
+
+def test_claim_by_priority_and_retry_with_backoff(jobs):
+    low, _ = jobs.submit(RADICADO)
+    high, _ = jobs.submit(OTRO, priority=3)
+    job = jobs.claim("w1")
+    assert job["id"] == high and job["state"] == "en_curso"
+    assert jobs.finish(high, ok=False, error="caída") == "pendiente"
+    # El reintento espera su turno: mientras tanto sale el otro trabajo
+    assert jobs.claim("w1")["id"] == low
+    assert jobs.claim("w1") is None
+    assert jobs.finish(low, ok=True) == "completo"
+
+def test_api_rejects_the_whole_list_when_one_radicado_is_invalid(api, jobs):
+    status, body = _post(api, {"radicados": [RADICADO, "123"]})
+    assert status == 400 and body["invalidos"] == ["123"]
+    assert jobs.counts() == {}
+
+    status, body = _post(api, {"radicados": [RADICADO, 7]})
+    assert status == 400 and jobs.counts() == {}
+
+def test_api_enqueues_valid_lists(api, jobs):
+    status, body = _post(api, {"radicados": [RADICADO, OTRO], "prioridad": 2})
+    assert status == 202
+    assert [job["radicado"] for job in body["trabajos"]] == [RADICADO, OTRO]
+    assert jobs.counts() == {"pendiente": 2}
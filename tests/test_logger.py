@@ -0,0 +1,46 @@
+# Registro de depuración: formateo diferido y contexto del expediente en los hilos del motor paralelo.
+import json
+import logging
+
+import tyba_downloader as td
+from conftest import RADICADO
+
+class _Costly:
+    """Argumento de registro que cuenta cuántas veces se convierte a texto."""
+    def __init__(self):
+        self.calls = 0
+
+    def __str__(self):
+        self.calls += 1
+        return "costoso"
+
+def test_disabled_level_is_not_formatted():
+    disabled, enabled = _Costly(), _Costly()
+    td.logger.configure(level="INFO")
+    try:
+        td.logger.log("Fragmento %s", disabled)
+        td.logger.log("Fragmento %s", enabled, level=logging.INFO)
+    finally:
+        td.logger.configure(level="DEBUG")
+        td.logger.close()
+    assert disabled.calls == 0 and enabled.calls >= 1
+
+class _LoggingClient:
+    def download(self, url, path, timeout=120, accept=None, require_pdf=False):
+        td.logger.log("Descarga en el pool: %s", url)
+        return 1, url, True
+
+def test_engine_threads_log_with_the_case_context(tmp_path):
+    engine = td.ParallelAttachmentEngine(max_parallel=2).start()
+    try:
+        with td.logger.case(RADICADO, str(tmp_path)):
+            td.logger.phase("adjuntos")
+            engine.submit(_LoggingClient(), "u1", "p1").result()
+    finally:
+        engine.close()
+        td.logger.close()
+    records = [json.loads(line) for line in (tmp_path / "registro.jsonl").read_text(encoding="utf-8").splitlines()]
+    pool = [r for r in records if r["msg"] == "Descarga en el pool: u1"]
+    assert len(pool) == 1
+    assert pool[0]["radicado"] == RADICADO and pool[0]["fase"] == "adjuntos"
+    assert pool[0]["hilo"].startswith("tyba-dl")
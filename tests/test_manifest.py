@@ -0,0 +1,49 @@
+# Manifiesto incremental (.manifiesto.json): una segunda sincronización no vuelve a abrir lo que no cambió.
+import os
+
+import pytest
+
+import tyba_downloader as td
+from conftest import run_http_case
+
+@pytest.fixture
+def mock(make_mock):
+    return make_mock(actuaciones=6, adjuntos=2, archivos=1, notificaciones=0.5, pdf_kb=2)
+
+def _sync(mock, tmp_path, skip=True, **options):
+    downloader = td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0, engine="http", pacing="agresivo",
+                                   base_url=mock.url, **options)
+    before = dict(mock.stats)
+    state = run_http_case(downloader, mock, skip_notifications=skip)
+    assert state.completed
+    return state, {k: v - before.get(k, 0) for k, v in mock.stats.items()}
+
+def test_second_sync_skips_unchanged_actuaciones(mock, tmp_path):
+    state, first = _sync(mock, tmp_path)
+    assert first["detalles"] == 6
+    again, second = _sync(mock, tmp_path)
+    assert second.get("detalles", 0) == 0
+    assert second.get("pdf", 0) == 0
+    # Las actuaciones omitidas siguen en el índice con lo que decidió la pasada anterior
+    assert {k: r.decision for k, r in again.documents.records.items()} == \
+           {k: r.decision for k, r in state.documents.records.items()}
+
+def test_missing_file_reopens_its_actuacion(mock, tmp_path):
+    state, _ = _sync(mock, tmp_path)
+    lost = next(r for r in state.documents.kept() if r.tab == "actuacion")
+    os.remove(os.path.join(state.case_dir, f"{lost.name}.pdf"))
+    _, second = _sync(mock, tmp_path)
+    assert second["detalles"] == 1 and second["pdf"] == 1
+    assert os.path.exists(os.path.join(state.case_dir, f"{lost.name}.pdf"))
+
+def test_full_resync_and_unfiltered_runs_reopen_actuaciones(mock, tmp_path):
+    state, _ = _sync(mock, tmp_path)
+    filtered = [r for r in state.documents.records.values() if r.decision == "filtrado"]
+    assert filtered
+    # Con --completo se abren todas; solo se descarga de nuevo lo que el filtro había descartado
+    _, full = _sync(mock, tmp_path, full_resync=True)
+    assert full["detalles"] == 6 and full["pdf"] == len(filtered)
+    # Sin filtro hay que abrir las actuaciones con notificaciones descartadas, y solo esas
+    _, unfiltered = _sync(mock, tmp_path, skip=False)
+    assert unfiltered["detalles"] == len(filtered) // 2 # dos adjuntos por actuación
+    assert unfiltered["pdf"] == len(filtered)
@@ -0,0 +1,65 @@
+# Métricas del expediente (CaseMetrics): fases, contadores, informe y volcado para Prometheus.
+import os
+
+import tyba_downloader as td
+from conftest import RADICADO, run_http_case
+
+def test_spans_counters_and_report():
+    metrics = td.CaseMetrics(RADICADO)
+    assert td.CaseMetrics.current() is None
+    with metrics.activate():
+        assert td.CaseMetrics.current() is metrics
+        with metrics.span("captcha"):
+            pass
+        metrics.add_time("captcha", 2.0)
+        metrics.incr("reintentos")
+        metrics.incr("reintentos", 2)
+        for n, seconds in enumerate([0.1, 0.3, 0.2]):
+            metrics.file_done(f"Auto {n}.pdf", seconds, 100, "kept")
+    assert td.CaseMetrics.current() is None
+    metrics.finish()
+    report = metrics.report()
+    assert report["fases"]["captcha"]["n"] == 2 and report["fases"]["captcha"]["max_s"] == 2.0
+    assert report["contadores"] == {"bytes": 300, "reintentos": 3}
+    assert report["latencia_archivo_s"] == {"p50": 0.2, "p95": 0.3, "max": 0.3}
+    assert "completo" not in report
+
+def test_phases_are_closed_when_the_next_one_starts():
+    metrics = td.CaseMetrics(RADICADO)
+    metrics.phase("busqueda")
+    metrics.phase("actuaciones")
+    metrics.finish()
+    assert set(metrics.report()["fases"]) == {"fase_busqueda", "fase_actuaciones"}
+
+def test_prometheus_textfile(tmp_path):
+    metrics = td.CaseMetrics(RADICADO)
+    metrics.add_time("detalle", 1.5)
+    metrics.incr("descargados", 4)
+    metrics.finish()
+    state = td.CaseState(RADICADO, str(tmp_path))
+    state.completed = True
+    path = tmp_path / "tyba.prom"
+    td.write_prometheus_textfile(str(path), [metrics.report(state)])
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert f'tyba_case_completed{{radicado="{RADICADO}"}} 1' in lines
+    assert f'tyba_phase_seconds_total{{radicado="{RADICADO}",fase="detalle"}} 1.5' in lines
+    assert f'tyba_events_total{{radicado="{RADICADO}",evento="descargados"}} 4' in lines
+    assert "# TYPE tyba_phase_count_total counter" in lines
+    assert not [name for name in os.listdir(tmp_path) if name != "tyba.prom"]
+
+def test_http_case_is_instrumented(make_mock, tmp_path):
+    mock = make_mock(actuaciones=8, adjuntos=2, archivos=2, notificaciones=0.5, pdf_kb=2)
+    downloader = td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0, engine="http", pacing="agresivo",
+                                   base_url=mock.url)
+    try:
+        state = run_http_case(downloader, mock)
+    finally:
+        downloader.close()
+    state.metrics.finish()
+    report = state.metrics.report(state)
+    assert report["completo"] and report["errores"] == 0
+    assert {"fase_actuaciones", "fase_archivos", "detalle", "descarga", "filtro"} <= set(report["fases"])
+    assert report["fases"]["detalle"]["n"] == mock.stats["detalles"]
+    assert len(report["archivos"]) == mock.stats["pdf"]
+    assert report["contadores"]["bytes"] == sum(f["bytes"] for f in report["archivos"])
+    assert {f["resultado"] for f in report["archivos"]} == {"kept", "filtered"}
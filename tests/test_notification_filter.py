@@ -0,0 +1,42 @@
+# Filtro de notificaciones antes de escribir en disco y filtro previo por nombre (--filtro-por-nombre).
+import pytest
+
+import tyba_downloader as td
+from conftest import RADICADO, run_http_case
+from tyba_mock_server import make_pdf
+
+def test_gate_decides_on_the_bytes(tmp_path):
+    downloader = td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0, filter_cache=False)
+    state = downloader._new_case_state(RADICADO, skip_notifications=True)
+    accept = downloader._notification_gate(state, "NOTIFICACION PERSONAL 3-1")
+    notice = make_pdf(["NOTIFICACION PERSONAL. POR MEDIO DEL PRESENTE SE HACE SABER", f"RADICADO {RADICADO}"])
+    ruling = make_pdf(["AUTO INTERLOCUTORIO. RESUELVE: ADMITIR LA DEMANDA", f"RADICADO {RADICADO}"])
+    assert accept(notice, None) is False
+    assert downloader._notification_gate(state, "AUTO ADMITE DEMANDA 1-1")(ruling, None) is True
+    # Sin filtro no hay decisión previa
+    assert downloader._notification_gate(state, "NOTIFICACION PERSONAL 3-1", skip_notifications=False) is None
+    state.http.close()
+
+@pytest.mark.parametrize("name, expected", [
+    ("NOTIFICACION PERSONAL 3-1", True),
+    ("CITACION PARA NOTIFICACION 8-2", True),
+    ("AUTO NOTIFICADO POR ESTADO", False), # Palabra protegida: se decide por el contenido
+    ("SENTENCIA 4-1", False),
+])
+def test_name_prefilter(tmp_path, name, expected):
+    downloader = td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0, filter_cache=False)
+    assert downloader._is_notification_by_name(name) is expected
+
+def test_prefilter_skips_downloads_without_changing_what_is_kept(make_mock, tmp_path):
+    mock = make_mock(actuaciones=8, adjuntos=2, archivos=2, notificaciones=0.5, pdf_kb=2)
+    runs = {}
+    for prefilter in (False, True):
+        downloader = td.TybaDownloader(output_base_dir=str(tmp_path / str(prefilter)), session_ttl=0, engine="http",
+                                       pacing="agresivo", base_url=mock.url, name_prefilter=prefilter)
+        before = mock.stats.get("pdf", 0)
+        state = run_http_case(downloader, mock)
+        runs[prefilter] = (state, mock.stats["pdf"] - before)
+    (plain, plain_pdf), (fast, fast_pdf) = runs[False], runs[True]
+    by_name = [r for r in fast.documents.records.values() if r.decision == "filtrado_por_nombre"]
+    assert by_name and fast_pdf == plain_pdf - len(by_name)
+    assert {r.name for r in fast.documents.kept()} == {r.name for r in plain.documents.kept()}
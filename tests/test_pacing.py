@@ -0,0 +1,46 @@
+# Ritmo adaptativo (PacingController): frena ante señales de saturación, acelera con éxitos y recuerda el nivel.
+import pytest
+
+import tyba_downloader as td
+
+def test_backoff_on_saturation_and_relax_after_successes():
+    pacing = td.PacingController(preset="normal")
+    assert pacing.level == pytest.approx(0.3)
+    pacing.observe_error(td.CaptchaMismatch("no coincide"))
+    pacing.observe_error(td.HttpStatusError("bloqueado", status=429))
+    assert pacing.level == pytest.approx(1.2) and pacing.penalties == 2
+    # Un 404 o un 500 no dicen nada del ritmo
+    pacing.observe_error(td.HttpStatusError("no existe", status=404))
+    pacing.observe_error(td.HttpStatusError("caído", status=500))
+    assert pacing.penalties == 2
+    for _ in range(td.PacingController._RELAX_AFTER):
+        pacing.success()
+    assert pacing.level == pytest.approx(1.2 * td.PacingController._RELAX_FACTOR)
+
+def test_level_stays_within_the_preset_bounds():
+    pacing = td.PacingController(preset="agresivo")
+    for _ in range(10):
+        pacing.penalize("prueba")
+    assert pacing.level == pacing.max_level
+    for _ in range(200):
+        pacing.success()
+    assert pacing.level == pacing.min_level
+
+def test_learned_level_is_reused_for_the_same_hour(tmp_path):
+    path = str(tmp_path / ".ritmo.json")
+    first = td.PacingController(path, preset="normal")
+    first.penalize("timeout") # se guarda al frenar
+    second = td.PacingController(path, preset="normal")
+    # Se parte algo por debajo de lo tolerado para seguir buscando el límite
+    assert second.level == pytest.approx(first.level * td.PacingController._RELAX_FACTOR)
+
+def test_pauses_scale_with_the_level(monkeypatch):
+    slept = []
+    monkeypatch.setattr(td.time, "sleep", slept.append)
+    pacing = td.PacingController(preset="prudente")
+    pacing.pause("pagina")
+    pacing.level = 0.5
+    pacing.pause("pagina")
+    assert slept == [pytest.approx(2.0), pytest.approx(1.0)]
+    with pytest.raises(ValueError):
+        td.PacingController(preset="turbo")
@@ -0,0 +1,51 @@
+# Motor de descargas en paralelo (--motor async): límite por expediente y descargas contra el servidor simulado.
+import threading
+import time
+
+import tyba_downloader as td
+from conftest import RADICADO, document_url, session_client
+from tyba_mock_server import make_pdf
+
+class _SlowClient:
+    """Cliente de un expediente que solo mide cuántas descargas tiene a la vez."""
+    def __init__(self):
+        self.active = self.peak = 0
+        self._lock = threading.Lock()
+
+    def download(self, url, path, timeout=120, accept=None, require_pdf=False):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.05)
+        with self._lock:
+            self.active -= 1
+        return 1, url, True
+
+def test_parallel_limit_is_per_case():
+    engine = td.ParallelAttachmentEngine(max_parallel=2).start()
+    try:
+        first, second = _SlowClient(), _SlowClient()
+        futures = [engine.submit(client, f"u{n}", f"p{n}") for n in range(6) for client in (first, second)]
+        assert sorted(f.result()[1] for f in futures) == sorted(f"u{n}" for n in range(6) for _ in range(2))
+    finally:
+        engine.close()
+    # Cada expediente respeta su límite, y los dos avanzan a la vez
+    assert first.peak == second.peak == 2
+
+def test_downloads_through_the_case_client(make_mock, tmp_path):
+    mock = make_mock(actuaciones=3, adjuntos=2, pdf_kb=20)
+    case = mock.case(RADICADO)
+    docs = [doc for act in case.actuaciones for doc in act["adjuntos"]]
+    client = session_client(mock)
+    engine = td.ParallelAttachmentEngine(max_parallel=3).start()
+    try:
+        futures = {engine.submit(client, document_url(mock, doc_id), str(tmp_path / f"{name}.pdf"), require_pdf=True): (doc_id, name)
+                   for doc_id, name in docs}
+        for future, (doc_id, name) in futures.items():
+            size, _, kept = future.result()
+            expected = make_pdf(mock.document(doc_id), 20)
+            assert kept and size == len(expected)
+            assert (tmp_path / f"{name}.pdf").read_bytes() == expected
+    finally:
+        engine.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(f"{name}.pdf" for _, name in docs)
@@ -0,0 +1,116 @@
+# Motor HTTP (PostbackSession, _GridParser, _FormParser) contra las páginas del servidor simulado.
+import pytest
+
+import tyba_downloader as td
+from conftest import RADICADO, open_case
+from tyba_mock_server import make_pdf
+
+ACTUACIONES = "MainContent_grdActuaciones"
+
+def _actuaciones(session):
+    return session.grid(ACTUACIONES, "grdActuaciones_imgbConsultarGrilla")
+
+def test_search_reaches_case_detail(make_mock):
+    mock = make_mock(actuaciones=4)
+    session = open_case(mock)
+    assert session.has_element(ACTUACIONES)
+    case = mock.case(RADICADO)
+    rows = _actuaciones(session)
+    assert [(r.date, r.description) for r in rows] == [(a["fecha"], a["nombre"]) for a in case.actuaciones]
+    assert all(r.visible and r.button_id.startswith("MainContent_grdActuaciones_imgbConsultarGrilla_") for r in rows)
+
+def test_actuaciones_pagination(make_mock):
+    mock = make_mock(actuaciones=13, por_pagina=5)
+    session = open_case(mock)
+    names, page_num = [], 1
+    while True:
+        names += [r.description for r in _actuaciones(session)]
+        target = session.pager_target(ACTUACIONES, page_num + 1)
+        if target is None: break
+        session.postback(*target)
+        page_num += 1
+    assert page_num == 3
+    assert names == [a["nombre"] for a in mock.case(RADICADO).actuaciones]
+    # La fila de paginación (tabla anidada) no se confunde con una actuación
+    assert len(_actuaciones(session)) == 3
+
+@pytest.mark.parametrize("id_en_fila", [True, False])
+def test_attachment_popup_gives_generator_url(make_mock, id_en_fila):
+    mock = make_mock(actuaciones=3, adjuntos=3, id_en_fila=id_en_fila)
+    session = open_case(mock)
+    act = mock.case(RADICADO).actuaciones[1]
+    session.submit(_actuaciones(session)[1].button_id)
+    assert session.has_element("MainContent_btnRegresarActuacion")
+
+    files = session.grid("MainContent_grdArchivosActuaciones", "grdArchivosActuaciones_imgDescargaArchivos")
+    assert [f.text.strip() for f in files] == [name for _, name in act["adjuntos"]]
+    for f_row, (doc_id, _) in zip(files, act["adjuntos"]):
+        url = session.attachment_url(f_row.button_id)
+        assert url.endswith(f"Descargando.aspx?idDocumento={doc_id}")
+
+    session.submit("MainContent_btnRegresarActuacion")
+    assert len(_actuaciones(session)) == 3
+
+def test_archivo_url_from_viewer(make_mock):
+    mock = make_mock(actuaciones=2, archivos=3)
+    session = open_case(mock)
+    rows = session.grid("MainContent_grdArchivos", "grdArchivos_imgbConsultarGrillaArchivos")
+    archivos = mock.case(RADICADO).archivos
+    assert [r.text.split("\n")[0].strip() for r in rows] == [name for _, name in archivos]
+    for row, (doc_id, _) in zip(rows, archivos):
+        url = session.archivo_url(row.button_id)
+        assert url == mock.url.rsplit("/", 1)[0] + f"/Documento.aspx?idDocumento={doc_id}"
+        session.submit("MainContent_imbCerrarVistaPDF")
+
+def test_downloads_through_the_session_cookies(make_mock, tmp_path):
+    mock = make_mock(actuaciones=1, archivos=1, pdf_kb=10)
+    session = open_case(mock)
+    doc_id, _ = mock.case(RADICADO).archivos[0]
+    url = session.archivo_url("MainContent_grdArchivos_imgbConsultarGrillaArchivos_0")
+    path = str(tmp_path / "demanda.pdf")
+    size, _, kept = session.http.download(url, path, require_pdf=True)
+    assert kept and size == len(make_pdf(mock.document(doc_id), 10))
+
+def test_unknown_pages_are_unsupported(make_mock):
+    mock = make_mock(actuaciones=1)
+    with pytest.raises(td.PostbackUnsupported):
+        td.PostbackSession(td.HttpClient(), mock.url, "<html><body>Mantenimiento</body></html>")
+    session = open_case(mock)
+    with pytest.raises(td.PostbackUnsupported):
+        session.submit("MainContent_botonInexistente")
+    with pytest.raises(td.SessionExpired):
+        td.PostbackSession(td.HttpClient(), mock.url, "<html><body>Su sesi&oacute;n ha expirado</body></html>")
+
+def test_form_parser_collects_what_the_browser_would_send():
+    parser = td._FormParser()
+    parser.feed('''<form action="./frmConsulta.aspx">
+        <input type="hidden" name="__VIEWSTATE" value="abc" />
+        <input type="text" name="txt" value="x" />
+        <input type="checkbox" name="marcado" checked />
+        <input type="checkbox" name="sin_marcar" />
+        <select name="lista"><option value="1">uno</option><option value="2" selected>dos</option></select>
+        <select name="vacia"><option value="a">a</option></select>
+        <textarea name="nota">hola</textarea>
+        <input type="image" name="ctl00$btn" id="MainContent_btn" />
+        <input type="submit" name="ctl00$enviar" value="Consultar" id="MainContent_enviar" />
+        <input type="file" name="archivo" />
+    </form>''')
+    parser.close()
+    assert parser.action == "./frmConsulta.aspx"
+    assert parser.fields == [("__VIEWSTATE", "abc"), ("txt", "x"), ("marcado", "on"), ("lista", "2"),
+                             ("vacia", "a"), ("nota", "hola")]
+    assert parser.buttons == {"MainContent_btn": ("ctl00$btn", "image", ""),
+                              "MainContent_enviar": ("ctl00$enviar", "submit", "Consultar")}
+
+def test_grid_parser_rows_text_and_visibility():
+    html = ('<table id="MainContent_grdArchivos"><tr><th></th><th>Descripción</th></tr>'
+            '<tr><td><input type="image" id="MainContent_grdArchivos_imgbConsultarGrillaArchivos_0" /></td>'
+            '<td>DEMANDA<br/>Folios: 1</td></tr>'
+            '<tr><td><input type="image" id="MainContent_grdArchivos_imgbConsultarGrillaArchivos_1" style="display: none" /></td>'
+            '<td>PODER</td></tr></table>')
+    rows = td.parse_grid_html(html, "MainContent_grdArchivos", "grdArchivos_imgbConsultarGrillaArchivos")
+    assert [r.index for r in rows] == [0, 1]
+    assert rows[0].text.split("\t")[1] == "DEMANDA\nFolios: 1"
+    assert rows[0].description == "DEMANDAFolios: 1"
+    assert [r.visible for r in rows] == [True, False]
+    assert rows[1].html.startswith("<tr>") and rows[1].html.endswith("</tr>")
@@ -0,0 +1,36 @@
+# Reclasificación fuera de línea (reclasificar): el filtro sobre expedientes ya descargados.
+import json
+import os
+
+import tyba_downloader as td
+from conftest import run_http_case
+
+def test_reclassify_quarantines_notifications_and_updates_the_case(make_mock, tmp_path):
+    mock = make_mock(actuaciones=8, adjuntos=2, archivos=2, notificaciones=0.5, pdf_kb=2)
+    downloader = td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0, engine="http", pacing="agresivo",
+                                   base_url=mock.url)
+    # Descarga sin filtro: las notificaciones quedan en disco
+    state = run_http_case(downloader, mock, skip_notifications=False)
+    case_dir = state.case_dir
+    notices = {name for _, name in state.documents.records if "NOTIFICACION" in name or "FIJACION" in name}
+
+    simulated = td.reclassify_expedientes(str(tmp_path), "simular", workers=1)
+    assert set(simulated[case_dir]) == notices
+    assert all(os.path.exists(os.path.join(case_dir, f"{n}.pdf")) for n in notices)
+
+    td.reclassify_expedientes(str(tmp_path), "cuarentena", workers=1)
+    quarantine = tmp_path / ".cuarentena" / os.path.basename(case_dir)
+    assert {p.stem for p in quarantine.iterdir()} == notices
+    assert not any(os.path.exists(os.path.join(case_dir, f"{n}.pdf")) for n in notices)
+
+    listed = (tmp_path / os.path.basename(case_dir) / "lista.txt").read_text(encoding="utf-8")
+    assert not any(n in listed for n in notices)
+    index = json.loads((tmp_path / os.path.basename(case_dir) / "indice.json").read_text(encoding="utf-8"))
+    assert {d["nombre"] for d in index["documentos"] if d["decision"] == "filtrado"} == notices
+    # La siguiente sincronización sabe que ya se filtraron y no las vuelve a descargar
+    manifest = td.CaseManifest(case_dir)
+    outcomes = {f["name"]: f["outcome"] for entry in manifest.entries.values() for f in entry["files"]}
+    assert {n for n, outcome in outcomes.items() if outcome == "filtered"} == notices
+
+    # Una segunda pasada ya no encuentra nada
+    assert td.reclassify_expedientes(str(tmp_path), "eliminar", workers=1) == {}
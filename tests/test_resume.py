@@ -0,0 +1,76 @@
+# Reanudación de descargas (HttpClient.download) contra el servidor simulado con cortes de conexión.
+import hashlib
+import json
+import os
+
+import pytest
+
+from conftest import RADICADO, document_url, session_client
+from tyba_mock_server import make_pdf
+
+PDF_KB = 300
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+@pytest.fixture
+def cut_download(make_mock, tmp_path, monkeypatch):
+    """Servidor que corta todas las transferencias a la mitad, y la URL y el contenido de un documento."""
+    mock = make_mock(cortes=1.0, pdf_kb=PDF_KB)
+    doc_id, _ = mock.case(RADICADO).archivos[0]
+    expected = make_pdf(mock.document(doc_id), PDF_KB)
+    # Cuerpos de cualquier tamaño por el camino en streaming (el único que deja .part)
+    monkeypatch.setattr("tyba_downloader.HttpClient.MEMORY_LIMIT", 0)
+    return mock, document_url(mock, doc_id), str(tmp_path / "documento.pdf"), expected
+
+def test_cut_connections_are_resumed_with_range(cut_download):
+    mock, url, path, expected = cut_download
+    client = session_client(mock)
+    with pytest.raises(Exception, match="truncada"):
+        client.download(url, path)
+    resumes = client.RESUME_ATTEMPTS
+    # Cada corte se retoma desde lo ya recibido, no desde el byte cero
+    assert mock.stats["cortes"] == resumes + 1
+    assert mock.stats["rangos"] == resumes
+    received = os.path.getsize(path + ".part")
+    assert len(expected) // 2 < received < len(expected)
+    assert expected.startswith(_read(path + ".part"))
+    assert not os.path.exists(path)
+
+def test_part_survives_between_download_calls(cut_download):
+    mock, url, path, expected = cut_download
+    with pytest.raises(Exception):
+        session_client(mock).download(url, path)
+    meta = json.loads(_read(path + ".part.json"))
+    assert meta["url"] == url and meta["total"] == len(expected) and meta["etag"]
+    received = os.path.getsize(path + ".part")
+
+    # Otra ejecución (cliente nuevo) con el servidor ya estable: solo pide lo que falta
+    mock.config.cortes = 0.0
+    ranges = mock.stats["rangos"]
+    size, digest, kept = session_client(mock).download(url, path)
+    assert mock.stats["rangos"] == ranges + 1
+    assert (size, kept) == (len(expected), True)
+    assert len(expected) - received < len(expected) // 2
+    assert _read(path) == expected
+    assert digest == hashlib.sha256(expected).hexdigest()
+    assert not os.path.exists(path + ".part") and not os.path.exists(path + ".part.json")
+
+def test_if_range_mismatch_restarts_from_zero(cut_download):
+    mock, url, path, expected = cut_download
+    with pytest.raises(Exception):
+        session_client(mock).download(url, path)
+    # Si el documento cambió (otro ETag), el servidor ignora el Range y el .part no se mezcla con él
+    meta_path = path + ".part.json"
+    meta = json.loads(_read(meta_path))
+    meta["etag"] = '"otra-version"'
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    mock.config.cortes = 0.0
+    ranges = mock.stats["rangos"]
+    size, digest, kept = session_client(mock).download(url, path)
+    assert mock.stats["rangos"] == ranges
+    assert _read(path) == expected
+    assert digest == hashlib.sha256(expected).hexdigest()
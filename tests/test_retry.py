@@ -0,0 +1,75 @@
+# RetryPolicy y CircuitBreaker, sin red ni navegador.
+import pytest
+
+import tyba_downloader as td
+
+class _Pacing:
+    """Ritmo fijo que registra penalizaciones y no duerme."""
+    level = 1.0
+    def __init__(self):
+        self.errors, self.slept = [], []
+    def observe_error(self, error):
+        self.errors.append(error)
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+
+def _failing(errors, result="ok"):
+    calls = []
+    def fn(attempt):
+        calls.append(attempt)
+        if errors: raise errors.pop(0)
+        return result
+    return fn, calls
+
+def test_classify():
+    policy = td.RetryPolicy
+    assert policy.classify(td.CaptchaMismatch()) == policy.CAPTCHA
+    assert policy.classify(td.CaseNotFound()) == policy.PERMANENT
+    assert policy.classify(td.SessionExpired()) == policy.SESSION
+    assert policy.classify(td.HttpStatusError("x", 440)) == policy.SESSION
+    assert policy.classify(td.HttpStatusError("x", 503)) == policy.TRANSIENT
+    assert policy.classify(td.PlaywrightTimeoutError("x")) == policy.TRANSIENT
+
+def test_call_retries_until_success():
+    pacing = _Pacing()
+    breaker = td.CircuitBreaker()
+    policy = td.RetryPolicy(pacing, breaker)
+    fn, calls = _failing([td.CaptchaMismatch(), td.PlaywrightTimeoutError("lento")])
+    retries = []
+    assert policy.call("busqueda", fn, lambda e, n, wait: retries.append((type(e), n))) == "ok"
+    assert calls == [0, 1, 2]
+    assert retries == [(td.CaptchaMismatch, 0), (td.PlaywrightTimeoutError, 1)]
+    assert len(pacing.errors) == len(pacing.slept) == 2
+    # Solo el timeout cuenta para el circuito, y el éxito lo cierra
+    assert breaker._failures == 0
+
+def test_call_gives_up():
+    policy = td.RetryPolicy(_Pacing(), td.CircuitBreaker(threshold=100))
+    fn, calls = _failing([td.CaptchaMismatch() for _ in range(10)])
+    with pytest.raises(td.CaptchaMismatch):
+        policy.call("busqueda", fn)
+    assert len(calls) == policy.attempts("busqueda")
+
+    fn, calls = _failing([td.CaseNotFound("no existe")])
+    with pytest.raises(td.CaseNotFound):
+        policy.call("busqueda", fn)
+    assert calls == [0]
+
+    fn, calls = _failing([td.HttpStatusError("x", 401)])
+    with pytest.raises(td.SessionExpired):
+        policy.call("adjunto", fn)
+    assert calls == [0]
+
+def test_breaker_reports_openings_without_printing(capsys):
+    opened = []
+    breaker = td.CircuitBreaker(threshold=2, cooldown=10, max_cooldown=15, on_open=lambda *a: opened.append(a))
+    breaker.failure()
+    assert opened == []
+    breaker.failure()
+    breaker.failure() # con el circuito abierto los fallos no cuentan
+    breaker._open_until = 0.0 # fin de la pausa
+    breaker.failure() # semiabierto: un fallo más lo reabre con el doble de pausa (tope 15)
+    assert opened == [(10, 1), (15, 2)]
+    assert capsys.readouterr().out == ""
+    breaker.success()
+    assert breaker.trips == 0 and breaker._failures == 0
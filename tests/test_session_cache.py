@@ -0,0 +1,60 @@
+# Caché de sesiones: volver al detalle sin repetir la búsqueda (ni el CAPTCHA) contra el servidor simulado.
+import os
+
+import tyba_downloader as td
+from conftest import RADICADO, open_case
+
+ACTUACIONES = ("MainContent_grdActuaciones", "grdActuaciones_imgbConsultarGrilla")
+
+def _cache_detail(mock, tmp_path, ttl=60):
+    session = open_case(mock)
+    cache = td.SessionCache(str(tmp_path / ".sesiones"), ttl)
+    cache.save(RADICADO, {"cookies": session.http.cookies, "origins": []}, session.url, session.html)
+    return cache
+
+def _client(cached):
+    client = td.HttpClient("pytest")
+    client.set_cookies(cached["storage_state"]["cookies"])
+    return client
+
+def test_saved_detail_is_replayed_without_searching(make_mock, tmp_path):
+    mock = make_mock(actuaciones=4)
+    cached = _cache_detail(mock, tmp_path).load(RADICADO)
+    searches = mock.stats["busquedas"]
+
+    # La URL sola no sirve: un GET de frmConsulta.aspx devuelve el formulario de búsqueda vacío
+    page = _client(cached).request("GET", cached["url"]).read().decode("utf-8")
+    assert "MainContent_txtCodigoProceso" in page and not td.is_case_detail(page, RADICADO)
+
+    # Reenviar el formulario guardado devuelve el detalle con sus actuaciones
+    session = td.PostbackSession(_client(cached), cached["url"], cached["html"])
+    session.refresh()
+    assert td.is_case_detail(session.html, RADICADO)
+    assert [r.description for r in session.grid(*ACTUACIONES)] == [a["nombre"] for a in mock.case(RADICADO).actuaciones]
+    assert mock.stats["busquedas"] == searches
+
+    # Y desde ahí el motor HTTP sigue con postbacks normales
+    session.submit(session.grid(*ACTUACIONES)[0].button_id)
+    assert session.has_element("MainContent_btnRegresarActuacion")
+
+def test_detail_of_another_case_is_rejected(make_mock, tmp_path):
+    mock = make_mock(actuaciones=2)
+    cached = _cache_detail(mock, tmp_path).load(RADICADO)
+    session = td.PostbackSession(_client(cached), cached["url"], cached["html"])
+    session.refresh()
+    assert not td.is_case_detail(session.html, "11001310300120230099900")
+
+def test_expired_or_incomplete_entries_are_dropped(make_mock, tmp_path):
+    mock = make_mock(actuaciones=1)
+    cache = _cache_detail(mock, tmp_path, ttl=60)
+    path = cache._path(RADICADO)
+    assert cache.load(RADICADO)["html"]
+
+    cache.ttl_seconds = -1
+    assert cache.load(RADICADO) is None
+    assert not os.path.exists(path)
+
+    # Las entradas de versiones anteriores (solo cookies y URL) no permiten volver al detalle
+    cache = td.SessionCache(cache.cache_dir, 60)
+    cache.save(RADICADO, {"cookies": [], "origins": []}, mock.url, "")
+    assert cache.load(RADICADO) is None
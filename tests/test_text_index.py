@@ -0,0 +1,47 @@
+# Índice de texto completo (indexar / buscar) sobre un expediente descargado del servidor simulado.
+import os
+
+import pytest
+
+import tyba_downloader as td
+from conftest import RADICADO, run_http_case
+
+@pytest.fixture
+def case(make_mock, tmp_path):
+    mock = make_mock(actuaciones=4, adjuntos=1, archivos=2, notificaciones=0.5, pdf_kb=1)
+    downloader = td.TybaDownloader(output_base_dir=str(tmp_path), session_ttl=0, engine="http", pacing="agresivo",
+                                   base_url=mock.url)
+    try:
+        return run_http_case(downloader, mock)
+    finally:
+        downloader.close()
+
+def test_index_and_search_kept_documents(case, tmp_path):
+    index = td.TextIndex(str(tmp_path / ".texto.sqlite3"))
+    try:
+        indexed, unchanged, removed, errors = index.update(str(tmp_path), workers=1)
+        kept = case.documents.kept()
+        assert (indexed, unchanged, removed, errors) == (len(kept), 0, 0, 0)
+        assert index.counts() == {"documentos": len(kept), "expedientes": 1, "sin_texto": 0}
+
+        hits = index.search("pretensiones")
+        assert sorted(h["nombre"] for h in hits) == ["DEMANDA", "PODER"]
+        assert all(h["radicado"] == RADICADO and "[PRETENSIONES]" in h["fragmento"] for h in hits)
+        # Las notificaciones filtradas no se descargan y por tanto no aparecen
+        assert index.search("citacion") == []
+        assert index.search("pretensiones", radicado="11001310300120230045600") == []
+        # Sintaxis que FTS5 no acepta: se busca como frase en lugar de fallar
+        assert index.search("RADICADO-123") == []
+    finally:
+        index.close()
+
+def test_update_only_touches_changed_files(case, tmp_path):
+    index = td.TextIndex(str(tmp_path / ".texto.sqlite3"))
+    try:
+        total, _, _, _ = index.update(str(tmp_path), workers=1)
+        assert index.update(str(tmp_path), workers=1) == (0, total, 0, 0)
+        os.remove(os.path.join(case.case_dir, "PODER.pdf"))
+        assert index.update(str(tmp_path), workers=1) == (0, total - 1, 1, 0)
+        assert [h["nombre"] for h in index.search("pretensiones")] == ["DEMANDA"]
+    finally:
+        index.close()
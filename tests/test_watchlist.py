@@ -0,0 +1,56 @@
+# Vigilancia de radicados: lista persistente (Watchlist), límite de consultas y registro de cambios.
+import json
+import time
+
+import pytest
+
+import tyba_downloader as td
+from conftest import RADICADO
+
+@pytest.fixture
+def watchlist(tmp_path):
+    watch = td.Watchlist(str(tmp_path / "vigilancia.sqlite3"), interval=3600)
+    yield watch
+    watch.close()
+
+def test_new_radicado_is_due_on_the_next_pass(watchlist):
+    assert watchlist.add(RADICADO)
+    assert not watchlist.add(RADICADO)
+    # `vigilar --una-vez` justo después del alta ya lo revisa
+    item = watchlist.claim("w1")
+    assert item["radicado"] == RADICADO and item["fingerprints"] is None
+    assert watchlist.claim("w2") is None
+
+def test_rechecks_are_spread_around_the_interval(watchlist):
+    watchlist.add(RADICADO)
+    watchlist.claim("w1")
+    before = time.time()
+    watchlist.record(RADICADO, fingerprints=["a", "b"])
+    item = watchlist.list()[0]
+    assert item["fingerprints"] == ["a", "b"] and item["checks"] == 1
+    assert before + 3600 * 0.75 <= item["next_check"] <= time.time() + 3600 * 1.25
+    assert watchlist.claim("w1") is None
+
+def test_failed_check_keeps_fingerprints_and_backs_off(watchlist):
+    watchlist.add(RADICADO)
+    watchlist.claim("w1")
+    watchlist.record(RADICADO, fingerprints=["a"])
+    watchlist.record(RADICADO, error="portal caído")
+    item = watchlist.list()[0]
+    assert item["fingerprints"] == ["a"] and item["failures"] == 1
+    assert item["next_check"] - time.time() <= td.Watchlist.RETRY_BASE * 1.2
+    assert watchlist.counts() == {"vigilados": 1, "pendientes": 0, "con_fallos": 1}
+
+def test_rate_limiter_spaces_queries():
+    limiter = td.RateLimiter(per_hour=36000) # una consulta cada 0,1 s de media
+    started = time.monotonic()
+    for _ in range(3):
+        assert limiter.wait()
+    assert time.monotonic() - started >= 0.1
+
+def test_change_feed_appends_json_lines(tmp_path):
+    feed = td.ChangeFeed(str(tmp_path / "cambios.jsonl"))
+    feed.emit("alta", RADICADO)
+    feed.emit("cambio", RADICADO, nuevas=2)
+    events = [json.loads(line) for line in (tmp_path / "cambios.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [(e["evento"], e.get("nuevas")) for e in events] == [("alta", None), ("cambio", 2)]
@@ -0,0 +1,183 @@
+# Banco de pruebas de extremo a extremo sin tocar el portal real: levanta el servidor simulado
+# (tyba_mock_server.py), descarga con tyba_downloader.py varios expedientes sintéticos y reporta
+# expedientes/hora, segundos por actuación, caudal y pico de memoria (RSS) del proceso y sus hijos.
+#
+#   python tyba_bench.py -n 6 -c 3 --motor http --latencia 0.1 --fallos 0.05 --json resultado.json
+#
+# Cada ejecución usa una carpeta de salida nueva, así el manifiesto incremental no altera la medición.
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from tyba_downloader import TybaDownloader, BrowserProfile, PacingController, logger
+from tyba_mock_server import MockTyba, add_mock_arguments, config_from_args
+
+class RssSampler:
+    """Muestrea cada `interval` segundos el RSS de este proceso y sus descendientes (driver y Chromium).
+
+    La suma cuenta varias veces la memoria compartida entre procesos de Chromium: es una cota superior,
+    útil para comparar ejecuciones entre sí. Usa psutil si está instalado; si no, /proc (Linux).
+    """
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            rss = self.sample()
+            if rss: self.peak = max(self.peak, rss)
+            if self._stop.wait(self.interval): return
+
+    @staticmethod
+    def sample():
+        """RSS total en bytes del árbol de procesos, o None si no se puede medir en esta plataforma."""
+        try:
+            import psutil
+            root = psutil.Process()
+            total = 0
+            for proc in [root] + root.children(recursive=True):
+                try: total += proc.memory_info().rss
+                except psutil.Error: pass
+            return total
+        except ImportError:
+            pass
+        if not os.path.isdir("/proc/self"):
+            return None
+        children = {} # ppid -> [pid]
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit(): continue
+            try:
+                with open(f"/proc/{entry}/stat", "rb") as f:
+                    # El nombre del proceso va entre paréntesis y puede contener espacios
+                    ppid = int(f.read().rsplit(b")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        total = 0
+        pending = [os.getpid()]
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        while pending:
+            pid = pending.pop()
+            pending += children.get(pid, [])
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * page_size
+            except (OSError, IndexError, ValueError):
+                pass
+        return total
+
+def _radicados(n):
+    # 23 dígitos: despacho ficticio + año + consecutivo + recurso
+    return [f"11001310300{2024}{i:06d}00" for i in range(1, n + 1)]
+
+def run_bench(args):
+    config = config_from_args(args)
+    out_dir = args.salida or tempfile.mkdtemp(prefix="tyba_bench_")
+    radicados = _radicados(args.expedientes)
+    try:
+        with MockTyba(config) as mock, RssSampler() as rss:
+            downloader = TybaDownloader(output_base_dir=out_dir, silent_mode=True, session_ttl=0, engine=args.motor,
+                                        max_parallel_downloads=args.descargas_paralelas, pacing=args.ritmo,
+                                        base_url=mock.url, profile=args.perfil,
+                                        slow_mo=False if args.sin_slow_mo else None)
+            started = time.perf_counter()
+            try:
+                states = downloader.download_batch(radicados, skip_notifications=not args.incluir_notificaciones,
+                                                   concurrency=args.concurrencia)
+                wall = time.perf_counter() - started
+            finally:
+                downloader.close()
+        stats = dict(mock.stats)
+    finally:
+        if not args.salida and not args.conservar:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    reports = [st.metrics.report(st) for st in states if st is not None and st.metrics]
+    done = [r for r in reports if r.get("completo")]
+    case_seconds = sum(r["duracion_s"] for r in done)
+    actuaciones = len(done) * config.actuaciones
+    counters, phases = {}, {}
+    for r in reports:
+        for name, value in r["contadores"].items():
+            counters[name] = counters.get(name, 0) + value
+        for name, span in r["fases"].items():
+            phases[name] = round(phases.get(name, 0.0) + span["total_s"], 3)
+    latencies = sorted(f["segundos"] for r in reports for f in r["archivos"])
+
+    return {
+        "fecha": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "parametros": {"expedientes": args.expedientes, "concurrencia": args.concurrencia, "motor": args.motor,
+                       "ritmo": args.ritmo, "perfil": args.perfil,
+                       "slow_mo": downloader._slow_mo(), "servidor": vars(config)},
+        "expedientes_completos": len(done),
+        "expedientes_con_error": len(radicados) - len(done),
+        "duracion_s": round(wall, 3),
+        "expedientes_hora": round(len(done) / wall * 3600, 2) if wall > 0 else 0.0,
+        "s_por_actuacion": round(case_seconds / actuaciones, 3) if actuaciones else None,
+        "mb_s": round(counters.get("bytes", 0) / wall / (1024 * 1024), 3) if wall > 0 else 0.0,
+        "latencia_archivo_s": {"p50": latencies[len(latencies) // 2],
+                               "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]} if latencies else None,
+        "rss_pico_mb": round(rss.peak / (1024 * 1024), 1) if rss.peak else None,
+        "fases_s": phases,
+        "contadores": counters,
+        "servidor": stats,
+    }
+
+def _print_result(result):
+    C_CYAN, C_BOLD, C_END = "\033[96m", "\033[1m", "\033[0m"
+    print(f"\n{C_CYAN}{C_BOLD}=== Resultado del banco de pruebas ==={C_END}")
+    print(f"  Expedientes completos:  {result['expedientes_completos']} (con error: {result['expedientes_con_error']})")
+    print(f"  Duración total:         {result['duracion_s']} s")
+    print(f"  Expedientes por hora:   {result['expedientes_hora']}")
+    print(f"  Segundos por actuación: {result['s_por_actuacion']}")
+    print(f"  Caudal:                 {result['mb_s']} MB/s")
+    if result["latencia_archivo_s"]:
+        print(f"  Latencia por archivo:   p50 {result['latencia_archivo_s']['p50']} s · p95 {result['latencia_archivo_s']['p95']} s")
+    rss = result["rss_pico_mb"]
+    print(f"  Pico de RSS:            {f'{rss} MB' if rss else 'no disponible en esta plataforma'}")
+    print(f"  Tiempo por fase:        " + ", ".join(f"{k} {v}s" for k, v in sorted(result["fases_s"].items())))
+    print(f"  Servidor simulado:      " + ", ".join(f"{k} {v}" for k, v in sorted(result["servidor"].items())))
+
+def _build_arg_parser():
+    parser = argparse.ArgumentParser(description="Mide el descargador contra un servidor TYBA simulado local.")
+    parser.add_argument("-n", "--expedientes", type=int, default=4, help="Expedientes sintéticos a descargar.")
+    parser.add_argument("-c", "--concurrencia", type=int, default=2, help="Expedientes simultáneos.")
+    parser.add_argument("--motor", choices=["sync", "async", "http"], default="sync")
+    parser.add_argument("--descargas-paralelas", type=int, default=4, metavar="N")
+    parser.add_argument("--ritmo", choices=sorted(PacingController.PRESETS), default="agresivo")
+    parser.add_argument("--perfil", choices=sorted(BrowserProfile.PRESETS), default="visible",
+                        help="Perfil del navegador (ver 'lote --perfil').")
+    parser.add_argument("--sin-slow-mo", action="store_true")
+    parser.add_argument("--incluir-notificaciones", action="store_true", help="No filtrar notificaciones.")
+    parser.add_argument("-o", "--salida", help="Carpeta de descarga (por defecto una temporal que se borra al final).")
+    parser.add_argument("--conservar", action="store_true", help="No borrar la carpeta temporal de descarga.")
+    parser.add_argument("--json", metavar="RUTA", help="Guarda el resultado en JSON para comparar ejecuciones.")
+    parser.add_argument("--log-nivel", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="DEBUG")
+    add_mock_arguments(parser)
+    return parser
+
+if __name__ == "__main__":
+    args = _build_arg_parser().parse_args()
+    logger.configure(level=args.log_nivel)
+    result = run_bench(args)
+    _print_result(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=1)
+    sys.exit(0 if result["expedientes_con_error"] == 0 else 1)
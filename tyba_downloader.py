@@ -1,30 +1,212 @@
+import atexit
+import concurrent.futures
+import contextlib
+import csv
+import errno
+import hashlib
+import http.client
+import http.cookies
+import http.server
+import io
+import json
+import logging
+import logging.handlers
+import mmap
+import multiprocessing
 import os
+import queue
 import random
+import shutil
+import socket
+import sqlite3
 import sys
+import threading
 import time
 import traceback
+import urllib.parse
+import weakref
 
 
 # LOG DE DEPURACIÓN DETALLADO
+class _JsonLinesFormatter(logging.Formatter):
+    """Un objeto JSON por línea: hora, nivel, radicado, fase, mensaje y campos adicionales (tiempos, tamaños)."""
+    def format(self, record):
+        data = {
+            "ts": f"{self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}.{int(record.msecs):03d}",
+            "nivel": record.levelname,
+            "radicado": getattr(record, "radicado", None),
+            "fase": getattr(record, "fase", None),
+            "hilo": record.threadName,
+            "msg": record.getMessage(),
+        }
+        data.update(getattr(record, "campos", None) or {})
+        return json.dumps(data, ensure_ascii=False)
+
+class _CaseFilesHandler(logging.Handler):
+    """Reparte los registros por expediente en <carpeta del caso>/registro.jsonl, con rotación.
+
+    Solo lo usa el hilo escritor, así que los archivos se abren y cierran sin competir entre hilos.
+    """
+    def __init__(self, max_bytes, backups):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._files = {} # radicado -> RotatingFileHandler
+        self.setFormatter(_JsonLinesFormatter())
+
+    def emit(self, record):
+        radicado = getattr(record, "radicado", None)
+        if radicado is None: return
+        if getattr(record, "cerrar_caso", False):
+            handler = self._files.pop(radicado, None)
+            if handler: handler.close()
+            return
+        handler = self._files.get(radicado)
+        if handler is None:
+            case_dir = getattr(record, "case_dir", None)
+            if not case_dir: return
+            try:
+                handler = logging.handlers.RotatingFileHandler(os.path.join(case_dir, "registro.jsonl"), maxBytes=self.max_bytes,
+                                                               backupCount=self.backups, encoding="utf-8")
+            except OSError:
+                return
+            handler.setFormatter(self.formatter)
+            self._files[radicado] = handler
+        handler.emit(record)
+
+    def close(self):
+        for handler in self._files.values():
+            handler.close()
+        self._files = {}
+        super().close()
+
+class _SessionFileHandler(logging.handlers.RotatingFileHandler):
+    """debug_log.txt: cada sesión empieza en un archivo nuevo; las anteriores quedan como .1, .2..."""
+    def __init__(self, filename, max_bytes, backups):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            self.doRollover()
+
 class DebugLogger:
-    def __init__(self):
-        self.log_file = "debug_log.txt"
-        with open(self.log_file, "w", encoding="utf-8") as f:
-            f.write(f"=== INICIO DE SESIÓN DE DEPURACIÓN: {time.strftime('%Y-%m-%d %H:%M:%S')} ===\n\n")
-    
-    def log(self, msg):
-        timestamp = time.strftime('%H:%M:%S')
+    """Registro de depuración con escritura en segundo plano.
+
+    `log()` solo encola el registro (logging.handlers.QueueHandler); un hilo escritor (QueueListener)
+    lo vuelca en debug_log.txt y en el registro JSON del expediente, con los archivos abiertos. Los
+    niveles desactivados no llegan a la cola. El radicado y la fase salen del contexto del hilo (case/phase).
+    """
+    def __init__(self, log_file="debug_log.txt", level=logging.DEBUG, max_bytes=5 * 1024 * 1024, backups=3):
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._logger = logging.getLogger("tyba")
+        self._logger.setLevel(level)
+        self._logger.propagate = False
+        self._listener = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def configure(self, level=None, log_file=None, max_bytes=None, backups=None):
+        """Cambia nivel, archivo o rotación. Los archivos se abren al primer registro."""
+        if isinstance(level, str):
+            level = logging.getLevelName(level.upper())
+        if level is not None: self._logger.setLevel(level)
+        if log_file is not None or max_bytes is not None or backups is not None:
+            self.close()
+            self.log_file = log_file or self.log_file
+            self.max_bytes = max_bytes or self.max_bytes
+            self.backups = backups if backups is not None else self.backups
+
+    def _start(self):
+        with self._lock:
+            if self._listener is not None: return
+            # Los procesos del pool (reclasificación) vuelven a importar el módulo: no deben rotar el log
+            if multiprocessing.current_process().name != "MainProcess":
+                main_file = logging.NullHandler()
+            else:
+                main_file = _SessionFileHandler(self.log_file, self.max_bytes, self.backups)
+                main_file.setFormatter(logging.Formatter("[%(asctime)s] %(contexto)s%(message)s", "%H:%M:%S"))
+                main_file.addFilter(lambda record: not getattr(record, "cerrar_caso", False))
+            records = queue.SimpleQueue()
+            self._logger.handlers = [logging.handlers.QueueHandler(records)]
+            # La cabecera entra en la cola antes que cualquier registro de otro hilo
+            self._logger.log(logging.INFO, f"=== INICIO DE SESIÓN DE DEPURACIÓN: {time.strftime('%Y-%m-%d %H:%M:%S')} ===",
+                             extra={"contexto": ""})
+            listener = logging.handlers.QueueListener(
+                records, main_file, _CaseFilesHandler(self.max_bytes, self.backups), respect_handler_level=False
+            )
+            listener.start()
+            self._listener = listener
+
+    def enabled(self, level=logging.DEBUG):
+        return self._logger.isEnabledFor(level)
+
+    def log(self, msg, *args, level=logging.DEBUG, **fields):
+        """Registra `msg % args` (estilo logging): si el nivel está desactivado no se formatea nada."""
+        if not self._logger.isEnabledFor(level): return
+        if self._listener is None: self._start()
+        ctx = self._local.__dict__
+        radicado = ctx.get("radicado")
+        self._logger.log(level, msg, *args, extra={
+            "radicado": radicado, "case_dir": ctx.get("case_dir"), "fase": ctx.get("fase"), "campos": fields,
+            "contexto": f"[{radicado}] " if radicado else "",
+        })
+
+    @contextlib.contextmanager
+    def case(self, radicado, case_dir):
+        """Asocia al hilo actual los registros de un expediente (y cierra su archivo al terminar)."""
+        self._local.radicado = radicado
+        self._local.case_dir = case_dir
+        self._local.fase = None
         try:
-            with open(self.log_file, "a", encoding="utf-8") as f:
-                f.write(f"[{timestamp}] {msg}\n")
-        except: pass
+            yield
+        finally:
+            self.phase(None)
+            if self._listener is not None:
+                self._logger.log(logging.CRITICAL, "", extra={"radicado": radicado, "cerrar_caso": True, "contexto": ""})
+            self._local.__dict__.clear()
+
+    def context(self):
+        """Contexto del hilo actual (radicado, carpeta y fase), para atribuir registros hechos desde otro hilo."""
+        ctx = self._local.__dict__
+        return {key: ctx.get(key) for key in ("radicado", "case_dir", "fase")}
+
+    @contextlib.contextmanager
+    def bound(self, ctx):
+        """Aplica en el hilo actual un contexto tomado con context() (hilos del motor paralelo)."""
+        previous = dict(self._local.__dict__)
+        self._local.__dict__.update(ctx)
+        try:
+            yield
+        finally:
+            self._local.__dict__.clear()
+            self._local.__dict__.update(previous)
+
+    def phase(self, name):
+        """Marca el inicio de una fase del expediente y registra la duración de la anterior."""
+        ctx = self._local.__dict__
+        previous, started = ctx.get("fase"), ctx.get("fase_inicio")
+        if previous and started is not None:
+            self.log("Fase '%s' terminada", previous, level=logging.INFO, duracion_ms=round((time.perf_counter() - started) * 1000))
+        ctx["fase"] = name
+        ctx["fase_inicio"] = time.perf_counter() if name else None
+
+    def close(self):
+        """Vacía la cola y cierra los archivos (también se llama al salir)."""
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is None: return
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
 
 logger = DebugLogger()
+atexit.register(logger.close)
 
 # ARCHIVO DE LOG DE ERRORES CRÍTICOS
 def log_fatal_error(error_msg):
     try:
-        logger.log(f"ERROR FATAL: {error_msg}")
+        logger.log("ERROR FATAL: %s", error_msg, level=logging.CRITICAL)
+        logger.close()
         with open("fatal_error.txt", "w", encoding="utf-8") as f:
             f.write("=== LOG DE ERROR CRÍTICO ===\n")
             f.write(f"Fecha: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
@@ -33,9 +215,11 @@ def log_fatal_error(error_msg):
         pass
 
 try:
+    import html as html_lib
+    from html.parser import HTMLParser
     import re
     import unicodedata
-    from playwright.sync_api import sync_playwright, Page, BrowserContext, Browser
+    from playwright.sync_api import sync_playwright, Page, BrowserContext, Browser, TimeoutError as PlaywrightTimeoutError
     from playwright_stealth import Stealth
     try:
         from pypdf import PdfReader
@@ -48,19 +232,2032 @@ except Exception:
     input("\nPresione Enter para salir...")
     sys.exit(1)
 
+# REGLAS DEL FILTRO DE NOTIFICACIONES
+# Palabras de Protección (Documentos sustanciales que NUNCA se deben borrar)
+# Ampliado para cubrir todos los tipos de procesos (Ejecutivos, Familia, etc.)
+FILTRO_PROTECCION = [
+    "AUTO INTERLOCUTORIO", "SENTENCIA", "AUTO NR", "AUTO NUMERO", "RESUELVE", 
+    "DEMANDA", "PRETENSIONES", "ORDENA", "CONTESTACION", "RECURSO", "ALEGATOS", 
+    "MEMORIAL", "AUDIENCIA", "ACTA", "PODER", "SOLICITUD", "INCIDENTE",
+    "MANDAMIENTO", "LIQUIDACION", "AVALUO", "SECUESTRO", "REMATE", "COSTAS", 
+    "INVENTARIO", "DICTAMEN", "PERITAJE", "AUTO", "FALLO"
+]
+
+# Palabras clave que indican una comunicación puramente procesal/notoria
+FILTRO_NOTIFICACION = [
+    "NOTIFICACION", "ENVIO", "CITATORIO", "AVISO", "ESTADO", 
+    "CERTIFICADO", "PRUEBA DE ENTREGA", "FORMATO DE CITACION", 
+    "COMUNICACION", "OFICIO", "COMUNICADO", "CONSTANCIA", "ACUSE",
+    "GUIA", "REPORTE DE CORREO", "Telegrama", "HACE SABER"
+]
+
+# Indicios de formato de notificación en la primera página
+# Ampliamos los indicios para cubrir más formatos de Tyba / Rama Judicial
+FILTRO_INDICIOS_FORMATO = [
+    "DIRECCION DE NOTIFICACION", "CODIGO DE BARRAS", "GUIA NO", "ACUSE DE RECIBO", 
+    "AVISO DE NOTIFICACION", "HACE SABER", "POR MEDIO DEL PRESENTE", 
+    "NOTIFICACION POR ESTADO", "NOTIFICACION PERSONAL", "SECRETARIA",
+    "RAMA JUDICIAL DEL PODER PUBLICO", "DE MANERA ELECTRONICA", "SISTEMA DE GESTION"
+]
+
+# Protección por contenido del PDF
+# Usamos una lista más estricta para contenido (quitamos palabras genéricas como "AUTO" que aparecen en notificaciones)
+FILTRO_PROTECCION_CONTENIDO = [
+    "AUTO INTERLOCUTORIO", "SENTENCIA", "RESUELVE", "DEMANDA", "PRETENSIONES", 
+    "ORDENA", "CONTESTACION", "RECURSO", "ALEGATOS", "MEMORIAL", "AUDIENCIA", 
+    "ACTA", "PODER", "SOLICITUD", "INCIDENTE", "MANDAMIENTO", "LIQUIDACION", 
+    "AVALUO", "SECUESTRO", "REMATE", "COSTAS", "INVENTARIO", "DICTAMEN", "PERITAJE", "FALLO"
+]
+
+# Versión de las reglas: cambia sola al editar cualquiera de las listas e invalida las decisiones guardadas
+FILTRO_VERSION = hashlib.sha1(json.dumps(
+    [FILTRO_PROTECCION, FILTRO_NOTIFICACION, FILTRO_INDICIOS_FORMATO, FILTRO_PROTECCION_CONTENIDO]
+).encode("utf-8")).hexdigest()[:12]
+
+def _normalize_text(text):
+    """Normaliza el texto: quita acentos, convierte a mayúsculas y limpia espacios."""
+    if not text: return ""
+    text = text.upper()
+    # Eliminar acentos usando unicodedata
+    normalized = "".join(
+        c for c in unicodedata.normalize('NFD', text)
+        if unicodedata.category(c) != 'Mn'
+    )
+    return " ".join(normalized.split())
+
+class NotificationRules:
+    """Reglas del filtro precompiladas: una expresión regular por lista en vez de recorrer listas en cada llamada.
+
+    Búsqueda por subcadena, igual que `kw in texto`; las palabras más largas van primero en la alternancia.
+    """
+    def __init__(self):
+        self.proteccion = self._compile(FILTRO_PROTECCION)
+        self.notificacion = self._compile(FILTRO_NOTIFICACION)
+        self.indicios_formato = self._compile(FILTRO_INDICIOS_FORMATO)
+        self.proteccion_contenido = self._compile(FILTRO_PROTECCION_CONTENIDO)
+
+    @staticmethod
+    def _compile(words):
+        return re.compile("|".join(re.escape(w) for w in sorted(set(words), key=len, reverse=True)))
+
+    @staticmethod
+    def _find(pattern, text):
+        m = pattern.search(text)
+        return m.group(0) if m else ""
+
+    def name_verdict(self, u_act):
+        """Análisis por nombre (ya normalizado): (palabra de notificación, palabra protegida); "" si no hay."""
+        return self._find(self.notificacion, u_act), self._find(self.proteccion, u_act)
+
+    def classify_first_page(self, first_page, is_likely_notif):
+        """Decide sobre la primera página normalizada. Devuelve (es_notificación, motivo)."""
+        # PRIORIDAD 1: ¿Tiene formato obvio de notificación? (Si sí, es notificación sin duda)
+        # Si ya sospechábamos por el nombre, somos agresivos confirmando formato
+        if is_likely_notif and self.indicios_formato.search(first_page):
+            return True, "Confirmado como notificación (formato detectado, nombre sospechoso)"
+
+        # 2. Protección por contenido del PDF
+        word = self._find(self.proteccion_contenido, first_page)
+        if word:
+            return False, f"Protegido por contenido ('{word}')" # Es un documento de fondo, proteger
+
+        # 3. Verificación final: ¿Contiene el PDF palabras de notificación?
+        word = self._find(self.notificacion, first_page)
+        if word:
+            return True, f"Detectado como notificación por contenido ('{word}')"
+        return is_likely_notif, ""
+
+FILTRO_REGLAS = NotificationRules()
+
+def classify_notification(source, act_name="", rules=None, cache=None, digest=None, log=None):
+    """Verificación robusta y general para identificar notificaciones y citaciones.
+
+    `source` es la ruta del PDF o sus bytes. `cache` es un FilterDecisionCache opcional y `log`
+    un callable para las trazas del filtro (`log(msg, *args)`, como logger.log). Función de módulo para poder usarla en procesos del pool.
+    """
+    rules = rules or FILTRO_REGLAS
+    log = log or (lambda msg, *args: None)
+
+    # 1. Normalización y Palabras Clave Generales
+    u_act = _normalize_text(act_name)
+    notif_word, protected_word_found = rules.name_verdict(u_act)
+
+    # Si el nombre de la actuación contiene estas palabras, es casi seguro que es omitible
+    is_likely_notif = bool(notif_word)
+    if is_likely_notif:
+        log("    [Filtro] Posible notificación por nombre ('%s'): '%s'", notif_word, act_name)
+
+    # Si el nombre indica que es sustancial, lo protegemos por NOMBRE
+    # PERO SOLO SI NO TIENE TAMBIÉN PALABRAS DE NOTIFICACIÓN EXPLÍCITAS
+    if protected_word_found and not is_likely_notif:
+        log("    [Filtro] Protegido por nombre: '%s' (Palabra: %s)", act_name, protected_word_found)
+        return False
+    elif protected_word_found and is_likely_notif:
+        log("    [Filtro] Nombre ambiguo ('%s' + Notificación). Se analizará contenido.", protected_word_found)
+
+    in_memory = isinstance(source, (bytes, bytearray))
+    if not in_memory and not os.path.exists(source):
+        return is_likely_notif
+
+    # Decisión ya tomada para este mismo contenido, nombre y versión de reglas
+    cache_key = None
+    if cache:
+        try:
+            if digest is None:
+                digest = hashlib.sha256(source).hexdigest() if in_memory else cache.digest_for(source)
+            cache_key = (digest, u_act)
+            cached = cache.get(*cache_key)
+            if cached is not None:
+                log("    [Filtro] Decisión en caché: %s", cached)
+                return cached
+        except Exception as e:
+            log("    [Filtro] Caché de decisiones no disponible: %s", e)
+            cache_key = None
+
+    try:
+        reader = PdfReader(io.BytesIO(source) if in_memory else source)
+        # Solo analizamos la primera página para eficiencia
+        first_page = _normalize_text(reader.pages[0].extract_text())
+    except Exception as e:
+        log("    [Filtro] Error analizando PDF: %s. Usando predicción por nombre: %s", e, is_likely_notif)
+        return is_likely_notif
+
+    decision, reason = rules.classify_first_page(first_page, is_likely_notif)
+    if reason:
+        log("    [Filtro] %s: '%s'", reason, act_name)
+    if cache_key:
+        try: cache.put(*cache_key, decision)
+        except Exception as e: log("    [Filtro] No se pudo guardar la decisión: %s", e)
+    return decision
+
+class FilterDecisionCache:
+    """Caché persistente (SQLite) de decisiones del filtro, por huella del PDF, nombre y versión de reglas.
+
+    También recuerda la huella de cada archivo por (ruta, tamaño, mtime) para no volver a leerlo entero.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS decisions (
+            digest TEXT NOT NULL, name TEXT NOT NULL, ruleset TEXT NOT NULL,
+            is_notification INTEGER NOT NULL, decided_at REAL NOT NULL,
+            PRIMARY KEY (digest, name, ruleset))""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS digests (
+            path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL)""")
+        self._db.commit()
+
+    def digest_for(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime_ns, digest FROM digests WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        digest = _file_sha256(path)
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?)", (path, st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+    def get(self, digest, name, ruleset=None):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT is_notification FROM decisions WHERE digest = ? AND name = ? AND ruleset = ?",
+                (digest, name, ruleset or FILTRO_VERSION)).fetchone()
+        return None if row is None else bool(row[0])
+
+    def put(self, digest, name, is_notification, ruleset=None):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO decisions VALUES (?, ?, ?, ?, ?)",
+                             (digest, name, ruleset or FILTRO_VERSION, int(is_notification), time.time()))
+
+    def invalidate(self, everything=False):
+        """Borra las decisiones de versiones anteriores de las reglas (o todas). Devuelve cuántas."""
+        with self._lock, self._db:
+            if everything:
+                cur = self._db.execute("DELETE FROM decisions")
+                self._db.execute("DELETE FROM digests")
+            else:
+                cur = self._db.execute("DELETE FROM decisions WHERE ruleset != ?", (FILTRO_VERSION,))
+        return cur.rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class ClassificationPipeline:
+    """Filtro de notificaciones en segundo plano para un expediente.
+
+    Los PDF recién descargados se encolan en un pool de procesos que los clasifica mientras el navegador
+    sigue con la siguiente actuación; los resultados se aplican al final del caso con `drain()`. A lo sumo
+    `max_pending` archivos esperan clasificación: si la cola está llena, `submit` espera a que se libere un hueco.
+    """
+    def __init__(self, executor, max_pending):
+        self._executor = executor
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._jobs = [] # (futuro, ruta, clave)
+
+    def submit(self, path, key, name, digest=None):
+        """Encola `path`. `name` es el nombre con que lo juzga el filtro en línea, así la decisión y su caché coinciden."""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(_reclassify_file, path, name, digest)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._jobs.append((future, path, key))
+
+    def drain(self):
+        """Espera a que terminen las clasificaciones pendientes. Genera (clave, ruta, es_notificación, motivo)."""
+        jobs, self._jobs = self._jobs, []
+        for future, path, key in jobs:
+            try:
+                _, is_notif, reason = future.result()
+            except Exception as e:
+                # Ante la duda se conserva, igual que el filtro en línea
+                is_notif, reason = False, f"Error: {e}"
+            yield key, path, is_notif, reason
+
+class CaseState:
+    """Estado de un expediente en curso. Cada radicado tiene el suyo, así los casos concurrentes no se pisan."""
+    def __init__(self, radicado, case_dir):
+        self.radicado = radicado
+        self.case_dir = case_dir
+        self.documents = None # DocumentRegistry del expediente
+        self.auto_admite_date = "Sin fecha"
+        self.errors = [] # List of errors for the final report
+        self.completed = False
+        self.permanent_error = False # el fallo no se arregla reintentando (p. ej. radicado inexistente)
+        self.generator_urls = None # GeneratorUrlTemplate del expediente
+        self.http = None # HttpClient del expediente (conexiones keep-alive propias)
+        self.manifest = None # CaseManifest del expediente
+        self.metrics = None # CaseMetrics del expediente
+        self.pipeline = None # ClassificationPipeline del expediente (filtro en segundo plano)
+
+class CaseMetrics:
+    """Tiempos y contadores de un expediente: fases, esperas, reintentos, bytes y latencia por archivo.
+
+    Se activa en el hilo del expediente (`activate`) para que el filtro y el control de ritmo anoten sin
+    recibirlo como parámetro. Al terminar se vuelca en <caso>/informe.json.
+    """
+    _local = threading.local()
+
+    def __init__(self, radicado):
+        self.radicado = radicado
+        self.started_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        self._t0 = time.perf_counter()
+        self.elapsed = None
+        self.spans = {} # nombre -> {"n", "total_s", "max_s"}
+        self.counters = {} # nombre -> entero
+        self.files = [] # [{"nombre", "segundos", "bytes", "resultado"}]
+        self._phase = None # (nombre, inicio) de la fase en curso
+        self._lock = threading.Lock()
+
+    @classmethod
+    def current(cls):
+        return getattr(cls._local, "metrics", None)
+
+    @contextlib.contextmanager
+    def activate(self):
+        previous = CaseMetrics.current()
+        CaseMetrics._local.metrics = self
+        try:
+            yield self
+        finally:
+            CaseMetrics._local.metrics = previous
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            span = self.spans.setdefault(name, {"n": 0, "total_s": 0.0, "max_s": 0.0})
+            span["n"] += 1
+            span["total_s"] += seconds
+            span["max_s"] = max(span["max_s"], seconds)
+
+    @contextlib.contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def phase(self, name):
+        """Cierra la fase en curso (se anota como fase_<nombre>) y empieza `name`."""
+        now = time.perf_counter()
+        if self._phase:
+            self.add_time(f"fase_{self._phase[0]}", now - self._phase[1])
+        self._phase = (name, now) if name else None
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def file_done(self, name, seconds, size, outcome):
+        with self._lock:
+            self.files.append({"nombre": name, "segundos": round(seconds, 3), "bytes": size, "resultado": outcome})
+            self.counters["bytes"] = self.counters.get("bytes", 0) + size
+
+    def finish(self):
+        self.phase(None)
+        self.elapsed = time.perf_counter() - self._t0
+
+    def rate(self):
+        """Bytes por segundo desde el inicio del expediente."""
+        elapsed = time.perf_counter() - self._t0
+        return self.counters.get("bytes", 0) / elapsed if elapsed > 0 else 0.0
+
+    def progress(self, done, total, started):
+        """Sufijo para la línea de progreso: ETA de lo que queda (según el ritmo desde `started`) y MB/s."""
+        parts = []
+        if done:
+            remaining = (time.perf_counter() - started) / done * (total - done)
+            parts.append(f"ETA {int(remaining // 60)}m{int(remaining % 60):02d}s")
+        parts.append(f"{self.rate() / (1024 * 1024):.2f} MB/s")
+        return " · ".join(parts)
+
+    def report(self, state=None):
+        with self._lock:
+            data = {
+                "radicado": self.radicado,
+                "inicio": self.started_at,
+                "duracion_s": round(self.elapsed if self.elapsed is not None else time.perf_counter() - self._t0, 3),
+                "fases": {k: {"n": v["n"], "total_s": round(v["total_s"], 3), "max_s": round(v["max_s"], 3)}
+                          for k, v in sorted(self.spans.items())},
+                "contadores": dict(sorted(self.counters.items())),
+                "archivos": list(self.files),
+            }
+        latencies = sorted(f["segundos"] for f in data["archivos"])
+        if latencies:
+            data["latencia_archivo_s"] = {"p50": latencies[len(latencies) // 2],
+                                          "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                                          "max": latencies[-1]}
+        if state is not None:
+            data["completo"] = state.completed
+            data["errores"] = len(state.errors)
+        return data
+
+    def write(self, case_dir, report):
+        try:
+            _atomic_write(os.path.join(case_dir, "informe.json"),
+                          json.dumps(report, ensure_ascii=False, indent=1).encode("utf-8"))
+        except OSError as e:
+            logger.log("No se pudo guardar el informe del expediente: %s", e, level=logging.WARNING)
+
+def _prom_escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def write_prometheus_textfile(path, reports):
+    """Vuelca informes de expediente en formato de texto de Prometheus (colector textfile de node_exporter).
+
+    Se escribe en un temporal y se renombra, como exige el colector, para que nunca lea un archivo a medias.
+    """
+    metrics = [
+        ("tyba_case_duration_seconds", "gauge", "Duración total del expediente."),
+        ("tyba_case_completed", "gauge", "1 si el expediente terminó sin error fatal."),
+        ("tyba_phase_seconds_total", "counter", "Tiempo acumulado por fase o espera."),
+        ("tyba_phase_count_total", "counter", "Veces que se ejecutó cada fase o espera."),
+        ("tyba_events_total", "counter", "Contadores del expediente (reintentos, archivos, bytes...)."),
+    ]
+    samples = {name: [] for name, _, _ in metrics}
+    for rep in reports:
+        r = f'radicado="{_prom_escape(rep["radicado"])}"'
+        samples["tyba_case_duration_seconds"].append(f"{{{r}}} {rep['duracion_s']}")
+        samples["tyba_case_completed"].append(f"{{{r}}} {1 if rep.get('completo') else 0}")
+        for phase, span in rep["fases"].items():
+            samples["tyba_phase_seconds_total"].append(f'{{{r},fase="{_prom_escape(phase)}"}} {span["total_s"]}')
+            samples["tyba_phase_count_total"].append(f'{{{r},fase="{_prom_escape(phase)}"}} {span["n"]}')
+        for name, value in rep["contadores"].items():
+            samples["tyba_events_total"].append(f'{{{r},evento="{_prom_escape(name)}"}} {value}')
+    lines = []
+    for name, kind, help_text in metrics:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines += [f"{name}{sample}" for sample in samples[name]]
+    _atomic_write(path, ("\n".join(lines) + "\n").encode("utf-8"))
+
+class BrowserPool:
+    """Un único Chromium de larga vida compartido por varios hilos a través de CDP."""
+    def __init__(self, downloader):
+        self.downloader = downloader
+        self.cdp_url = None
+        self._pw = None
+        self._browser = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        # Puerto libre para el endpoint de depuración remota
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        self._pw = sync_playwright().start()
+        self._browser = self.downloader._launch_browser(
+            self._pw, extra_args=[f"--remote-debugging-port={port}", "--remote-debugging-address=127.0.0.1"]
+        )
+        self.cdp_url = f"http://127.0.0.1:{port}"
+        logger.log("Navegador compartido iniciado en %s", self.cdp_url)
+
+    def connect(self):
+        """Conexión propia del hilo llamante (la API síncrona no se puede compartir entre hilos)."""
+        pw = sync_playwright().start()
+        try:
+            browser = pw.chromium.connect_over_cdp(self.cdp_url, slow_mo=self.downloader._slow_mo())
+        except Exception:
+            pw.stop()
+            raise
+        return pw, browser
+
+    def disconnect(self, pw, browser):
+        try: browser.close() # En conexiones CDP solo cierra los contextos propios y desconecta
+        except: pass
+        try: pw.stop()
+        except: pass
+
+    def close(self):
+        if self._browser:
+            try: self._browser.close()
+            except: pass
+            self._browser = None
+        if self._pw:
+            try: self._pw.stop()
+            except: pass
+            self._pw = None
+
+class CaseManifest:
+    """Manifiesto incremental del expediente (.manifiesto.json en la carpeta del caso).
+
+    Guarda, por huella de fila de grdActuaciones, los adjuntos encontrados y el resultado de cada
+    uno ("kept", "filtered" o "error"), para no volver a abrir actuaciones que no han cambiado.
+    """
+    VERSION = 1
+
+    def __init__(self, case_dir):
+        self.case_dir = case_dir
+        self.path = os.path.join(case_dir, ".manifiesto.json")
+        self.entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self.entries = data.get("actuaciones", {})
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def fingerprint(cells):
+        """Huella de una fila: todas sus celdas normalizadas (fecha, descripción, anotación...).
+
+        Los adjuntos no entran en la huella: la grilla de actuaciones no los muestra y conocerlos exige
+        abrir el detalle, justo lo que el manifiesto evita. Un adjunto añadido a una actuación ya
+        registrada solo se detecta con --completo.
+        """
+        normalized = "\x1f".join(" ".join(c.split()).upper() for c in cells)
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+    def complete_entry(self, key, skip_notifications, deep=False):
+        """Devuelve la entrada si la actuación quedó completa y sus archivos siguen en disco e íntegros; si no, None."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        for f_info in entry["files"]:
+            outcome = f_info["outcome"]
+            if outcome == "kept":
+                f_path = os.path.join(self.case_dir, f"{f_info['name']}.pdf")
+                if pdf_integrity_problem(f_path, deep) is not None:
+                    return None
+            elif outcome == "filtered":
+                # Si ahora no se filtran notificaciones, hay que descargarla
+                if not skip_notifications:
+                    return None
+            else:
+                return None
+        return entry
+
+    def record(self, key, date, name, outcomes):
+        self.entries[key] = {
+            "date": date,
+            "name": name,
+            "count": len(outcomes),
+            "files": [{"name": f_name, "outcome": outcome} for f_name, outcome in outcomes.items()],
+            "updated_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        self.save()
+
+    def mark_filtered(self, names):
+        """Marca como filtrados los archivos que se retiraron fuera de línea (reclasificación)."""
+        names = set(names)
+        changed = False
+        for entry in self.entries.values():
+            for f_info in entry["files"]:
+                if f_info["name"] in names and f_info["outcome"] == "kept":
+                    f_info["outcome"] = "filtered"
+                    changed = True
+        if changed:
+            self.save()
+
+    def save(self):
+        # Se guarda tras cada actuación: si el proceso muere no se pierde lo ya sincronizado
+        try:
+            data = json.dumps({"version": self.VERSION, "actuaciones": self.entries}, ensure_ascii=False, indent=1)
+            _atomic_write(self.path, data.encode("utf-8"))
+        except Exception as e:
+            logger.log("No se pudo guardar el manifiesto: %s", e, level=logging.WARNING)
+
+class DocumentRecord:
+    """Un documento del expediente en el índice: de qué pestaña viene, su fecha, tamaño, hash y qué decidió el filtro."""
+    __slots__ = ("name", "tab", "date", "size", "sha256", "decision")
+
+    # Columnas de indice.json / indice.csv, en orden
+    COLUMNS = ("fecha", "origen", "nombre", "archivo", "bytes", "sha256", "decision")
+
+    def __init__(self, name, tab, date, size=None, sha256=None, decision="conservado"):
+        self.name = name
+        self.tab = tab # "actuacion" o "archivo"
+        self.date = date
+        self.size = size
+        self.sha256 = sha256
+        self.decision = decision # "conservado", "filtrado", "filtrado_por_nombre" o "pendiente" (en clasificación)
+
+    @property
+    def kept(self):
+        return self.decision == "conservado"
+
+    def as_dict(self):
+        return {"fecha": self.date, "origen": self.tab, "nombre": self.name,
+                "archivo": f"{self.name}.pdf" if self.kept else None,
+                "bytes": self.size, "sha256": self.sha256, "decision": self.decision}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["nombre"], d["origen"], d["fecha"], d.get("bytes"), d.get("sha256"), d.get("decision", "conservado"))
+
+class DocumentRegistry:
+    """Índice de documentos del expediente, por (pestaña, nombre) y por SHA-256.
+
+    Cada documento se agrega a indice.jsonl en cuanto llega, así un proceso interrumpido deja constancia de
+    lo descargado; `export()` escribe al final indice.json, indice.csv y lista.txt, y compacta indice.jsonl.
+    El diario se abre para agregar: una nueva ejecución no borra lo que dejó una interrumpida.
+    """
+    def __init__(self, case_dir, previous=None):
+        self.case_dir = case_dir
+        self.journal_path = os.path.join(case_dir, "indice.jsonl")
+        self.records = {} # (pestaña, nombre) -> DocumentRecord, en orden de llegada
+        self.by_digest = {} # sha256 -> [DocumentRecord]
+        self.damaged = {} # nombre -> motivo, de los archivos dañados encontrados en disco
+        # Índice de la ejecución anterior: evita recalcular el hash de los archivos que no cambiaron de tamaño
+        self._previous = previous if previous is not None else self._load_records(case_dir)
+        self._journal = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_records(case_dir):
+        records = []
+        try:
+            with open(os.path.join(case_dir, "indice.json"), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            records = [DocumentRecord.from_dict(d) for d in data.get("documentos", [])]
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+        # Lo que una ejecución interrumpida dejó en el diario es más reciente que indice.json
+        try:
+            with open(os.path.join(case_dir, "indice.jsonl"), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(DocumentRecord.from_dict(json.loads(line)))
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        pass # Línea a medio escribir
+        except OSError:
+            pass
+        return {(r.tab, r.name): r for r in records}
+
+    @classmethod
+    def load(cls, case_dir):
+        """Registro guardado en indice.json (para herramientas fuera de línea), o None si no hay índice."""
+        previous = cls._load_records(case_dir)
+        if not previous:
+            return None
+        registry = cls(case_dir, previous=previous)
+        for record in previous.values():
+            registry._index(record)
+        return registry
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def kept(self, tab=None):
+        return [r for r in self.records.values() if r.kept and (tab is None or r.tab == tab)]
+
+    def add(self, tab, name, date, path=None, size=None, digest=None, decision="conservado"):
+        """Registra un documento; si ya estaba en el índice no hace nada y devuelve False.
+
+        Con `path` se completan tamaño y hash desde el disco cuando no se conocen.
+        """
+        key = (tab, name)
+        with self._lock:
+            if key in self.records:
+                return False
+        if path is not None and os.path.exists(path):
+            if size is None:
+                size = os.path.getsize(path)
+            if digest is None:
+                prev = self._previous.get(key)
+                digest = prev.sha256 if prev is not None and prev.size == size and prev.sha256 else _file_sha256(path)
+        record = DocumentRecord(name, tab, date, size, digest, decision)
+        with self._lock:
+            if key in self.records:
+                return False
+            self._index(record)
+            self._append(record)
+        return True
+
+    def duplicates(self):
+        """Grupos de documentos conservados con el mismo contenido (mismo SHA-256)."""
+        groups = ([r for r in recs if r.kept] for recs in self.by_digest.values())
+        return [g for g in groups if len(g) > 1]
+
+    def mark_filtered(self, names):
+        """Marca como filtrados los documentos retirados fuera de línea (reclasificación)."""
+        changed = False
+        with self._lock:
+            for record in self.records.values():
+                if record.name in names and record.kept:
+                    record.decision = "filtrado"
+                    self._append(record)
+                    changed = True
+        return changed
+
+    def resolve(self, tab, name, decision):
+        """Fija la decisión del filtro de un documento registrado como "pendiente" (filtro en segundo plano)."""
+        with self._lock:
+            record = self.records.get((tab, name))
+            if record is None:
+                return
+            record.decision = decision
+            self._append(record)
+
+    def flag_damaged(self, name, reason):
+        with self._lock:
+            self.damaged[name] = reason
+
+    def damaged_report(self):
+        """[{nombre, motivo, estado}] de los archivos dañados: si se volvieron a descargar, los descartó el filtro o siguen pendientes."""
+        report = []
+        for name, reason in self.damaged.items():
+            records = [r for r in self.records.values() if r.name == name]
+            if any(r.kept for r in records):
+                status = "vuelto a descargar"
+            elif records:
+                status = "descartado por el filtro"
+            else:
+                status = "pendiente (no se pudo descargar)"
+            report.append({"nombre": name, "motivo": reason, "estado": status})
+        return report
+
+    def _index(self, record):
+        self.records[(record.tab, record.name)] = record
+        if record.sha256:
+            self.by_digest.setdefault(record.sha256, []).append(record)
+
+    def _append(self, record):
+        try:
+            if self._journal is None:
+                self._journal = open(self.journal_path, "a", encoding="utf-8")
+            self._journal.write(json.dumps(record.as_dict(), ensure_ascii=False) + "\n")
+            self._journal.flush()
+        except OSError as e:
+            logger.log("No se pudo escribir en indice.jsonl: %s", e, level=logging.WARNING)
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def export(self, radicado, auto_admite_date="Sin fecha", errors=()):
+        """Escribe indice.json, indice.csv, indice.jsonl (completo) y lista.txt."""
+        self.close()
+        records = list(self.records.values())
+        rows = [r.as_dict() for r in records]
+        damaged = self.damaged_report()
+        data = {"radicado": radicado, "generado": time.strftime('%Y-%m-%d %H:%M:%S'),
+                "fecha_auto_admite": auto_admite_date, "documentos": rows, "errores": list(errors), "danados": damaged}
+        _atomic_write(os.path.join(self.case_dir, "indice.json"),
+                      json.dumps(data, ensure_ascii=False, indent=1).encode("utf-8"))
+        _atomic_write(self.journal_path, "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows).encode("utf-8"))
+
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=DocumentRecord.COLUMNS, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+        _atomic_write(os.path.join(self.case_dir, "indice.csv"), buf.getvalue().encode("utf-8"))
+
+        lines = [f"EXPEDIENTE: {radicado}", "="*50, f"{'FECHA':<12} | {'DOCUMENTO'}", "-"*50]
+        lines += [f"{r.date:<12} | {r.name}" for r in records if r.kept and r.tab == "archivo"]
+        lines.append("-"*50)
+        lines += [f"{r.date:<12} | {r.name}" for r in records if r.kept and r.tab == "actuacion"]
+        if damaged:
+            lines.append("\n" + "!"*20 + " ARCHIVOS DAÑADOS EN DISCO " + "!"*20)
+            lines += [f"- {d['nombre']}: {d['motivo']} -> {d['estado']}" for d in damaged]
+        if errors:
+            lines.append("\n" + "!"*20 + " ERRORES DURANTE LA DESCARGA " + "!"*20)
+            lines += [f"- {err}" for err in errors]
+        _atomic_write(os.path.join(self.case_dir, "lista.txt"), ("\n".join(lines) + "\n").encode("utf-8"))
+
+class SessionCache:
+    """Caché persistente de búsquedas ya resueltas: cookies (storage_state), URL y HTML del detalle por radicado.
+
+    El detalle es fruto de postbacks: un GET de su URL solo devuelve el formulario de búsqueda. Por eso se
+    guarda también el HTML (con su __VIEWSTATE), que se reenvía para volver a él (TybaDownloader._replay_detail).
+    """
+    def __init__(self, cache_dir, ttl_seconds):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+
+    def _path(self, radicado):
+        return os.path.join(self.cache_dir, f"{radicado}.json")
+
+    def load(self, radicado):
+        """Devuelve la sesión guardada si existe y no ha caducado; si caducó la elimina."""
+        path = self._path(radicado)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        age = time.time() - entry.get("saved_at", 0)
+        if age > self.ttl_seconds or not entry.get("storage_state") or not entry.get("url") or not entry.get("html"):
+            logger.log("Sesión en caché caducada para %s (%ss).", radicado, int(age))
+            self.invalidate(radicado)
+            return None
+        return entry
+
+    def save(self, radicado, storage_state, url, page_html):
+        entry = {"radicado": radicado, "saved_at": time.time(), "url": url, "storage_state": storage_state, "html": page_html}
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self._path(radicado) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            try: os.chmod(tmp_path, 0o600) # Contiene cookies de sesión
+            except OSError: pass
+            os.replace(tmp_path, self._path(radicado))
+        except Exception as e:
+            logger.log("No se pudo guardar la sesión de %s: %s", radicado, e, level=logging.WARNING)
+
+    def invalidate(self, radicado):
+        try: os.remove(self._path(radicado))
+        except OSError: pass
+
+class ParallelAttachmentEngine:
+    """Motor que descarga en paralelo los PDF de las vistas de detalle (--motor async).
+
+    Un único motor (un pool de hilos) sirve a todos los expedientes e hilos del proceso. El hilo de
+    navegación le entrega URLs de Descargando.aspx junto con el HttpClient del expediente y recibe futuros
+    que se resuelven a medida que el generador responde. Cada transferencia usa HttpClient.download
+    (cookies del expediente, streaming a .part con su huella, reanudación con Range). Un semáforo por
+    cliente limita a `max_parallel` las simultáneas de cada expediente: `submit` espera turno cuando ya
+    las tiene todas en curso, así ningún expediente acapara los hilos del pool.
+    """
+    MAX_TRANSFERS = 64 # Transferencias simultáneas entre todos los expedientes
+
+    def __init__(self, max_parallel=4):
+        self.max_parallel = max(1, int(max_parallel))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._limits = weakref.WeakKeyDictionary() # HttpClient -> threading.BoundedSemaphore
+
+    def start(self):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.MAX_TRANSFERS, thread_name_prefix="tyba-dl")
+        return self
+
+    def _limit(self, client):
+        with self._lock:
+            limit = self._limits.get(client)
+            if limit is None:
+                limit = self._limits[client] = threading.BoundedSemaphore(self.max_parallel)
+            return limit
+
+    def submit(self, client, url, path, timeout=120000, accept=None, require_pdf=False):
+        """Programa la descarga de `url` en `path` con el HttpClient `client` del expediente.
+
+        Devuelve un concurrent.futures.Future con (tamaño, sha256, conservado), como HttpClient.download.
+        """
+        limit = self._limit(client)
+        limit.acquire()
+        try:
+            future = self._executor.submit(self._download, logger.context(), client, url, path, timeout=timeout / 1000,
+                                           accept=accept, require_pdf=require_pdf)
+        except Exception:
+            limit.release()
+            raise
+        future.add_done_callback(lambda _: limit.release())
+        return future
+
+    @staticmethod
+    def _download(ctx, client, *args, **kwargs):
+        # Los registros del hilo del pool (reanudaciones, cortes) van al registro.jsonl del expediente
+        with logger.bound(ctx):
+            return client.download(*args, **kwargs)
+
+    def close(self):
+        if self._executor is None: return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+def _check_body(size, head, min_size=100, require_pdf=False):
+    """Valida una respuesta del generador. `head` son sus primeros bytes (el portal responde HTML cuando falla)."""
+    if not head.lstrip().startswith(b"%PDF-") and _SESSION_EXPIRED_RE.search(head):
+        raise SessionExpired("el generador indica que la sesión expiró")
+    if size <= min_size:
+        raise HttpStatusError(f"Respuesta demasiado pequeña ({size} bytes)")
+    if require_pdf and not head.lstrip().startswith(b"%PDF-"):
+        raise HttpStatusError("La respuesta no es un PDF")
+
+PDF_MIN_SIZE = 1000 # Por debajo de esto un "PDF" del portal es una página de error
+PDF_TAIL_WINDOW = 4096 # Bytes finales donde deben estar startxref y %%EOF (admite algo de basura tras el final)
+
+def pdf_integrity_problem(path, deep=False):
+    """Revisión barata de un PDF en disco, sin analizarlo: cabecera `%PDF-` al inicio y `startxref` / `%%EOF` al final.
+
+    El archivo se mapea en memoria y solo se leen su primer KB y sus últimos bytes, así que cuesta lo mismo
+    para 1 KB que para 50 MB. Con `deep` se cuentan además las páginas con pypdf. Devuelve None si el
+    archivo parece completo, o el motivo del fallo.
+    """
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= PDF_MIN_SIZE:
+                return f"demasiado pequeño ({size} bytes)"
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                head = mm[:1024]
+                tail = mm[max(0, size - PDF_TAIL_WINDOW):]
+    except (OSError, ValueError) as e:
+        return f"no se pudo leer ({e})"
+    if b"%PDF-" not in head:
+        return "página HTML guardada como PDF" if head.lstrip()[:1] == b"<" else "sin cabecera %PDF-"
+    if b"%%EOF" not in tail:
+        return "truncado (sin %%EOF)"
+    if b"startxref" not in tail:
+        return "truncado (sin startxref)"
+    if deep:
+        try:
+            if len(PdfReader(path).pages) == 0:
+                return "sin páginas"
+        except Exception as e:
+            return f"estructura inválida ({e})"
+    return None
+
+def _atomic_write(path, data):
+    """Escribe `data` en un temporal junto al destino y lo renombra: nunca queda un PDF a medias."""
+    part_path = path + ".part"
+    with open(part_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(part_path, path)
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ContentStore:
+    """Almacén direccionado por contenido: cada PDF se guarda una vez, con su SHA-256 como nombre.
+
+    Las carpetas de los expedientes lo exponen con el nombre legible mediante enlaces duros
+    (o simbólicos, o en último caso una copia si el sistema de archivos no admite enlaces).
+    """
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def object_path(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.pdf")
+
+    def is_linked(self, path):
+        try:
+            return os.path.islink(path) or os.stat(path).st_nlink > 1
+        except OSError:
+            return False
+
+    def adopt(self, path, digest):
+        """Mueve `path` al almacén (o descarta la copia si ya estaba) y lo reemplaza por un enlace."""
+        obj = self.object_path(digest)
+        with self._lock:
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            if os.path.exists(obj):
+                if os.path.samefile(obj, path):
+                    return obj
+            else:
+                shutil.move(path, obj)
+            tmp_path = path + ".lnk"
+            try:
+                os.link(obj, tmp_path)
+            except OSError:
+                try: os.symlink(os.path.abspath(obj), tmp_path)
+                except OSError: shutil.copyfile(obj, tmp_path)
+            os.replace(tmp_path, path)
+        return obj
+
+class SessionExpired(Exception):
+    """El portal ya no reconoce la sesión ASP.NET del expediente: hay que repetir la búsqueda, no reintentar."""
+
+class CaptchaMismatch(Exception):
+    """El portal rechazó el CAPTCHA de la búsqueda."""
+
+class CaseNotFound(Exception):
+    """El portal no tiene el radicado buscado: reintentar no sirve."""
+
+# Avisos de sesión vencida del portal (también en páginas con entidades HTML o sin tildes)
+_SESSION_EXPIRED_RE = re.compile(rb"sesi(?:o|\xc3\xb3|&oacute;)n\s+(?:ha\s+)?(?:expirado|caducado|expir\xc3\xb3|finalizado)|session\s+(?:has\s+)?expired",
+                                 re.IGNORECASE)
+
+class HttpStatusError(Exception):
+    """El servidor respondió, pero con un estado o contenido inválido (reintentar por otra vía no ayuda)."""
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+class HttpClient:
+    """Cliente HTTP mínimo: conexiones keep-alive reutilizadas y descargas en streaming a disco.
+
+    Las cookies se copian del BrowserContext, así comparte la sesión ASP.NET con el navegador.
+    Las conexiones son por hilo, porque http.client no es thread-safe.
+    """
+    CHUNK_SIZE = 256 * 1024
+    MEMORY_LIMIT = 8 * 1024 * 1024 # Cuerpos hasta este tamaño se clasifican en memoria
+    RESUME_ATTEMPTS = 5 # Reanudaciones seguidas tras cortes de conexión dentro de una misma descarga
+    _CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+    def __init__(self, user_agent=None):
+        self.user_agent = user_agent
+        self.cookies = [] # Formato de Playwright: [{name, value, domain, path, secure, ...}]
+        self._local = threading.local()
+
+    def set_cookies(self, cookies):
+        # Las del navegador mandan; se conservan las que solo llegaron por este cliente (postbacks HTTP)
+        cookies = list(cookies)
+        names = {c["name"] for c in cookies}
+        self.cookies = [c for c in self.cookies if c["name"] not in names] + cookies
+
+    def _cookie_header(self, parts):
+        host = (parts.hostname or "").lower()
+        path = parts.path or "/"
+        pairs = []
+        for c in self.cookies:
+            domain = c.get("domain", "").lower().lstrip(".")
+            if not (host == domain or host.endswith("." + domain)): continue
+            if not path.startswith(c.get("path") or "/"): continue
+            if c.get("secure") and parts.scheme != "https": continue
+            pairs.append(f"{c['name']}={c['value']}")
+        return "; ".join(pairs)
+
+    def _store_cookies(self, parts, response):
+        for header in response.headers.get_all("Set-Cookie") or []:
+            jar = http.cookies.SimpleCookie()
+            try: jar.load(header)
+            except http.cookies.CookieError: continue
+            for name, morsel in jar.items():
+                self.cookies = [c for c in self.cookies if c["name"] != name]
+                self.cookies.append({"name": name, "value": morsel.value, "domain": morsel["domain"] or parts.hostname,
+                                     "path": morsel["path"] or "/", "secure": bool(morsel["secure"])})
+
+    def _connection(self, parts, timeout):
+        pool = getattr(self._local, "pool", None)
+        if pool is None:
+            pool = self._local.pool = {}
+        key = (parts.scheme, parts.hostname, parts.port)
+        conn = pool.get(key)
+        if conn is None:
+            cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            conn = pool[key] = cls(parts.hostname, parts.port, timeout=timeout)
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn
+
+    def _drop_connection(self, parts):
+        pool = getattr(self._local, "pool", {})
+        conn = pool.pop((parts.scheme, parts.hostname, parts.port), None)
+        if conn: conn.close()
+
+    def request(self, method, url, body=None, headers=None, timeout=60, max_redirects=5):
+        """Envía una petición y devuelve la respuesta sin leer el cuerpo (el llamador lo consume)."""
+        for _ in range(max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            target = parts.path or "/"
+            if parts.query: target += "?" + parts.query
+            req_headers = {"User-Agent": self.user_agent or "Mozilla/5.0", "Accept": "*/*"}
+            cookie = self._cookie_header(parts)
+            if cookie: req_headers["Cookie"] = cookie
+            req_headers.update(headers or {})
+
+            # Una conexión keep-alive pudo cerrarla el servidor: reintentamos una vez con una nueva
+            for fresh in (False, True):
+                conn = self._connection(parts, timeout)
+                try:
+                    conn.request(method, target, body=body, headers=req_headers)
+                    response = conn.getresponse()
+                    break
+                except (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                        http.client.BadStatusLine, BrokenPipeError, ConnectionResetError):
+                    self._drop_connection(parts)
+                    if fresh: raise
+                except Exception:
+                    self._drop_connection(parts)
+                    raise
+
+            self._store_cookies(parts, response)
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                response.read()
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                if response.status == 303 or (response.status in (301, 302) and method == "POST"):
+                    method, body = "GET", None
+                continue
+            if response.will_close:
+                # El servidor cerrará la conexión al terminar este cuerpo; no la reutilizamos
+                self._local.pool.pop((parts.scheme, parts.hostname, parts.port), None)
+            return response
+        raise HttpStatusError(f"Demasiadas redirecciones ({url})")
+
+    def _part_meta(self, part_path):
+        try:
+            with open(part_path + ".json", "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _drop_part(self, part_path):
+        for p in (part_path, part_path + ".json"):
+            try: os.remove(p)
+            except OSError: pass
+
+    def _resume_point(self, url, part_path):
+        """Bytes ya descargados en `part_path` que se pueden reanudar (0 si no hay nada aprovechable)."""
+        meta = self._part_meta(part_path)
+        if meta is None or not os.path.exists(part_path):
+            self._drop_part(part_path)
+            return 0, None
+        # Sin validador (ETag / Last-Modified) solo se reanuda exactamente la misma URL
+        if meta.get("url") != url and not (meta.get("etag") or meta.get("last_modified")):
+            self._drop_part(part_path)
+            return 0, None
+        return os.path.getsize(part_path), meta
+
+    def download(self, url, path, timeout=120, min_size=100, accept=None, require_pdf=False):
+        """Descarga `url` en `path` sin dejar nunca un archivo a medias.
+
+        Los cuerpos pequeños (Content-Length conocido, hasta MEMORY_LIMIT) se leen en memoria; los
+        grandes se escriben en bloques a `path`.part. Si el servidor admite rangos (Accept-Ranges: bytes),
+        el .part se conserva (con sus validadores en `path`.part.json) y una conexión cortada se reanuda
+        con Range, en esta misma llamada o en una ejecución posterior. Antes de colocar el archivo en su
+        sitio se llama a `accept(bytes_o_ruta, sha256)`: si devuelve False el documento se descarta.
+
+        Devuelve (tamaño, sha256, conservado): tamaño y huella salen de los bytes recibidos.
+        """
+        part_path = path + ".part"
+        resumes = 0
+        while True:
+            offset, meta = self._resume_point(url, part_path)
+            headers = {}
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+                validator = meta.get("etag") or meta.get("last_modified")
+                if validator: headers["If-Range"] = validator
+
+            response = self.request("GET", url, headers=headers, timeout=timeout)
+            total = None
+            if response.status == 206 and offset:
+                m = self._CONTENT_RANGE_RE.match(response.getheader("Content-Range") or "")
+                if not m or int(m.group(1)) != offset:
+                    # El servidor devolvió otro tramo: empezamos de cero
+                    response.read()
+                    self._drop_part(part_path)
+                    continue
+                total = int(m.group(3)) if m.group(3) != "*" else None
+            elif response.status == 416 and offset:
+                response.read()
+                self._drop_part(part_path)
+                continue
+            elif response.status == 200:
+                if offset:
+                    logger.log("  - El servidor no aceptó la reanudación; se descarga desde el inicio.")
+                offset = 0
+                length = response.getheader("Content-Length")
+                total = int(length) if length and length.isdigit() else None
+            else:
+                response.read()
+                raise HttpStatusError(f"Respuesta inválida del servidor (HTTP {response.status})", response.status)
+
+            if offset == 0 and total is not None and total <= self.MEMORY_LIMIT:
+                self._drop_part(part_path)
+                try:
+                    body = response.read()
+                except BaseException:
+                    self.close()
+                    raise
+                if len(body) != total:
+                    raise Exception(f"Descarga truncada ({len(body)} de {total} bytes)")
+                digest = hashlib.sha256(body).hexdigest()
+                _check_body(len(body), body[:1024], min_size, require_pdf)
+                if accept and not accept(body, digest):
+                    return len(body), digest, False
+                _atomic_write(path, body)
+                return len(body), digest, True
+
+            resumable = response.status == 206 or (response.getheader("Accept-Ranges") or "").lower() == "bytes"
+            if resumable:
+                # Se escribe antes de recibir nada: el progreso sobrevive aunque el proceso muera
+                _atomic_write(part_path + ".json", json.dumps({
+                    "url": url, "total": total,
+                    "etag": response.getheader("ETag") if response.status == 200 else (meta or {}).get("etag"),
+                    "last_modified": response.getheader("Last-Modified") if response.status == 200 else (meta or {}).get("last_modified"),
+                }).encode("utf-8"))
+            else:
+                self._drop_part(part_path)
+
+            try:
+                size, head, digest = self._stream(response, part_path, offset)
+                if total is not None and size != total:
+                    raise http.client.IncompleteRead(b"", total - size)
+            except (OSError, http.client.HTTPException) as e:
+                # La conexión quedó con datos a medio leer: no se puede reutilizar
+                self.close()
+                got = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                if resumable and got > offset and resumes < self.RESUME_ATTEMPTS:
+                    resumes += 1
+                    logger.log("  - Conexión cortada en %s bytes (%s); se reanuda (intento %s).", got, e, resumes)
+                    continue
+                if not (resumable and got):
+                    self._drop_part(part_path)
+                if total is not None and got < total:
+                    raise Exception(f"Descarga truncada ({got} de {total} bytes)") from e
+                raise
+            except BaseException:
+                self.close()
+                # Una interrupción conserva el .part reanudable para la próxima ejecución
+                if not resumable: self._drop_part(part_path)
+                raise
+
+            try:
+                _check_body(size, head, min_size, require_pdf)
+            except HttpStatusError:
+                self._drop_part(part_path)
+                raise
+            if accept and not accept(part_path, digest):
+                self._drop_part(part_path)
+                return size, digest, False
+            os.replace(part_path, path)
+            self._drop_part(part_path)
+            return size, digest, True
+
+    def _stream(self, response, part_path, offset=0):
+        """Escribe el cuerpo a `part_path` (a continuación de `offset` bytes ya presentes). Devuelve (tamaño, cabecera, sha256)."""
+        digest = hashlib.sha256()
+        head = b""
+        size = 0
+        if offset:
+            # Los bytes ya presentes cuentan para la huella y para la validación de la cabecera
+            with open(part_path, 'rb') as f:
+                while True:
+                    chunk = f.read(self.CHUNK_SIZE)
+                    if not chunk: break
+                    if len(head) < 1024: head += chunk[:1024]
+                    digest.update(chunk)
+                    size += len(chunk)
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            while True:
+                chunk = response.read(self.CHUNK_SIZE)
+                if not chunk: break
+                if len(head) < 1024: head += chunk[:1024]
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        return size, head, digest.hexdigest()
+
+    def close(self):
+        for conn in getattr(self._local, "pool", {}).values():
+            try: conn.close()
+            except: pass
+        self._local.pool = {}
+
+class Attachment:
+    """Adjunto de una actuación pendiente de descarga."""
+    def __init__(self, index, button, name, path, row_html=""):
+        self.index = index
+        self.button = button
+        self.name = name
+        self.path = path
+        self.row_html = row_html
+
+# Lectura de una grilla completa en una sola ida y vuelta al navegador. Las celdas usan textContent
+# (como all_text_contents, así las huellas del manifiesto no cambian) y el texto de la fila innerText.
+_GRID_JS = """([gridId, buttonPart]) => {
+    const grid = document.getElementById(gridId);
+    const headers = grid && grid.rows.length ? Array.from(grid.rows[0].cells).map(c => c.textContent) : [];
+    const rows = [];
+    for (const btn of document.querySelectorAll(`input[id*='${buttonPart}']`)) {
+        const tr = btn.parentElement && btn.parentElement.parentElement;
+        if (!tr) continue;
+        const m = btn.id.match(/_(\\d+)$/);
+        const style = getComputedStyle(btn);
+        rows.push({
+            index: m ? parseInt(m[1], 10) : rows.length,
+            button_id: btn.id,
+            cells: Array.from(tr.cells || []).map(c => c.textContent),
+            text: tr.innerText || "",
+            html: tr.outerHTML,
+            visible: btn.getClientRects().length > 0 && style.visibility !== "hidden",
+        });
+    }
+    return {headers, rows};
+}"""
+
+class GridRow:
+    """Fila de una grilla del portal (grdActuaciones, grdArchivos, grdArchivosActuaciones)."""
+    def __init__(self, record, date_idx=-1, desc_idx=-1):
+        self.index = record["index"]
+        self.button_id = record["button_id"]
+        self.cells = record["cells"]
+        self.text = record["text"]
+        self.html = record["html"]
+        self.visible = record["visible"]
+        self.date = self._cell(date_idx)
+        self.description = self._cell(desc_idx)
+
+    def _cell(self, idx):
+        if idx == -1 or idx >= len(self.cells):
+            return None
+        return self.cells[idx].strip()
+
+def grid_columns(headers):
+    """Índices de las columnas de fecha y descripción según la cabecera (-1 si no aparecen)."""
+    date_idx = -1
+    desc_idx = -1
+    for idx, h in enumerate(headers):
+        text = h.upper().strip()
+        if "FECHA" in text and "REGISTRO" not in text: date_idx = idx
+        if "ACTUACIÓN" in text or "DESCRIPCIÓN" in text: desc_idx = idx
+    return date_idx, desc_idx
+
+def read_grid(page: Page, grid_id, button_part):
+    """Lee con un solo page.evaluate todas las filas de una grilla que tienen botón de acción."""
+    data = page.evaluate(_GRID_JS, [grid_id, button_part]) or {"headers": [], "rows": []}
+    date_idx, desc_idx = grid_columns(data["headers"])
+    return [GridRow(record, date_idx, desc_idx) for record in data["rows"]]
+
+class GeneratorUrlTemplate:
+    """Aprende cómo se construye la URL de Descargando.aspx a partir del HTML de la fila de cada adjunto.
+
+    Cada popup resuelto aporta un ejemplo (HTML de la fila, URL). Los parámetros cuyo valor aparece
+    en el HTML se extraen con el prefijo literal más corto que los identifica; el resto se toma como
+    constante. El patrón solo se usa tras acertar la URL de un popup posterior, para no guardar nunca
+    un PDF con el nombre de otro adjunto.
+    """
+    _DIRECT_RE = re.compile(r"""[^'"\s()]*Descargando\.aspx[^'"\s()]*""", re.IGNORECASE)
+    _MAX_REJECTIONS = 2
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.endpoint = None
+        self.params = None # [(clave, valor constante | None, regex | None)]
+        self.confirmed = False
+        self.rejections = 0
+
+    def _direct(self, row_html):
+        # Si el propio botón lleva la URL del generador (window.open en onclick) la usamos tal cual
+        m = self._DIRECT_RE.search(html_lib.unescape(row_html or ""))
+        if m:
+            return urllib.parse.urljoin(self.base_url, m.group(0).replace("\\", "/"))
+        return None
+
+    def learn(self, row_html, url):
+        if not row_html or self.rejections >= self._MAX_REJECTIONS: return
+        row_html = html_lib.unescape(row_html)
+        parts = urllib.parse.urlsplit(url)
+        endpoint = urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+        # ¿El patrón ya aprendido habría acertado? Entonces queda confirmado
+        if self.params is not None and not self.confirmed:
+            predicted = self.guess(row_html, require_confirmed=False)
+            if predicted and self._same_url(predicted, url):
+                self.confirmed = True
+                logger.log("Patrón de URL del generador confirmado: se activa la descarga sin popup.")
+                return
+
+        params = []
+        variable = False
+        for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True):
+            pattern = self._locate(row_html, value) if len(value) >= 3 else None
+            params.append((key, None if pattern else value, pattern))
+            variable = variable or pattern is not None
+        # Sin parámetros variables todas las URLs serían iguales: el servidor elige el documento por sesión
+        if not variable:
+            return
+        if (endpoint, params) != (self.endpoint, self.params):
+            self.endpoint, self.params, self.confirmed = endpoint, params, False
+
+    @staticmethod
+    def _same_url(a, b):
+        a, b = urllib.parse.urlsplit(a), urllib.parse.urlsplit(b)
+        return (a.netloc, a.path.lower(), urllib.parse.parse_qsl(a.query, keep_blank_values=True)) == \
+               (b.netloc, b.path.lower(), urllib.parse.parse_qsl(b.query, keep_blank_values=True))
+
+    @staticmethod
+    def _locate(row_html, value):
+        idx = row_html.find(value)
+        if idx == -1: return None
+        for n in range(4, 33):
+            if n > idx: break
+            prefix = row_html[idx - n:idx]
+            if row_html.count(prefix) != 1: continue
+            pattern = re.escape(prefix) + r"""([^"'&<>\s,;)]+)"""
+            m = re.search(pattern, row_html)
+            if m and m.group(1) == value:
+                return pattern
+        return None
+
+    def guess(self, row_html, require_confirmed=True):
+        direct = self._direct(row_html)
+        if direct:
+            return direct
+        if self.params is None or (require_confirmed and not self.confirmed):
+            return None
+        row_html = html_lib.unescape(row_html or "")
+        query = []
+        for key, value, pattern in self.params:
+            if pattern:
+                m = re.search(pattern, row_html)
+                if not m: return None
+                value = m.group(1)
+            query.append((key, value))
+        return self.endpoint + "?" + urllib.parse.urlencode(query)
+
+    def reject(self):
+        """Una URL deducida falló: se vuelve a exigir confirmación y, tras varios fallos, se desactiva."""
+        self.rejections += 1
+        self.confirmed = False
+        if self.rejections >= self._MAX_REJECTIONS:
+            self.params = None
+            logger.log("Vía rápida del generador desactivada para este expediente tras varios fallos.", level=logging.WARNING)
+
+class _GridParser(HTMLParser):
+    """Versión para HTML estático de _GRID_JS: filas con botón de acción de una grilla."""
+    def __init__(self, source, grid_id, button_part):
+        super().__init__(convert_charrefs=True)
+        self.source = source
+        self.grid_id = grid_id
+        self.button_part = button_part
+        self.headers = None
+        self.records = []
+        self._line_starts = [0] + [m.end() for m in re.finditer("\n", source)]
+        self._tables = [] # ids de las tablas abiertas
+        self._rows = [] # filas abiertas, de la exterior a la interior
+
+    def _offset(self):
+        line, col = self.getpos()
+        return self._line_starts[line - 1] + col
+
+    def handle_starttag(self, tag, attrs):
+        a = dict(attrs)
+        if tag == "table":
+            self._tables.append(a.get("id"))
+        elif tag == "tr":
+            self._rows.append({"start": self._offset(), "table": self._tables[-1] if self._tables else None,
+                               "cells": [], "inner": [], "buttons": []})
+        elif tag in ("td", "th") and self._rows:
+            self._rows[-1]["cells"].append("")
+            self._rows[-1]["inner"].append("")
+        elif tag == "br" and self._rows and self._rows[-1]["inner"]:
+            self._rows[-1]["inner"][-1] += "\n"
+        elif tag == "input" and self._rows and self.button_part in (a.get("id") or ""):
+            style = (a.get("style") or "").replace(" ", "").lower()
+            visible = (a.get("type") or "").lower() != "hidden" and "display:none" not in style and "visibility:hidden" not in style
+            self._rows[-1]["buttons"].append((a["id"], visible))
+
+    def handle_endtag(self, tag):
+        if tag == "table" and self._tables:
+            self._tables.pop()
+        elif tag == "tr" and self._rows:
+            row = self._rows.pop()
+            end = self.source.find(">", self._offset()) + 1
+            if row["table"] == self.grid_id and self.headers is None:
+                self.headers = row["cells"]
+            # Aproximación de innerText: espacios colapsados, <br> como salto de línea y celdas separadas por tabulador
+            text = "\t".join("\n".join(" ".join(line.split()) for line in cell.split("\n")).strip() for cell in row["inner"])
+            for button_id, visible in row["buttons"]:
+                m = re.search(r"_(\d+)$", button_id)
+                self.records.append({
+                    "index": int(m.group(1)) if m else len(self.records),
+                    "button_id": button_id,
+                    "cells": row["cells"],
+                    "text": text,
+                    "html": self.source[row["start"]:end],
+                    "visible": visible,
+                })
+
+    def handle_data(self, data):
+        # Como textContent: el texto cuenta para la celda abierta de cada fila que lo contiene
+        for row in self._rows:
+            if row["cells"]:
+                row["cells"][-1] += data
+                row["inner"][-1] += data
+
+def parse_grid_html(page_html, grid_id, button_part):
+    """Equivalente de read_grid sobre el HTML devuelto por un postback."""
+    parser = _GridParser(page_html, grid_id, button_part)
+    parser.feed(page_html)
+    parser.close()
+    date_idx, desc_idx = grid_columns(parser.headers or [])
+    return [GridRow(record, date_idx, desc_idx) for record in parser.records]
+
+class _FormParser(HTMLParser):
+    """Campos que el navegador enviaría con el formulario ASP.NET, y botones por id."""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.action = None
+        self.fields = [] # [(nombre, valor)] en orden de documento
+        self.buttons = {} # id -> (nombre, tipo, valor)
+        self._select = None # [nombre, seleccionado, primero]
+        self._textarea = None # [nombre, texto]
+
+    def handle_starttag(self, tag, attrs):
+        a = {k: (v if v is not None else "") for k, v in attrs}
+        name = a.get("name")
+        if tag == "form" and self.action is None:
+            self.action = a.get("action", "")
+        elif tag == "input" and name:
+            kind = a.get("type", "text").lower()
+            if kind in ("image", "submit", "button"):
+                if a.get("id"): self.buttons[a["id"]] = (name, kind, a.get("value", ""))
+            elif kind in ("checkbox", "radio"):
+                if "checked" in a: self.fields.append((name, a.get("value") or "on"))
+            elif kind not in ("file", "reset"):
+                self.fields.append((name, a.get("value", "")))
+        elif tag == "select" and name:
+            self._select = [name, None, None]
+        elif tag == "option" and self._select is not None:
+            value = a.get("value", "")
+            if self._select[2] is None: self._select[2] = value
+            if "selected" in a: self._select[1] = value
+        elif tag == "textarea" and name:
+            self._textarea = [name, ""]
+
+    def handle_endtag(self, tag):
+        if tag == "select" and self._select is not None:
+            name, selected, first = self._select
+            self.fields.append((name, selected if selected is not None else (first or "")))
+            self._select = None
+        elif tag == "textarea" and self._textarea is not None:
+            self.fields.append(tuple(self._textarea))
+            self._textarea = None
+
+    def handle_data(self, data):
+        if self._textarea is not None:
+            self._textarea[1] += data
+
+class PostbackUnsupported(Exception):
+    """El motor HTTP no sabe reproducir este paso: se continúa con el navegador."""
+
+_DETAIL_TABS_RE = re.compile(r"""\bhref\s*=\s*["']#Archivos["']""", re.IGNORECASE)
+
+def is_case_detail(page_html, radicado):
+    """True si el HTML es la vista de detalle (pestañas Actuaciones y Archivos) del proceso `radicado`."""
+    return _DETAIL_TABS_RE.search(page_html) is not None and radicado in page_html
+
+class PostbackSession:
+    """Recorre el formulario frmConsulta.aspx por HTTP, repitiendo los postbacks de ASP.NET WebForms.
+
+    Parte del HTML y las cookies que deja el navegador tras la búsqueda. Cada postback envía los campos
+    del formulario (__VIEWSTATE, __EVENTVALIDATION...) más el control que lo dispara, y la respuesta
+    pasa a ser el estado actual. Lo que no sabe reproducir lanza PostbackUnsupported.
+    """
+    _SCRIPT_RE = re.compile(r"<script\b[^>]*>(.*?)</script>", re.IGNORECASE | re.DOTALL)
+    _WINDOW_OPEN_RE = re.compile(r"""window\.open\(\s*['"]([^'"]+)['"]""")
+    _IFRAME_RE = re.compile(r"<iframe\b[^>]*>", re.IGNORECASE)
+    _SRC_RE = re.compile(r"""\bsrc\s*=\s*(?:"([^"]*)"|'([^']*)')""", re.IGNORECASE)
+
+    def __init__(self, http, url, page_html, timeout=60):
+        self.http = http
+        self.url = url
+        self.timeout = timeout
+        self._static_popups = None # popups que la vista ya abría antes de pulsar un adjunto
+        self.postbacks = 0 # postbacks enviados: desde el primero, el formulario del navegador queda desfasado
+        self._load(page_html)
+
+    def _load(self, page_html):
+        if _SESSION_EXPIRED_RE.search(page_html.encode("utf-8", errors="replace")):
+            raise SessionExpired("el portal indica que la sesión expiró")
+        if "__VIEWSTATE" not in page_html:
+            raise PostbackUnsupported("la respuesta no es un formulario ASP.NET")
+        parser = _FormParser()
+        parser.feed(page_html)
+        parser.close()
+        self.html = page_html
+        self.fields = parser.fields
+        self.buttons = parser.buttons
+        if parser.action:
+            self.url = urllib.parse.urljoin(self.url, parser.action)
+
+    def has_element(self, element_id):
+        return re.search(r"""\bid\s*=\s*["']%s["']""" % re.escape(element_id), self.html) is not None
+
+    def grid(self, grid_id, button_part):
+        return parse_grid_html(self.html, grid_id, button_part)
+
+    def _get(self, url):
+        try:
+            response = self.http.request("GET", url, headers={"Referer": self.url}, timeout=self.timeout)
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            raise PostbackUnsupported(f"error de red ({e})") from e
+        if response.status != 200:
+            raise PostbackUnsupported(f"HTTP {response.status} en {url}")
+        return body.decode(response.headers.get_content_charset() or "utf-8", errors="replace")
+
+    def _popups(self):
+        scripts = "\n".join(self._SCRIPT_RE.findall(self.html))
+        return set(self._WINDOW_OPEN_RE.findall(html_lib.unescape(scripts)))
+
+    def _post(self, extra, event_target="", event_argument=""):
+        self._static_popups = None
+        self.postbacks += 1
+        data = [(k, v) for k, v in self.fields if k not in ("__EVENTTARGET", "__EVENTARGUMENT")]
+        data += [("__EVENTTARGET", event_target), ("__EVENTARGUMENT", event_argument)] + extra
+        headers = {"Content-Type": "application/x-www-form-urlencoded", "Referer": self.url,
+                   "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"}
+        try:
+            response = self.http.request("POST", self.url, body=urllib.parse.urlencode(data).encode("utf-8"),
+                                         headers=headers, timeout=self.timeout)
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            raise PostbackUnsupported(f"error de red ({e})") from e
+        if response.status != 200:
+            raise PostbackUnsupported(f"el servidor rechazó el postback (HTTP {response.status})")
+        self._load(body.decode(response.headers.get_content_charset() or "utf-8", errors="replace"))
+
+    def submit(self, button_id):
+        """Pulsa un botón del formulario por su id (input image o submit)."""
+        button = self.buttons.get(button_id)
+        if button is None:
+            raise PostbackUnsupported(f"no se encontró el botón {button_id}")
+        name, kind, value = button
+        # Un input image envía las coordenadas del clic en lugar de su valor
+        self._post([(f"{name}.x", "10"), (f"{name}.y", "10")] if kind == "image" else [(name, value)])
+
+    def postback(self, target, argument=""):
+        """Equivalente a __doPostBack(target, argument) (paginación, LinkButtons)."""
+        self._post([], target, argument)
+
+    def refresh(self):
+        """Reenvía el formulario sin pulsar ningún control: ASP.NET vuelve a pintar la vista desde el ViewState."""
+        self._post([])
+
+    def pager_target(self, grid_id, page_num):
+        """(target, argumento) del enlace a la página `page_num` de una grilla, o None si no existe."""
+        grid_name = grid_id.split("_", 1)[-1]
+        pattern = r"""__doPostBack\(\s*['"]([^'"]*%s[^'"]*)['"]\s*,\s*['"](Page\$%d)['"]""" % (re.escape(grid_name), page_num)
+        m = re.search(pattern, html_lib.unescape(self.html))
+        return (m.group(1), m.group(2)) if m else None
+
+    def attachment_url(self, button_id):
+        """URL de Descargando.aspx que abriría el popup de un adjunto de la vista de detalle."""
+        static = self._static_popups if self._static_popups is not None else self._popups()
+        self.submit(button_id)
+        # La respuesta trae un script que abre el popup; el popup contiene el iframe del generador
+        targets = self._popups() - static
+        self._static_popups = static
+        if len(targets) != 1:
+            raise PostbackUnsupported("la respuesta del adjunto no abre un único popup")
+        popup_url = urllib.parse.urljoin(self.url, targets.pop())
+        if "Descargando.aspx" in popup_url:
+            return popup_url
+        popup_html = html_lib.unescape(self._get(popup_url))
+        m = GeneratorUrlTemplate._DIRECT_RE.search(popup_html)
+        if not m:
+            raise PostbackUnsupported("el popup del adjunto no contiene el generador")
+        return urllib.parse.urljoin(popup_url, m.group(0))
+
+    def archivo_url(self, button_id):
+        """URL del PDF que muestra el visor (#MainContent_IframeViewPDF) de la pestaña Archivos, o None."""
+        self.submit(button_id)
+        for tag in self._IFRAME_RE.findall(self.html):
+            if "MainContent_IframeViewPDF" not in tag: continue
+            m = self._SRC_RE.search(tag)
+            src = html_lib.unescape(m.group(1) or m.group(2)) if m else ""
+            if src:
+                return (self.url.split("?", 1)[0].rsplit('/', 1)[0] + '/' + src).replace("\\", "/")
+            return None
+        raise PostbackUnsupported("la respuesta no contiene el visor de documentos")
+
+class PacingController:
+    """Ritmo adaptativo de las pausas entre acciones en el portal.
+
+    Cada pausa base (las del ritmo fijo original) se multiplica por `level`. Se empieza rápido y se
+    frena al ver errores de CAPTCHA, timeouts o bloqueos; tras varios éxitos seguidos se vuelve a
+    acelerar. El nivel tolerado en cada hora del día se guarda en .ritmo.json para la próxima ejecución.
+    Un único controlador se comparte entre los hilos de un lote: el portal ve la suma de todos.
+    """
+    VERSION = 1
+    # Preajuste -> (nivel inicial, nivel mínimo, nivel máximo, slow_mo en ms)
+    PRESETS = {
+        "agresivo": (0.1, 0.05, 2.0, 0),
+        "normal": (0.3, 0.1, 3.0, 20),
+        "prudente": (1.0, 0.5, 4.0, 50),
+    }
+    # Pausas base (mín, máx) en segundos: las que usaba el script con ritmo fijo
+    DELAYS = {
+        "carga": (2, 2),              # tras abrir el formulario de consulta
+        "tecla": (0.1, 0.3),          # entre caracteres del radicado
+        "consulta": (4, 6),           # tras pulsar Consultar (CAPTCHA)
+        "clic": (0.5, 0.5),           # antes de abrir el popup de un adjunto
+        "regresar": (0.5, 0.5),       # tras volver a la grilla de actuaciones
+        "pagina": (2, 2),             # al cambiar de página de la grilla
+    }
+    _RELAX_AFTER = 5        # éxitos seguidos para acelerar un paso
+    _RELAX_FACTOR = 0.8
+    _BACKOFF_FACTOR = 2.0
+    _BLOCK_STATUSES = (403, 429, 503)
+
+    def __init__(self, path=None, preset="normal"):
+        if preset not in self.PRESETS:
+            raise ValueError(f"Ritmo desconocido: {preset}")
+        self.path = path
+        self.preset = preset
+        start, self.min_level, self.max_level, self.slow_mo = self.PRESETS[preset]
+        self._lock = threading.Lock()
+        self._streak = 0
+        self.penalties = 0
+        self._hours = self._load()
+        learned = self._hours.get(self._hour())
+        # Partimos algo por debajo del nivel que se toleró a esta hora para seguir buscando el límite
+        self.level = self._clamp(learned["level"] * self._RELAX_FACTOR if learned else start)
+
+    @staticmethod
+    def _hour():
+        return time.strftime("%H")
+
+    def _clamp(self, level):
+        return min(self.max_level, max(self.min_level, level))
+
+    def _load(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data.get("horas", {}) if data.get("version") == self.VERSION else {}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """Guarda el nivel actual como ritmo seguro de esta hora del día."""
+        if not self.path:
+            return
+        with self._lock:
+            self._hours[self._hour()] = {
+                "level": round(self.level, 3),
+                "penalties": self.penalties,
+                "updated_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            data = {"version": self.VERSION, "horas": dict(self._hours)}
+        try:
+            _atomic_write(self.path, json.dumps(data, indent=1).encode("utf-8"))
+        except OSError as e:
+            logger.log("No se pudo guardar el ritmo: %s", e, level=logging.WARNING)
+
+    def wait(self, seconds):
+        """Pausa de `seconds` segundos al ritmo actual."""
+        self.sleep(seconds * self.level)
+
+    def sleep(self, seconds):
+        """Pausa deliberada ya escalada; se anota como tiempo de espera del expediente."""
+        if seconds <= 0: return
+        time.sleep(seconds)
+        metrics = CaseMetrics.current()
+        if metrics: metrics.add_time("espera", seconds)
+
+    def pause(self, kind):
+        lo, hi = self.DELAYS[kind]
+        self.wait(random.uniform(lo, hi))
+
+    def success(self):
+        with self._lock:
+            self._streak += 1
+            if self._streak < self._RELAX_AFTER:
+                return
+            self._streak = 0
+            self.level = self._clamp(self.level * self._RELAX_FACTOR)
+
+    def penalize(self, reason):
+        """El portal dio señales de saturación: se frena y se guarda el nuevo nivel."""
+        with self._lock:
+            self._streak = 0
+            self.penalties += 1
+            previous = self.level
+            self.level = self._clamp(max(self.level, self.min_level) * self._BACKOFF_FACTOR)
+        logger.log("Ritmo: %s, nivel %.2f -> %.2f", reason, previous, self.level)
+        self.save()
+
+    def observe_error(self, error):
+        """Clasifica un error de la búsqueda o de una descarga: solo CAPTCHA, timeouts y bloqueos cambian el ritmo."""
+        if isinstance(error, CaptchaMismatch):
+            self.penalize("CAPTCHA no coincide")
+        elif isinstance(error, (PlaywrightTimeoutError, socket.timeout, TimeoutError)):
+            self.penalize("timeout")
+        elif isinstance(error, HttpStatusError) and error.status in self._BLOCK_STATUSES:
+            self.penalize(f"bloqueo (HTTP {error.status})")
+
+class CircuitBreaker:
+    """Corta el paso cuando el portal parece caído, para todos los expedientes y hilos a la vez.
+
+    Tras `threshold` fallos transitorios seguidos (timeouts, conexiones rechazadas, HTTP 5xx) el circuito
+    se abre y cada nuevo intento espera `cooldown` segundos; si el primero tras la pausa vuelve a fallar,
+    la pausa se duplica hasta `max_cooldown`. Un éxito lo cierra. Así un lote se detiene mientras el portal
+    no responde en lugar de agotar los reintentos de cada expediente. Cada apertura queda en el registro;
+    qué mostrar al usuario lo decide quien lo crea, con `on_open(pausa, apertura)`.
+    """
+    def __init__(self, threshold=8, cooldown=60, max_cooldown=900, on_open=None):
+        self.threshold = threshold
+        self.on_open = on_open
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.trips = 0
+        self._failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return time.monotonic() < self._open_until
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self.trips = 0
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures < self.threshold or self.is_open:
+                return
+            self.trips += 1
+            pause = min(self.max_cooldown, self.cooldown * 2 ** (self.trips - 1))
+            self._open_until = time.monotonic() + pause
+            # Semiabierto: tras la pausa basta un fallo más para volver a abrirlo
+            self._failures = self.threshold - 1
+        logger.log("Circuito abierto: portal sin respuesta (%s fallos seguidos), pausa de %.0fs (apertura %s).",
+                   self.threshold, pause, self.trips, level=logging.WARNING)
+        if self.on_open: self.on_open(pause, self.trips)
+
+    def wait(self):
+        """Si el circuito está abierto, espera a que vuelva a dejar pasar. Devuelve los segundos esperados."""
+        remaining = self._open_until - time.monotonic()
+        if remaining <= 0:
+            return 0.0
+        time.sleep(remaining)
+        metrics = CaseMetrics.current()
+        if metrics: metrics.add_time("circuito", remaining)
+        return remaining
+
+class RetryPolicy:
+    """Política de reintentos común a la búsqueda y a las descargas.
+
+    Clasifica cada error en transitorio, CAPTCHA, sesión vencida o permanente. Los transitorios se reintentan
+    con espera exponencial y variación al azar (y alimentan el CircuitBreaker); los de CAPTCHA, con una
+    espera corta que crece poco; los de sesión se relanzan como SessionExpired para que el expediente repita
+    la búsqueda; los permanentes (404, radicado inexistente, disco lleno) no se reintentan.
+    """
+    TRANSIENT, CAPTCHA, SESSION, PERMANENT = "transitorio", "captcha", "sesion", "permanente"
+    # Operación -> (intentos, espera base, espera máxima) en segundos
+    PRESETS = {
+        "busqueda": (8, 5, 60),
+        "archivo": (2, 2, 30),
+        "adjunto": (3, 3, 45),
+    }
+    CAPTCHA_BASE = 5
+    SESSION_RENEWALS = 2 # búsquedas repetidas por expediente cuando vence la sesión
+    _PERMANENT_STATUSES = (400, 404, 405, 410, 501)
+    _SESSION_STATUSES = (401, 440)
+
+    def __init__(self, pacing, breaker=None):
+        self.pacing = pacing
+        self.breaker = breaker or CircuitBreaker()
+
+    def attempts(self, operation):
+        return self.PRESETS[operation][0]
+
+    @classmethod
+    def classify(cls, error):
+        if isinstance(error, SessionExpired):
+            return cls.SESSION
+        if isinstance(error, CaptchaMismatch):
+            return cls.CAPTCHA
+        if isinstance(error, CaseNotFound):
+            return cls.PERMANENT
+        if isinstance(error, HttpStatusError):
+            if error.status in cls._SESSION_STATUSES:
+                return cls.SESSION
+            if error.status in cls._PERMANENT_STATUSES:
+                return cls.PERMANENT
+            return cls.TRANSIENT
+        if isinstance(error, OSError) and error.errno == errno.ENOSPC:
+            return cls.PERMANENT
+        return cls.TRANSIENT
+
+    def delay(self, operation, attempt, category=TRANSIENT):
+        """Espera antes del intento `attempt + 1`, escalada por el ritmo actual."""
+        if category == self.CAPTCHA:
+            # Un CAPTCHA fallido no indica saturación: espera corta, casi lineal
+            return (self.CAPTCHA_BASE + attempt * 2) * random.uniform(0.8, 1.2) * self.pacing.level
+        _, base, cap = self.PRESETS[operation]
+        ceiling = min(cap, base * 2 ** attempt)
+        return (ceiling / 2 + random.uniform(0, ceiling / 2)) * max(self.pacing.level, 0.5)
+
+    def call(self, operation, fn, on_retry=None):
+        """Ejecuta `fn(intento)` con la política de `operation` y devuelve su resultado.
+
+        `on_retry(error, intento, espera)` se llama antes de cada espera. Relanza el último error si se
+        agotan los intentos, de inmediato si es permanente, y como SessionExpired si la sesión venció.
+        """
+        attempts = self.attempts(operation)
+        for attempt in range(attempts):
+            self.breaker.wait()
+            try:
+                result = fn(attempt)
+            except PostbackUnsupported:
+                raise
+            except Exception as e:
+                category = self.classify(e)
+                self.pacing.observe_error(e)
+                if category == self.SESSION:
+                    if isinstance(e, SessionExpired): raise
+                    raise SessionExpired(str(e)) from e
+                if category == self.TRANSIENT:
+                    self.breaker.failure()
+                if category == self.PERMANENT or attempt == attempts - 1:
+                    raise
+                wait = self.delay(operation, attempt, category)
+                if on_retry: on_retry(e, attempt, wait)
+                self.pacing.sleep(wait)
+                continue
+            self.breaker.success()
+            return result
+
+class BrowserProfile:
+    """Perfil de ejecución del navegador: modo headless, viewport, slow_mo y recursos que no se descargan.
+
+    "visible" es el comportamiento original (ventana fuera de la pantalla, sin bloqueos). "ligero" corre
+    sin pantalla y descarta imágenes, fuentes, multimedia, rastreadores y peticiones de terceros que no
+    son scripts ni hojas de estilo (de ellas dependen las pestañas y las comprobaciones de visibilidad).
+    "minimo" descarta también las hojas de estilo y prescinde de slow_mo. Stealth se aplica en todos.
+    Lo que necesita el CAPTCHA (imagen del portal y servicios de reCAPTCHA) nunca se bloquea.
+    """
+    # Preajuste -> (headless, viewport, slow_mo, tipos de recurso bloqueados, bloquear terceros)
+    PRESETS = {
+        "visible": (False, (1920, 1080), True, (), False),
+        "ligero": (True, (1280, 800), True, ("image", "media", "font", "texttrack", "manifest"), True),
+        "minimo": (True, (1024, 700), False, ("image", "media", "font", "texttrack", "manifest", "stylesheet"), True),
+    }
+    CAPTCHA_HOSTS = ("google.com", "gstatic.com", "recaptcha.net")
+    TRACKER_HOSTS = ("google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+                     "facebook.net", "facebook.com", "hotjar.com", "clarity.ms", "addthis.com", "addtoany.com")
+    # Tipos que se cargan aunque vengan de otro dominio (librerías de la página en CDN)
+    _THIRD_PARTY_ALLOWED = ("document", "script", "stylesheet")
+    _CAPTCHA_RE = re.compile(r"captcha", re.IGNORECASE)
+
+    def __init__(self, preset="visible", slow_mo=None):
+        if preset not in self.PRESETS:
+            raise ValueError(f"Perfil de navegador desconocido: {preset}")
+        self.preset = preset
+        self.headless, self.viewport, self.slow_mo, self.blocked_types, self.block_third_party = self.PRESETS[preset]
+        if slow_mo is not None:
+            self.slow_mo = slow_mo
+
+    @staticmethod
+    def _host_in(host, domains):
+        return any(host == d or host.endswith("." + d) for d in domains)
+
+    def allows(self, url, resource_type, portal_host):
+        """¿Se debe cargar este recurso? `portal_host` es el host del formulario de consulta."""
+        host = (urllib.parse.urlsplit(url).hostname or "").lower()
+        if self._CAPTCHA_RE.search(url) or self._host_in(host, self.CAPTCHA_HOSTS):
+            return True
+        if self.block_third_party and self._host_in(host, self.TRACKER_HOSTS):
+            return False
+        if resource_type in self.blocked_types:
+            return False
+        if self.block_third_party and host and not self._same_site(host, portal_host):
+            return resource_type in self._THIRD_PARTY_ALLOWED
+        return True
+
+    @staticmethod
+    def _same_site(host, portal_host):
+        # procesojudicial.ramajudicial.gov.co comparte sitio con cualquier *.ramajudicial.gov.co
+        labels = portal_host.split(".")
+        site = ".".join(labels[1:]) if len(labels) > 3 and not portal_host.replace(".", "").isdigit() else portal_host
+        return host == site or host.endswith("." + site) or host == portal_host
+
+    def install(self, context: BrowserContext, base_url):
+        """Instala el filtro de recursos en el contexto (cubre también los popups de los adjuntos)."""
+        if not (self.blocked_types or self.block_third_party):
+            return
+        portal_host = (urllib.parse.urlsplit(base_url).hostname or "").lower()
+
+        def handle(route):
+            request = route.request
+            if self.allows(request.url, request.resource_type, portal_host):
+                route.continue_()
+            else:
+                metrics = CaseMetrics.current()
+                if metrics: metrics.incr("recursos_bloqueados")
+                route.abort("blockedbyclient")
+        context.route("**/*", handle)
+
 class TybaDownloader:
-    def __init__(self, output_base_dir=None, silent_mode=True):
+    RADICADO_RE = re.compile(r"\d{23}") # formato de radicado del portal
+
+    def __init__(self, output_base_dir=None, silent_mode=True, session_ttl=20 * 60, engine="sync", max_parallel_downloads=4,
+                 full_resync=False, content_store=False, filter_cache=True, name_prefilter=False, pacing="normal",
+                 metrics_textfile=None, base_url=None, profile="visible", slow_mo=None, verify_pages=False,
+                 classify_workers=0):
         if output_base_dir is None:
             self.base_dir = os.path.dirname(os.path.abspath(__file__))
         else:
             self.base_dir = os.path.abspath(output_base_dir)
             
         self.silent_mode = silent_mode
+
+        # Caché de sesiones: evita repetir búsqueda + CAPTCHA en re-sincronizaciones.
+        # El TTL por defecto coincide con el timeout de sesión habitual de ASP.NET (20 min).
+        self.session_cache = SessionCache(os.path.join(self.base_dir, ".sesiones"), session_ttl) if session_ttl else None
+
+        # Motor: "sync" (adjuntos uno a uno), "async" (adjuntos en paralelo en un pool de hilos compartido)
+        # o "http" (el navegador solo resuelve la búsqueda; el detalle se recorre repitiendo los postbacks)
+        if engine not in ("sync", "async", "http"):
+            raise ValueError(f"Motor desconocido: {engine}")
+        self.engine = engine
+        self.max_parallel_downloads = max_parallel_downloads
+
+        # Con full_resync se ignora el manifiesto y se revisan todas las actuaciones
+        self.full_resync = full_resync
+
+        # Almacén direccionado por contenido compartido por todos los expedientes de base_dir
+        self.content_store = ContentStore(os.path.join(self.base_dir, ".almacen")) if content_store else None
+
+        # Filtro agresivo: descarta por nombre, sin descargar, lo que el nombre ya identifica como notificación
+        self.name_prefilter = name_prefilter
+
+        # Los PDF ya descargados se revisan (cabecera y final) antes de darlos por buenos; con esto, también sus páginas
+        self.verify_pages = verify_pages
+
+        # Decisiones del filtro de notificaciones ya calculadas (se reutilizan mientras no cambien las reglas)
+        self.filter_cache = None
+        if filter_cache:
+            try:
+                os.makedirs(self.base_dir, exist_ok=True)
+                self.filter_cache = FilterDecisionCache(os.path.join(self.base_dir, ".filtro_cache.sqlite3"))
+            except Exception as e:
+                logger.log("Caché de decisiones del filtro desactivada: %s", e, level=logging.WARNING)
+
+        # Pausas adaptativas: arrancan rápido y frenan ante CAPTCHA fallidos, timeouts o bloqueos
+        self.pacing = PacingController(os.path.join(self.base_dir, ".ritmo.json"), preset=pacing)
+
+        # Reintentos según el tipo de error, y un circuito común que pausa todo si el portal se cae
+        self.retry = RetryPolicy(self.pacing, CircuitBreaker(on_open=self._circuit_opened))
+
+        # Perfil del navegador: "visible" (original), "ligero" o "minimo" (headless y con recursos bloqueados)
+        self.profile = BrowserProfile(profile, slow_mo=slow_mo)
+
+        # Informes de los expedientes ya terminados; si hay ruta se vuelcan también para Prometheus
+        self.metrics_textfile = metrics_textfile
+        self._reports = {} # radicado -> informe
+        self._reports_lock = threading.Lock()
+
+        # Filtro en segundo plano: procesos que clasifican los PDF mientras el navegador sigue (0 = en línea)
+        self.classify_workers = classify_workers
+        self._classify_pool = None
+        self._classify_pool_lock = threading.Lock()
+        self._parallel_engine = None
+        self._engine_lock = threading.Lock()
             
-        self.base_url = "https://procesojudicial.ramajudicial.gov.co/Justicia21/Administracion/Ciudadanos/frmConsulta.aspx"
-        self.downloaded_docs = [] # List of {date, name, type}
-        self.auto_admite_date = "Pendiente"
-        self.errors = [] # List of errors for the final report
+        # `base_url` permite apuntar a otro servidor (por ejemplo, el simulado de tyba_mock_server.py)
+        self.base_url = base_url or "https://procesojudicial.ramajudicial.gov.co/Justicia21/Administracion/Ciudadanos/frmConsulta.aspx"
+        self.user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
         
         # ANSI Colors
         self.C_CYAN = "\033[96m"
@@ -77,114 +2274,42 @@ class TybaDownloader:
 
     def _normalize_text(self, text):
         """Normaliza el texto: quita acentos, convierte a mayúsculas y limpia espacios."""
-        if not text: return ""
-        text = text.upper()
-        # Eliminar acentos usando unicodedata
-        normalized = "".join(
-            c for c in unicodedata.normalize('NFD', text)
-            if unicodedata.category(c) != 'Mn'
-        )
-        return " ".join(normalized.split())
+        return _normalize_text(text)
 
-    def _is_notification(self, file_path, act_name=""):
-        """Verificación robusta y general para identificar notificaciones y citaciones."""
-        # 1. Normalización y Palabras Clave Generales
-        u_act = self._normalize_text(act_name)
-        
-        # 0. Palabras de Protección (Documentos sustanciales que NUNCA se deben borrar)
-        # Ampliado para cubrir todos los tipos de procesos (Ejecutivos, Familia, etc.)
-        proteccion = [
-            "AUTO INTERLOCUTORIO", "SENTENCIA", "AUTO NR", "AUTO NUMERO", "RESUELVE", 
-            "DEMANDA", "PRETENSIONES", "ORDENA", "CONTESTACION", "RECURSO", "ALEGATOS", 
-            "MEMORIAL", "AUDIENCIA", "ACTA", "PODER", "SOLICITUD", "INCIDENTE",
-            "MANDAMIENTO", "LIQUIDACION", "AVALUO", "SECUESTRO", "REMATE", "COSTAS", 
-            "INVENTARIO", "DICTAMEN", "PERITAJE", "AUTO", "FALLO"
-        ]
-        
-        # Palabras clave que indican una comunicación puramente procesal/notoria
-        notif_keywords = [
-            "NOTIFICACION", "ENVIO", "CITATORIO", "AVISO", "ESTADO", 
-            "CERTIFICADO", "PRUEBA DE ENTREGA", "FORMATO DE CITACION", 
-            "COMUNICACION", "OFICIO", "COMUNICADO", "CONSTANCIA", "ACUSE",
-            "GUIA", "REPORTE DE CORREO", "Telegrama", "HACE SABER"
-        ]
-        
-        # Si el nombre de la actuación contiene estas palabras, es casi seguro que es omitible
-        is_likely_notif = False
-        for kw in notif_keywords:
-            if kw in u_act:
-                is_likely_notif = True
-                logger.log(f"    [Filtro] Posible notificación por nombre ('{kw}'): '{act_name}'")
-                break
+    def _is_notification_by_name(self, act_name):
+        """Filtro agresivo: el nombre basta para decidir (palabra de notificación y ninguna protegida)."""
+        notif_word, protected_word = FILTRO_REGLAS.name_verdict(_normalize_text(act_name))
+        return bool(notif_word) and not protected_word
 
-        # Si el nombre indica que es sustancial, lo protegemos por NOMBRE
-        # PERO SOLO SI NO TIENE TAMBIÉN PALABRAS DE NOTIFICACIÓN EXPLÍCITAS
-        has_protected_word = False
-        protected_word_found = ""
-        for p in proteccion:
-            if p in u_act:
-                has_protected_word = True
-                protected_word_found = p
-                break
-        
-        if has_protected_word and not is_likely_notif:
-            logger.log(f"    [Filtro] Protegido por nombre: '{act_name}' (Palabra: {protected_word_found})")
-            return False
-        elif has_protected_word and is_likely_notif:
-             logger.log(f"    [Filtro] Nombre ambiguo ('{protected_word_found}' + Notificación). Se analizará contenido.")
+    def _is_notification(self, source, act_name="", digest=None, metrics=None):
+        """Verificación robusta y general para identificar notificaciones y citaciones.
 
-        if not os.path.exists(file_path):
-            return is_likely_notif
-            
-        try:
-            reader = PdfReader(file_path)
-            # Solo analizamos la primera página para eficiencia
-            raw_content = reader.pages[0].extract_text()
-            first_page = self._normalize_text(raw_content)
-            
-            # PRIORIDAD 1: ¿Tiene formato obvio de notificación? (Si sí, es notificación sin duda)
-            # Ampliamos los indicios para cubrir más formatos de Tyba / Rama Judicial
-            indicios_formato = [
-                "DIRECCION DE NOTIFICACION", "CODIGO DE BARRAS", "GUIA NO", "ACUSE DE RECIBO", 
-                "AVISO DE NOTIFICACION", "HACE SABER", "POR MEDIO DEL PRESENTE", 
-                "NOTIFICACION POR ESTADO", "NOTIFICACION PERSONAL", "SECRETARIA",
-                "RAMA JUDICIAL DEL PODER PUBLICO", "DE MANERA ELECTRONICA", "SISTEMA DE GESTION"
-            ]
-            
-            if is_likely_notif:
-                # Si ya sospechábamos por el nombre, somos agresivos confirmando formato
-                if any(ind in first_page for ind in indicios_formato):
-                    logger.log(f"    [Filtro] Confirmado como notificación (Formato detected, nombre sospechoso): '{act_name}'")
-                    return True
-
-            # 2. Protección por contenido del PDF
-            # Usamos una lista más estricta para contenido (quitamos palabras genéricas como "AUTO" que aparecen en notificaciones)
-            proteccion_contenido = [
-                "AUTO INTERLOCUTORIO", "SENTENCIA", "RESUELVE", "DEMANDA", "PRETENSIONES", 
-                "ORDENA", "CONTESTACION", "RECURSO", "ALEGATOS", "MEMORIAL", "AUDIENCIA", 
-                "ACTA", "PODER", "SOLICITUD", "INCIDENTE", "MANDAMIENTO", "LIQUIDACION", 
-                "AVALUO", "SECUESTRO", "REMATE", "COSTAS", "INVENTARIO", "DICTAMEN", "PERITAJE", "FALLO"
-            ]
-            
-            for p in proteccion_contenido:
-                if p in first_page:
-                    logger.log(f"    [Filtro] Protegido por contenido ('{p}')")
-                    return False # Es un documento de fondo, proteger
-            
-            # 3. Verificación final: ¿Contiene el PDF palabras de notificación?
-            for kw in notif_keywords:
-                if kw in first_page:
-                    logger.log(f"    [Filtro] Detectado como notificación por contenido ('{kw}')")
-                    return True
-                    
-            return is_likely_notif
-        except Exception as e:
-            logger.log(f"    [Filtro] Error analizando PDF: {e}. Usando predicción por nombre: {is_likely_notif}")
-            return is_likely_notif
+        `source` puede ser la ruta del PDF o sus bytes en memoria (así se decide antes de escribir en disco).
+        `metrics` se indica cuando se llama desde otro hilo (motor paralelo); si no, se usa el del hilo actual.
+        """
+        metrics = metrics or CaseMetrics.current()
+        if metrics is None:
+            return classify_notification(source, act_name, FILTRO_REGLAS, self.filter_cache, digest, logger.log)
+        with metrics.span("filtro"):
+            return classify_notification(source, act_name, FILTRO_REGLAS, self.filter_cache, digest, logger.log)
+
+    def _phase(self, name):
+        """Cambia la fase del expediente en curso: en el registro y en las métricas."""
+        logger.phase(name)
+        metrics = CaseMetrics.current()
+        if metrics: metrics.phase(name)
+
+    def _count(self, name, n=1):
+        metrics = CaseMetrics.current()
+        if metrics: metrics.incr(name, n)
+
+    def _span(self, name):
+        metrics = CaseMetrics.current()
+        return metrics.span(name) if metrics else contextlib.nullcontext()
 
     def _human_delay(self, min_s=1, max_s=3):
-        """Simula una pausa humana aleatoria."""
-        time.sleep(random.uniform(min_s, max_s))
+        """Simula una pausa humana aleatoria (escalada por el ritmo actual)."""
+        self.pacing.wait(random.uniform(min_s, max_s))
 
     def _emulate_mouse(self, page: Page):
         """Mueve el ratón de forma aleatoria para parecer humano."""
@@ -198,100 +2323,354 @@ class TybaDownloader:
         except:
             pass
 
-    def download_case(self, radicado, skip_notifications=False):
-        print(f"\n{self.C_CYAN}{self.C_BOLD}>>> Iniciando proceso: {radicado}{self.C_END}")
-        self.downloaded_docs = []
-        self.errors = []
-        self.auto_admite_date = "Sin fecha"
-        
+    def _prepare_case_dir(self, radicado):
         case_dir = os.path.join(self.base_dir, radicado)
         try:
             os.makedirs(case_dir, exist_ok=True)
         except Exception as e:
             case_dir = os.path.join(os.path.expanduser("~"), "TYBA_Downloads", radicado)
             os.makedirs(case_dir, exist_ok=True)
+        return case_dir
 
-        with sync_playwright() as p:
+    def _slow_mo(self):
+        return self.pacing.slow_mo if self.profile.slow_mo else 0
+
+    def _launch_browser(self, playwright, extra_args=None):
+        args = ["--no-sandbox"]
+        if not self.profile.headless:
             # Pseudo-Silent Mode: Navegador visible pero fuera de la pantalla
             # Esto ayuda con reCAPTCHA y evita errores de visibilidad de elementos
-            browser = p.chromium.launch(
-                headless=False, 
-                slow_mo=50,
-                args=["--window-position=-2000,0", "--no-sandbox"]
-            )
-            
-            # Configuración de contexto con viewport fijo y grande
-            context = browser.new_context(
-                accept_downloads=True, 
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                viewport={'width': 1920, 'height': 1080},
-                locale="es-CO",
-                timezone_id="America/Bogota",
-                permissions=["geolocation"]
-            )
-            
-            page = context.new_page()
-            
-            # Aplicamos modo sigilo (Compatibilidad con v2.0.0)
-            Stealth().use_sync(page)
+            args.append("--window-position=-2000,0")
+        return playwright.chromium.launch(
+            headless=self.profile.headless, 
+            slow_mo=self._slow_mo(),
+            args=args + (extra_args or [])
+        )
+
+    def _new_context(self, browser: Browser, storage_state=None):
+        # Configuración de contexto con viewport fijo (según el perfil)
+        width, height = self.profile.viewport
+        context = browser.new_context(
+            storage_state=storage_state,
+            accept_downloads=True, 
+            user_agent=self.user_agent,
+            viewport={'width': width, 'height': height},
+            locale="es-CO",
+            timezone_id="America/Bogota",
+            permissions=["geolocation"]
+        )
+        self.profile.install(context, self.base_url)
+        return context
+
+    def download_case(self, radicado, skip_notifications=False, browser: Browser = None):
+        """Descarga un expediente. Si se recibe `browser` se reutiliza; si no, se lanza uno propio."""
+        print(f"\n{self.C_CYAN}{self.C_BOLD}>>> Iniciando proceso: {radicado}{self.C_END}")
+        state = self._new_case_state(radicado, skip_notifications)
+
+        if browser is not None:
+            self._run_case(browser, state, skip_notifications)
+            return state
 
+        with sync_playwright() as p:
+            browser = self._launch_browser(p)
             try:
-                self._search_case(page, radicado)
-                
-                # We process Actuaciones first to find the "Auto Admite" date
-                self._process_actuaciones(page, context, case_dir, skip_notifications)
-                self._process_archivos(page, case_dir, skip_notifications)
-                
-                print(f"\n{self.C_GREEN}{self.C_BOLD}✓ Expediente completo: {radicado}{self.C_END}")
-            except Exception as e:
-                print(f"\n{self.C_RED}✗ Error fatal durante el proceso: {e}{self.C_END}")
-                try: page.screenshot(path=os.path.join(case_dir, "error_screenshot.png"))
-                except: pass
+                self._run_case(browser, state, skip_notifications)
             finally:
-                # Guardamos la lista aunque haya habido un error parcial
-                self._save_doc_list(case_dir)
-                print(f"{self.C_CYAN}Ubicación: {case_dir}{self.C_END}")
                 browser.close()
+        return state
+
+    def _new_case_state(self, radicado, skip_notifications=False):
+        """CaseState de un expediente con su carpeta, cliente HTTP, manifiesto, índice, métricas y filtro en segundo plano."""
+        state = CaseState(radicado, self._prepare_case_dir(radicado))
+        state.generator_urls = GeneratorUrlTemplate(self.base_url)
+        state.http = HttpClient(self.user_agent)
+        state.manifest = CaseManifest(state.case_dir)
+        state.documents = DocumentRegistry(state.case_dir)
+        state.metrics = CaseMetrics(radicado)
+        if skip_notifications and self.classify_workers:
+            state.pipeline = ClassificationPipeline(self._classifier_pool(), max_pending=self.classify_workers * 4)
+        return state
 
-    def _save_doc_list(self, case_dir):
-        list_path = os.path.join(case_dir, "lista.txt")
+    def _circuit_opened(self, pause, trips):
+        print(f"\n{self.C_RED}! El portal no responde: pausa de {pause:.0f}s antes de seguir (todos los expedientes).{self.C_END}")
+
+    def _attachment_engine(self):
+        """Motor de descargas paralelas (--motor async), compartido por todos los expedientes del proceso."""
+        with self._engine_lock:
+            if self._parallel_engine is None:
+                self._parallel_engine = ParallelAttachmentEngine(self.max_parallel_downloads).start()
+            return self._parallel_engine
+
+    def close(self):
+        """Libera los recursos compartidos entre expedientes (motor de descargas y pool del filtro)."""
+        with self._engine_lock:
+            if self._parallel_engine is not None:
+                self._parallel_engine.close()
+                self._parallel_engine = None
+        with self._classify_pool_lock:
+            if self._classify_pool is not None:
+                self._classify_pool.shutdown()
+                self._classify_pool = None
+
+    def _classifier_pool(self):
+        """Pool de procesos del filtro en segundo plano, compartido por todos los expedientes del proceso."""
+        with self._classify_pool_lock:
+            if self._classify_pool is None:
+                db_path = self.filter_cache.db_path if self.filter_cache else None
+                self._classify_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.classify_workers, initializer=_reclassify_init, initargs=(db_path,))
+            return self._classify_pool
+
+    def _run_case(self, browser: Browser, state, skip_notifications=False):
+        # Los registros de este hilo van también al registro.jsonl del expediente
+        with logger.case(state.radicado, state.case_dir), state.metrics.activate():
+            try:
+                self._run_case_logged(browser, state, skip_notifications)
+            finally:
+                state.metrics.finish()
+                report = state.metrics.report(state)
+                state.metrics.write(state.case_dir, report)
+                self._export_metrics(report)
+                logger.log("Expediente terminado en %ss", report['duracion_s'], duracion_ms=round(report['duracion_s'] * 1000),
+                           bytes=report["contadores"].get("bytes", 0))
+
+    def _export_metrics(self, report):
+        """Guarda el informe del expediente y, si se pidió, reescribe el textfile de Prometheus con todos los del proceso."""
+        if not self.metrics_textfile: return
+        with self._reports_lock:
+            self._reports[report["radicado"]] = report
+            try:
+                write_prometheus_textfile(self.metrics_textfile, list(self._reports.values()))
+            except OSError as e:
+                logger.log("No se pudo escribir el archivo de métricas: %s", e, level=logging.WARNING)
+
+    def _run_case_logged(self, browser: Browser, state, skip_notifications=False):
+        self._phase("busqueda")
+        cached = self.session_cache.load(state.radicado) if self.session_cache else None
+
+        # Cada expediente trabaja en su propio contexto aislado (cookies, sesión ASP.NET)
+        context = self._new_context(browser, storage_state=cached["storage_state"] if cached else None)
+        page = context.new_page()
+        
+        # Aplicamos modo sigilo (Compatibilidad con v2.0.0)
+        Stealth().use_sync(page)
+
+        engine = self._attachment_engine() if self.engine == "async" else None
         try:
-            with open(list_path, "w", encoding="utf-8") as f:
-                f.write(f"EXPEDIENTE: {os.path.basename(case_dir)}\n")
-                f.write("="*50 + "\n")
-                f.write(f"{'FECHA':<12} | {'DOCUMENTO'}\n")
-                f.write("-"*50 + "\n")
-                
-                for doc in self.downloaded_docs:
-                    if doc['type'] == 'archivo':
-                        date = self.auto_admite_date if "DEMANDA" in doc['name'].upper() else "N/A"
-                        f.write(f"{date:<12} | {doc['name']}\n")
-                
-                f.write("-"*50 + "\n")
-                for doc in self.downloaded_docs:
-                    if doc['type'] == 'actuacion':
-                        f.write(f"{doc['date']:<12} | {doc['name']}\n")
-                
-                if self.errors:
-                    f.write("\n" + "!"*20 + " ERRORES DURANTE LA DESCARGA " + "!"*20 + "\n")
-                    for err in self.errors:
-                        f.write(f"- {err}\n")
+
+            if not (cached and self._restore_session(page, state.radicado, cached, state.http)):
+                if cached:
+                    self.session_cache.invalidate(state.radicado)
+                    context.clear_cookies()
+                self._search_case(page, state.radicado)
+                self._remember_session(context, page, state.radicado)
             
-            print(f"  {self.C_GREEN}→ Archivo 'lista.txt' generado.{self.C_END}")
-            if self.errors:
-                print(f"  {self.C_YELLOW}⚠ Se encontraron {len(self.errors)} errores (ver lista.txt).{self.C_END}")
+            for renewal in range(RetryPolicy.SESSION_RENEWALS + 1):
+                try:
+                    # We process Actuaciones first to find the "Auto Admite" date
+                    if self.engine == "http":
+                        self._process_case_http(page, context, state, skip_notifications)
+                    else:
+                        self._process_actuaciones(page, context, state, skip_notifications, engine=engine)
+                        self._process_archivos(page, state, skip_notifications)
+                    break
+                except SessionExpired as e:
+                    if renewal == RetryPolicy.SESSION_RENEWALS:
+                        raise
+                    # Se repite la búsqueda; el manifiesto hace que se retome donde iba
+                    self._count("sesiones_renovadas")
+                    print(f"\n  {self.C_YELLOW}! La sesión del portal expiró ({e}). Se repite la búsqueda y se retoma el expediente.{self.C_END}")
+                    logger.log("Sesión vencida en %s: %s. Se renueva.", state.radicado, e, level=logging.WARNING)
+                    if self.session_cache: self.session_cache.invalidate(state.radicado)
+                    context.clear_cookies()
+                    self._phase("busqueda")
+                    self._search_case(page, state.radicado)
+                    self._remember_session(context, page, state.radicado)
+            
+            state.completed = True
+            # Refrescamos la marca de tiempo: la sesión ASP.NET se renueva con cada petición
+            self._remember_session(context, page, state.radicado)
+            print(f"\n{self.C_GREEN}{self.C_BOLD}✓ Expediente completo: {state.radicado}{self.C_END}")
+        except Exception as e:
+            state.permanent_error = RetryPolicy.classify(e) == RetryPolicy.PERMANENT
+            if state.permanent_error:
+                state.errors.append(f"Error permanente (no se reintentará): {e}")
+            print(f"\n{self.C_RED}✗ Error fatal durante el proceso ({state.radicado}): {e}{self.C_END}")
+            logger.log("Error fatal en el expediente: %s", traceback.format_exc(), level=logging.ERROR)
+            try: page.screenshot(path=os.path.join(state.case_dir, "error_screenshot.png"))
+            except: pass
+        finally:
+            # Lo ya descargado se clasifica aunque haya habido un error parcial; después se guarda la lista
+            self._drain_pipeline(state)
+            self._save_doc_list(state)
+            print(f"{self.C_CYAN}Ubicación: {state.case_dir}{self.C_END}")
+            state.http.close()
+            self.pacing.save()
+            try: context.close()
+            except: pass
+
+    def download_batch(self, radicados, skip_notifications=False, concurrency=3):
+        """Procesa varios radicados a la vez, cada uno en su propio contexto, sobre un único navegador."""
+        # Quitamos duplicados conservando el orden de entrada
+        radicados = list(dict.fromkeys(r.strip() for r in radicados if r and r.strip()))
+        invalid = set(_invalid_radicados(radicados))
+        if invalid:
+            print(f"{self.C_RED}Se omiten {len(invalid)} radicados inválidos (se esperan 23 dígitos): {', '.join(sorted(invalid))}{self.C_END}")
+            logger.log("Radicados inválidos omitidos del lote: %s", sorted(invalid), level=logging.WARNING)
+        if len(invalid) == len(radicados):
+            return [None] * len(radicados)
+        concurrency = max(1, min(int(concurrency), len(radicados) - len(invalid)))
+
+        print(f"\n{self.C_CYAN}{self.C_BOLD}>>> Lote de {len(radicados)} radicados ({concurrency} en paralelo){self.C_END}")
+        logger.log("Inicio de lote: %s radicados, concurrencia %s.", len(radicados), concurrency)
+
+        jobs = queue.Queue()
+        for radicado in radicados:
+            if radicado not in invalid: jobs.put(radicado)
+        results = {}
+
+        def worker(pool):
+            # La API síncrona de Playwright no es thread-safe: cada hilo abre su propia
+            # conexión al navegador compartido y crea sus contextos sobre ella.
+            pw, browser = pool.connect()
+            try:
+                while True:
+                    try:
+                        radicado = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        results[radicado] = self.download_case(radicado, skip_notifications, browser=browser)
+                    except Exception as e:
+                        print(f"\n{self.C_RED}Error en {radicado}: {e}{self.C_END}")
+                        logger.log("Error no controlado en lote para %s: %s", radicado, traceback.format_exc(), level=logging.ERROR)
+            finally:
+                pool.disconnect(pw, browser)
+
+        with BrowserPool(self) as pool:
+            threads = [threading.Thread(target=worker, args=(pool,), name=f"tyba-{n}") for n in range(concurrency)]
+            for t in threads: t.start()
+            for t in threads: t.join()
+
+        states = [results.get(r) for r in radicados]
+        ok = sum(1 for st in states if st is not None and st.completed)
+        print(f"\n{self.C_BOLD}Resumen del lote:{self.C_END} {self.C_GREEN}{ok} completos{self.C_END}, "
+              f"{self.C_RED}{len(radicados) - ok} con errores{self.C_END}")
+        for radicado, st in zip(radicados, states):
+            if radicado in invalid:
+                print(f"  {self.C_RED}✗ {radicado} (radicado inválido){self.C_END}")
+            elif st is None or not st.completed:
+                print(f"  {self.C_RED}✗ {radicado}{self.C_END}")
+            elif st.errors:
+                print(f"  {self.C_YELLOW}⚠ {radicado}: {len(st.errors)} errores (ver lista.txt){self.C_END}")
+        return states
+
+    def _save_doc_list(self, state):
+        try:
+            state.documents.export(os.path.basename(state.case_dir), state.auto_admite_date, state.errors)
+            print(f"  {self.C_GREEN}→ Archivo 'lista.txt' generado (índice en indice.json / indice.csv).{self.C_END}")
+            if state.errors:
+                print(f"  {self.C_YELLOW}⚠ Se encontraron {len(state.errors)} errores (ver lista.txt).{self.C_END}")
         except Exception as e:
             print(f"  {self.C_RED}→ Error creando lista.txt: {e}{self.C_END}")
 
+    def _remember_session(self, context: BrowserContext, page: Page, radicado):
+        if not self.session_cache: return
+        try:
+            self.session_cache.save(radicado, context.storage_state(), page.url, page.content())
+        except Exception as e:
+            logger.log("No se pudo capturar la sesión de %s: %s", radicado, e, level=logging.WARNING)
+
+    def _restore_session(self, page: Page, radicado, cached, http):
+        """Intenta volver al detalle del proceso con la sesión guardada. Devuelve False si ya no es válida."""
+        print(f"{self.C_YELLOW}Reutilizando sesión guardada...{self.C_END}")
+        try:
+            http.set_cookies(page.context.cookies())
+            self._replay_detail(page, http, radicado, cached["url"], cached["html"])
+            logger.log("Sesión restaurada para %s sin repetir la búsqueda.", radicado)
+            return True
+        except Exception as e:
+            print(f"  {self.C_YELLOW}! Sesión guardada no válida, se hará una búsqueda nueva.{self.C_END}")
+            logger.log("Sesión en caché inválida para %s: %s", radicado, e, level=logging.WARNING)
+            return False
+
+    def _replay_detail(self, page: Page, http, radicado, url, page_html):
+        """Vuelve al detalle de `radicado` a partir del HTML de esa vista y lo deja en el navegador.
+
+        Un GET de frmConsulta.aspx solo devuelve el formulario de búsqueda vacío. Se reenvía por HTTP el
+        formulario guardado (postback sin control, con su __VIEWSTATE y las cookies de la sesión), el portal
+        vuelve a pintar el detalle, y esa respuesta se entrega al navegador sin pedirla otra vez. Si la
+        sesión ya no vale o la respuesta no es el detalle de `radicado`, lanza una excepción.
+        """
+        session = PostbackSession(http, url, page_html)
+        session.refresh()
+        if not is_case_detail(session.html, radicado):
+            raise Exception("el portal no devolvió el detalle del expediente")
+        self._share_cookies(page.context, http)
+        is_target = lambda request_url: request_url == session.url
+        fulfill = lambda route: route.fulfill(status=200, content_type="text/html; charset=utf-8", body=session.html)
+        page.route(is_target, fulfill)
+        try:
+            page.goto(session.url)
+        finally:
+            page.unroute(is_target, fulfill)
+        page.wait_for_selector("a[href='#Archivos']", timeout=20000)
+
+    def _share_cookies(self, context: BrowserContext, http):
+        """Copia al navegador las cookies que el cliente HTTP recibió por su cuenta (postbacks del motor HTTP)."""
+        cookies = [{"name": c["name"], "value": c["value"], "domain": c["domain"], "path": c.get("path") or "/",
+                    "secure": bool(c.get("secure"))} for c in http.cookies if c.get("domain")]
+        if cookies: context.add_cookies(cookies)
+
+    def _reopen_detail(self, page: Page, context: BrowserContext, state):
+        """Tras abandonar el motor HTTP, el navegador quedó desfasado: los postbacks del motor cambiaron la
+        vista en el servidor. Vuelve a pintar el detalle reenviando el formulario del navegador (o repite la búsqueda)."""
+        try:
+            self._replay_detail(page, state.http, state.radicado, page.url, page.content())
+            logger.log("Detalle de %s recargado en el navegador tras el motor HTTP.", state.radicado)
+        except Exception as e:
+            logger.log("No se pudo recargar el detalle de %s (%s); se repite la búsqueda.", state.radicado, e, level=logging.WARNING)
+            self._search_case(page, state.radicado)
+            self._remember_session(context, page, state.radicado)
+
+    def peek_actuaciones(self, browser: Browser, radicado, limit=10):
+        """Vigilancia: resuelve la búsqueda (o reutiliza la sesión) y lee solo la primera página de
+        grdActuaciones, que trae las actuaciones más recientes. Devuelve sus primeras `limit` filas."""
+        cached = self.session_cache.load(radicado) if self.session_cache else None
+        context = self._new_context(browser, storage_state=cached["storage_state"] if cached else None)
+        http = HttpClient(self.user_agent)
+        try:
+            page = context.new_page()
+            Stealth().use_sync(page)
+            if not (cached and self._restore_session(page, radicado, cached, http)):
+                if cached:
+                    self.session_cache.invalidate(radicado)
+                    context.clear_cookies()
+                self._search_case(page, radicado)
+            page.click("a[href='#Actuaciones']")
+            try:
+                page.wait_for_selector("#MainContent_grdActuaciones", timeout=10000)
+            except PlaywrightTimeoutError:
+                return [] # Proceso sin actuaciones todavía
+            rows = read_grid(page, "MainContent_grdActuaciones", "grdActuaciones_imgbConsultarGrilla")
+            # La descarga que siga a un cambio reutiliza esta sesión sin repetir el CAPTCHA
+            self._remember_session(context, page, radicado)
+            return rows[:limit]
+        finally:
+            http.close()
+            context.close()
+
     def _search_case(self, page: Page, radicado):
         print(f"{self.C_YELLOW}Conectando con TYBA...{self.C_END}")
         page.goto(self.base_url)
-        time.sleep(2)
+        self.pacing.pause("carga")
         
-        max_retries = 8
-        logger.log(f"Iniciando búsqueda de radicado: {radicado} con {max_retries} intentos.")
-        for attempt in range(max_retries):
-            print(f"  Buscando radicado (intento {attempt+1})...")
+        attempts = self.retry.attempts("busqueda")
+        logger.log("Iniciando búsqueda de radicado: %s con %s intentos.", radicado, attempts)
+
+        def attempt(n):
+            print(f"  Buscando radicado (intento {n+1})...")
+            self._count("intentos_busqueda")
             
             # Emulamos comportamiento humano antes de llenar
             self._emulate_mouse(page)
@@ -303,42 +2682,70 @@ class TybaDownloader:
             # Escritura con ritmo variable
             for char in radicado:
                 page.type("#MainContent_txtCodigoProceso", char)
-                time.sleep(random.uniform(0.1, 0.3))
+                self.pacing.pause("tecla")
                 
             self._human_delay(1, 1.5)
             self._emulate_mouse(page)
             page.click("#MainContent_btnConsultar")
             
             # Espera algo más larga por el captcha
-            time.sleep(random.uniform(4, 6))
+            self.pacing.pause("consulta")
             
             try:
                 page.wait_for_selector("#MainContent_grdProceso_imgbConsultarGrilla_0", timeout=8000)
-                break
-            except:
-                captcha_err = page.get_by_text("El valor de la Capcha no coincide").is_visible() or \
-                              page.get_by_text("Code Captcha value does not match").is_visible()
-                
-                if captcha_err:
-                    wait_time = 5 + (attempt * 2) # Espera incremental
-                    print(f"  {self.C_YELLOW}! Error de CAPTCHA, reintentando en {wait_time}s...{self.C_END}")
-                    time.sleep(wait_time)
+                self.pacing.success()
+                return
+            except PlaywrightTimeoutError:
+                if page.get_by_text("El valor de la Capcha no coincide").is_visible() or \
+                   page.get_by_text("Code Captcha value does not match").is_visible():
+                    self._count("errores_captcha")
                     reload_btn = page.locator("#MainContent_imgCaptcha").first
                     if reload_btn.is_visible(): reload_btn.click() # Intentar refrescar imagen si existe
-                    continue
-                else:
-                    # Si no es error de captcha, quizás la página está lenta
-                    try:
-                        page.wait_for_selector("#MainContent_grdProceso_imgbConsultarGrilla_0", timeout=5000)
-                        break
-                    except: continue
+                    raise CaptchaMismatch("El valor de la Capcha no coincide")
+                if self._case_not_found(page):
+                    raise CaseNotFound(f"TYBA no encontró el radicado {radicado}")
+            # Si no es error de captcha, quizás la página está lenta
+            try:
+                page.wait_for_selector("#MainContent_grdProceso_imgbConsultarGrilla_0", timeout=5000)
+            except PlaywrightTimeoutError:
+                self._count("timeouts_busqueda")
+                raise
+
+        def on_retry(e, n, wait):
+            if isinstance(e, CaptchaMismatch):
+                print(f"  {self.C_YELLOW}! Error de CAPTCHA, reintentando en {wait:.1f}s...{self.C_END}")
+            else:
+                print(f"  {self.C_YELLOW}! El portal no respondió a la consulta, reintentando en {wait:.1f}s...{self.C_END}")
+
+        try:
+            self.retry.call("busqueda", attempt, on_retry)
+        except (PlaywrightTimeoutError, CaptchaMismatch) as e:
+            raise Exception(f"No se pudo completar la búsqueda tras {attempts} intentos ({e})") from e
 
         details_btn = page.locator("#MainContent_grdProceso_imgbConsultarGrilla_0").first
         details_btn.wait_for(state="visible", timeout=60000)
         details_btn.click(force=True)
         page.wait_for_selector("a[href='#Archivos']", timeout=45000)
 
-    def _process_archivos(self, page: Page, case_dir, skip_notifications=False):
+    def _case_not_found(self, page: Page):
+        """True si el portal respondió que no hay procesos con ese radicado."""
+        try:
+            return page.get_by_text(re.compile(r"no se encontraron (registros|procesos|resultados)", re.IGNORECASE)).first.is_visible()
+        except Exception:
+            return False
+
+    def _session_lost(self, page: Page):
+        """True si la página volvió al formulario de búsqueda o muestra el aviso de sesión vencida."""
+        try:
+            if _SESSION_EXPIRED_RE.search(page.content().encode("utf-8", errors="replace")):
+                return True
+            return page.locator("#MainContent_txtCodigoProceso").first.is_visible() and \
+                   not page.locator("a[href='#Actuaciones']").first.is_visible()
+        except Exception:
+            return False
+
+    def _process_archivos(self, page: Page, state, skip_notifications=False):
+        self._phase("archivos")
         print(f"\n{self.C_CYAN}[Pestaña: Archivos]{self.C_END}")
         page.click("a[href='#Archivos']")
         # Eliminamos sleeps innecesarios, wait_for_selector es más rápido
@@ -349,113 +2756,217 @@ class TybaDownloader:
             print("  - Sin archivos disponibles.")
             return
 
-        logger.log(f"Entrando a pestaña Archivos...")
-        buttons = page.locator("input[id*='grdArchivos_imgbConsultarGrillaArchivos']")
-        count = buttons.count()
-        logger.log(f"Encontrados {count} botones de descarga en Archivos.")
+        logger.log("Entrando a pestaña Archivos...")
+        rows = read_grid(page, "MainContent_grdArchivos", "grdArchivos_imgbConsultarGrillaArchivos")
+        logger.log("Encontrados %s botones de descarga en Archivos.", len(rows))
+
+        for row in rows:
+            if not row.visible: continue
+            button = page.locator(f"#{row.button_id}")
+            self._download_archivo(page.context, state, row, lambda: self._archivo_viewer_url(page, button), skip_notifications)
+
+    def _archivo_viewer_url(self, page: Page, button):
+        """Abre el visor de un documento de la pestaña Archivos y devuelve la URL del PDF (o None)."""
+        button.click()
+        iframe = page.locator("#MainContent_IframeViewPDF").first
+        page.wait_for_selector("#MainContent_IframeViewPDF", timeout=30000)
+        src = iframe.get_attribute("src")
+        if src:
+            return (page.url.rsplit('/', 1)[0] + '/' + src).replace("\\", "/")
+        close_btn = page.locator("#MainContent_imbCerrarVistaPDF")
+        if close_btn.is_visible(): close_btn.click()
+        return None
+
+    def _download_archivo(self, context: BrowserContext, state, row, viewer_url, skip_notifications=False):
+        """Descarga un documento de la pestaña Archivos; `viewer_url()` abre su visor y devuelve la URL del PDF."""
+        file_description = row.text.split("\n")[0].strip()
+        safe_name = self.sanitize_filename(file_description)
+        file_path = os.path.join(state.case_dir, f"{safe_name}.pdf")
+        
+        # Las actuaciones van primero, así la fecha del auto admisorio ya se conoce
+        doc_date = state.auto_admite_date if "DEMANDA" in safe_name.upper() else "N/A"
+        if self._existing_ok(state, file_path, safe_name):
+             if skip_notifications and self._is_notification(file_path, act_name=safe_name):
+                 state.documents.add("archivo", safe_name, doc_date, path=file_path, decision="filtrado")
+                 os.remove(file_path)
+                 self._count("filtrados")
+                 logger.log("Archivo existente eliminado por filtro (Notificación): %s", safe_name)
+                 return
+             else:
+                 self._count("existentes")
+                 self._store_document(file_path)
+                 state.documents.add("archivo", safe_name, doc_date, path=file_path)
+                 print(f"  {self.C_CYAN}○ Ya existe:{self.C_END} {safe_name}")
+                 logger.log("Archivo ya existe: %s", safe_name)
+                 return
+
+        # Modo agresivo: si el nombre ya lo identifica como notificación, ni siquiera se descarga
+        if skip_notifications and self.name_prefilter and self._is_notification_by_name(safe_name):
+            print(f"  {self.C_YELLOW}○ Omitida (Notificación, por nombre): {safe_name}{self.C_END}")
+            self._count("filtrados_por_nombre")
+            state.documents.add("archivo", safe_name, doc_date, decision="filtrado_por_nombre")
+            logger.log("Archivo omitido sin descargar (Filtro por nombre): %s", safe_name)
+            return
+
+        def attempt(n):
+            with self._span("visor"):
+                url = viewer_url()
+            if not url:
+                raise HttpStatusError("el visor no devolvió la URL del documento")
+            accept = self._notification_gate(state, safe_name, skip_notifications)
+            return self._fetch_to_file(context, state, url, file_path, timeout=60000, accept=accept)
+
+        def on_retry(e, n, wait):
+            print(f"  {self.C_YELLOW}! Reintentando descarga de {safe_name} en {wait:.1f}s... ({e}){self.C_END}")
+            self._count("reintentos_archivo")
+
+        try:
+            size, digest, kept = self.retry.call("archivo", attempt, on_retry)
+        except (PostbackUnsupported, SessionExpired):
+            raise
+        except Exception as e:
+            self._count("errores")
+            state.errors.append(f"Error final en Archivo '{safe_name}': {e}")
+            print(f"  {self.C_RED}⚠ {self._failure_reason(e, 'archivo')} en {safe_name}.{self.C_END}")
+            return
+
+        if not kept:
+            self._count("filtrados")
+            state.documents.add("archivo", safe_name, doc_date, size=size, digest=digest, decision="filtrado")
+            print(f"  {self.C_YELLOW}○ Omitida (Notificación): {safe_name}{self.C_END}")
+        else:
+            self._count("descargados")
+            print(f"  {self.C_GREEN}↓ Descargado:{self.C_END} {safe_name}")
+            if state.pipeline is not None:
+                self._classify_later(state, "archivo", safe_name, doc_date, file_path, size, digest)
+            else:
+                self._store_document(file_path, digest)
+                state.documents.add("archivo", safe_name, doc_date, path=file_path, size=size, digest=digest)
+
+    def _failure_reason(self, error, operation):
+        """Texto del fallo definitivo de una descarga: permanente o tras agotar los intentos."""
+        if RetryPolicy.classify(error) == RetryPolicy.PERMANENT:
+            return f"Error permanente ({error}), sin reintentos,"
+        return f"Falló la descarga tras {self.retry.attempts(operation)} intentos"
+
+    def _check_actuacion_row(self, state, row, seen_rows, skip_notifications=False):
+        """Fecha, nombre y clave de manifiesto de una fila de grdActuaciones.
 
-        for i in range(count):
-            button = page.locator(f"#MainContent_grdArchivos_imgbConsultarGrillaArchivos_{i}")
-            if not button.is_visible(): continue
-                
-            file_description = button.locator("xpath=../..").inner_text().split("\n")[0].strip()
-            safe_name = self.sanitize_filename(file_description)
-            file_path = os.path.join(case_dir, f"{safe_name}.pdf")
-            
-            if os.path.exists(file_path) and os.path.getsize(file_path) > 1000:
-                 if skip_notifications and self._is_notification(file_path, act_name=file_description):
-                     os.remove(file_path)
-                     logger.log(f"Archivo existente eliminado por filtro (Notificación): {safe_name}")
-                 else:
-                     self.downloaded_docs.append({'date': 'N/A', 'name': safe_name, 'type': 'archivo'})
-                     print(f"  {self.C_CYAN}○ Ya existe:{self.C_END} {safe_name}")
-                     logger.log(f"Archivo ya existe: {safe_name}")
-                     continue
-
-            # Reintentos de descarga para mayor resiliencia
-            max_dl_retries = 2
-            success = False
+        Devuelve (fecha, nombre, clave, sin_cambios); con sin_cambios no hace falta abrir el detalle.
+        """
+        act_date = row.date if row.date is not None else "N/A"
+        act_name = row.description if row.description is not None else f"Actuación_{row.index}"
+        
+        # Identify Auto Admite date (Auto Admite, Auto Admisorio, or Auto de Admisión)
+        # Using more robust matching (ADMIS covers Admisorio, Admisión, etc)
+        u_name = act_name.upper()
+        if "AUTO" in u_name and ("ADMITE" in u_name or "ADMIS" in u_name):
+            if state.auto_admite_date == "Sin fecha":
+                state.auto_admite_date = act_date
+                print(f"  {self.C_YELLOW}→ Fecha detectada para Demanda: {act_date}{self.C_END}")
+
+        # Manifiesto: si la fila no cambió desde la última sincronización no abrimos el detalle
+        fingerprint = CaseManifest.fingerprint(row.cells)
+        occurrence = seen_rows.get(fingerprint, 0)
+        seen_rows[fingerprint] = occurrence + 1
+        row_key = f"{fingerprint}#{occurrence}"
+        entry = None if self.full_resync else state.manifest.complete_entry(row_key, skip_notifications, self.verify_pages)
+        if entry is None:
+            return act_date, act_name, row_key, False
+        for f_info in entry["files"]:
+            if f_info["outcome"] == "kept":
+                state.documents.add("actuacion", f_info["name"], act_date,
+                                    path=os.path.join(state.case_dir, f"{f_info['name']}.pdf"))
+            else:
+                state.documents.add("actuacion", f_info["name"], act_date, decision="filtrado")
+        logger.log("Actuación sin cambios (manifiesto): '%s' (%s archivos)", act_name, len(entry['files']))
+        return act_date, act_name, row_key, True
+
+    def _collect_attachments(self, state, file_rows, act_name, act_date, skip_notifications, button_of):
+        """Revisa los adjuntos de una actuación. Los que ya están en disco o se descartan por nombre quedan resueltos.
+
+        Devuelve (pendientes, {nombre: resultado}). `button_of(fila)` da el botón que guarda cada Attachment.
+        """
+        pending = [] # Adjuntos por descargar
+        outcomes = {} # Nombre -> resultado, para el manifiesto
+        files_count = len(file_rows)
+        for f_row in file_rows:
+            j = f_row.index
+            f_name = self.sanitize_filename(f_row.text.strip())
+            if not f_name: f_name = f"{self.sanitize_filename(act_name)}_{j}"
             
-            for dl_attempt in range(max_dl_retries):
-                try:
-                    button.click()
-                    iframe = page.locator("#MainContent_IframeViewPDF").first
-                    page.wait_for_selector("#MainContent_IframeViewPDF", timeout=30000)
-                    src = iframe.get_attribute("src")
-                    if src:
-                        url = (page.url.rsplit('/', 1)[0] + '/' + src).replace("\\", "/")
-                        response = page.context.request.get(url, timeout=60000)
-                        if response.ok and len(response.body()) > 100:
-                            with open(file_path, 'wb') as f: f.write(response.body())
-                            
-                            if skip_notifications and self._is_notification(file_path, act_name=file_description):
-                                print(f"  {self.C_YELLOW}○ Omitida (Notificación): {safe_name}{self.C_END}")
-                                os.remove(file_path)
-                            else:
-                                print(f"  {self.C_GREEN}↓ Descargado:{self.C_END} {safe_name}")
-                                self.downloaded_docs.append({'date': 'N/A', 'name': safe_name, 'type': 'archivo'})
-                            success = True
-                            break # Exito, salir del loop de reintentos
-                    
-                    close_btn = page.locator("#MainContent_imbCerrarVistaPDF")
-                    if close_btn.is_visible(): close_btn.click()
-                except Exception as e:
-                    if dl_attempt == max_dl_retries - 1:
-                        self.errors.append(f"Error final en Archivo '{safe_name}': {e}")
-                        print(f"  {self.C_RED}⚠ Falló descarga de {safe_name} tras {max_dl_retries} intentos.{self.C_END}")
-                    else:
-                        print(f"  {self.C_YELLOW}! Reintentando descarga de {safe_name}...{self.C_END}")
-                        time.sleep(2)
+            logger.log("  [Archivo %s/%s] Procesando: '%s'", j+1, files_count, f_name)
+
+            f_path = os.path.join(state.case_dir, f"{f_name}.pdf")
+            if self._existing_ok(state, f_path, f_name):
+                is_notif = False
+                if skip_notifications:
+                    is_notif = self._is_notification(f_path, act_name=f_name)
+                    logger.log("  - Check Notificación (Existente): %s", is_notif)
+
+                if skip_notifications and is_notif:
+                    state.documents.add("actuacion", f_name, act_date, path=f_path, decision="filtrado")
+                    os.remove(f_path)
+                    self._count("filtrados")
+                    logger.log("  - ELIMINADO (Notificación existente): %s", f_name)
+                    outcomes[f_name] = "filtered"
+                    continue
+                else:
+                    self._count("existentes")
+                    self._store_document(f_path)
+                    state.documents.add("actuacion", f_name, act_date, path=f_path)
+                    print(f"  {self.C_CYAN}○ Ya existe:{self.C_END} {f_name}")
+                    logger.log("  - OMITIDO (Ya existe validado): %s", f_name)
+                    outcomes[f_name] = "kept"
+                    continue
+
+            # Modo agresivo: si el nombre ya lo identifica como notificación, ni siquiera se descarga
+            if skip_notifications and self.name_prefilter and self._is_notification_by_name(f_name):
+                print(f"  {self.C_YELLOW}○ Omitida (Notificación, por nombre): {f_name}{self.C_END}")
+                self._count("filtrados_por_nombre")
+                state.documents.add("actuacion", f_name, act_date, decision="filtrado_por_nombre")
+                logger.log("  - OMITIDO sin descargar (Filtro por nombre): %s", f_name)
+                outcomes[f_name] = "filtered"
+                continue
 
-    def _process_actuaciones(self, page: Page, context: BrowserContext, case_dir, skip_notifications=False):
+            # El HTML de la fila permite deducir la URL del generador sin abrir el popup
+            pending.append(Attachment(j, button_of(f_row), f_name, f_path, f_row.html))
+        return pending, outcomes
+
+    def _process_actuaciones(self, page: Page, context: BrowserContext, state, skip_notifications=False, engine=None):
+        self._phase("actuaciones")
         print(f"\n{self.C_CYAN}[Pestaña: Actuaciones]{self.C_END}")
         page.click("a[href='#Actuaciones']")
         # Velocidad: esperamos contenido, no tiempo
         page.wait_for_selector("#MainContent_grdActuaciones", timeout=10000)
         
-        # Determine column indices more robustly
-        header_row = page.locator("#MainContent_grdActuaciones tr").first
-        headers = header_row.locator("th, td").all_text_contents()
-        date_idx = -1
-        desc_idx = -1
-        for idx, h in enumerate(headers):
-            text = h.upper().strip()
-            if "FECHA" in text and "REGISTRO" not in text: date_idx = idx
-            if "ACTUACIÓN" in text or "DESCRIPCIÓN" in text: desc_idx = idx
+        seen_rows = {} # Huella -> ocurrencias (dos filas idénticas no deben compartir entrada del manifiesto)
 
         # Logic for multiple pages if they exist
         while True:
-            btns = page.locator("input[id*='grdActuaciones_imgbConsultarGrilla']")
-            count = btns.count()
+            # Toda la página de la grilla (cabecera incluida) en una sola llamada
+            rows = read_grid(page, "MainContent_grdActuaciones", "grdActuaciones_imgbConsultarGrilla")
+            count = len(rows)
+            unchanged = 0
             print(f"  Analizando {count} actuaciones en esta página...")
-            logger.log(f"Procesando página de actuaciones. Encontradas: {count}")
+            logger.log("Procesando página de actuaciones. Encontradas: %s", count)
+            page_started = time.perf_counter()
             
-            for i in range(count):
-                # Mensaje de progreso visual para el usuario
-                print(f"  > Procesando actuación {i+1}/{count} de esta página...", end="\r")
-                logger.log(f"--- Inicio procesamiento actuación {i+1}/{count} ---")
-                
-                btn_id = f"MainContent_grdActuaciones_imgbConsultarGrilla_{i}"
-                row_xpath = f"xpath=//*[@id='{btn_id}']/../.."
-                row = page.locator(row_xpath)
-                
-                cols = row.locator("td").all_text_contents()
-                if not cols: continue
-                
-                act_date = cols[date_idx].strip() if date_idx != -1 else "N/A"
-                act_name = cols[desc_idx].strip() if desc_idx != -1 else f"Actuación_{i}"
+            for n, row in enumerate(rows):
+                i = row.index
+                # Mensaje de progreso visual para el usuario (con ETA de la página y caudal del expediente)
+                print(f"  > Procesando actuación {n+1}/{count} de esta página ({state.metrics.progress(n, count, page_started)})...", end="\r")
+                logger.log("--- Inicio procesamiento actuación %s/%s ---", n+1, count)
                 
-                # Identify Auto Admite date (Auto Admite, Auto Admisorio, or Auto de Admisión)
-                # Using more robust matching (ADMIS covers Admisorio, Admisión, etc)
-                u_name = act_name.upper()
-                if "AUTO" in u_name and ("ADMITE" in u_name or "ADMIS" in u_name):
-                    if self.auto_admite_date == "Sin fecha":
-                        self.auto_admite_date = act_date
-                        print(f"  {self.C_YELLOW}→ Fecha detectada para Demanda: {act_date}{self.C_END}")
+                if not row.cells: continue
+                act_date, act_name, row_key, is_unchanged = self._check_actuacion_row(state, row, seen_rows, skip_notifications)
+                if is_unchanged:
+                    unchanged += 1
+                    continue
 
                 # Selección rápida de actuación
-                f_btn_id = f"MainContent_grdActuaciones_imgbConsultarGrilla_{i}"
-                page.click(f"#{f_btn_id}")
+                detail_started = time.perf_counter()
+                page.click(f"#{row.button_id}")
                 
                 try:
                     # Esperamos la vista de detalle
@@ -463,128 +2974,53 @@ class TybaDownloader:
                     
                     # Intentamos esperar explícitamente la tabla de archivos
                     # Aumentamos a 5s para cubrir conexiones lentas ("solución general")
+                    files_grid_loaded = True
                     try:
                         page.wait_for_selector("#MainContent_grdArchivosActuaciones", timeout=5000)
                     except:
-                        pass 
+                        files_grid_loaded = False
+                    state.metrics.add_time("detalle", time.perf_counter() - detail_started)
 
-                    files_locator = page.locator("input[id*='grdArchivosActuaciones_imgDescargaArchivos']")
-                    files_count = files_locator.count()
-                    logger.log(f"Actuación '{act_name}': Encontrados {files_count} archivos adjuntos.")
+                    file_rows = read_grid(page, "MainContent_grdArchivosActuaciones", "grdArchivosActuaciones_imgDescargaArchivos")
+                    logger.log("Actuación '%s': Encontrados %s archivos adjuntos.", act_name, len(file_rows))
                     
-                    if files_count == 0:
+                    if not file_rows:
                         # Verificación visual rápida: ¿está vacío o falló la carga?
                         print(f"  - No se encontraron archivos adjuntos.")
                     
-                    for j in range(files_count):
-                        f_btn_id = f"MainContent_grdArchivosActuaciones_imgDescargaArchivos_{j}"
-                        f_btn = page.locator(f"#{f_btn_id}")
-                        f_row = page.locator(f"xpath=//*[@id='{f_btn_id}']/../..")
-                        f_name = self.sanitize_filename(f_row.inner_text().strip())
-                        if not f_name: f_name = f"{self.sanitize_filename(act_name)}_{j}"
-                        
-                        logger.log(f"  [Archivo {j+1}/{files_count}] Procesando: '{f_name}'")
-
-                        f_path = os.path.join(case_dir, f"{f_name}.pdf")
-                        if os.path.exists(f_path) and os.path.getsize(f_path) > 1000:
-                            is_notif = False
-                            if skip_notifications:
-                                is_notif = self._is_notification(f_path, act_name=f_name)
-                                logger.log(f"  - Check Notificación (Existente): {is_notif}")
-
-                            if skip_notifications and is_notif:
-                                os.remove(f_path)
-                                logger.log(f"  - ELIMINADO (Notificación existente): {f_name}")
-                            else:
-                                if not any(d['name'] == f_name for d in self.downloaded_docs):
-                                    self.downloaded_docs.append({'date': act_date, 'name': f_name, 'type': 'actuacion'})
-                                print(f"  {self.C_CYAN}○ Ya existe:{self.C_END} {f_name}")
-                                logger.log(f"  - OMITIDO (Ya existe validado): {f_name}")
-                                continue
-
-                        # Reintentos para descargas de actuaciones
-                        max_act_retries = 3 
-                        success = False
-                        for act_attempt in range(max_act_retries):
-                            logger.log(f"  - Intento de descarga {act_attempt+1}/{max_act_retries} para '{f_name}'")
-                            new_p = None
-                            try:
-                                # Aseguramos que el botón sea visible en el viewport antes de click
-                                f_btn.scroll_into_view_if_needed()
-                                time.sleep(0.5) # Pequeña pausa para que el scroll termine
-                                
-                                # A veces el click necesita ser forzado o reintentado si el portal ignora el primero
-                                with context.expect_page(timeout=60000) as new_p_info: 
-                                    f_btn.click(force=True, timeout=30000)
-                                    
-                                new_p = new_p_info.value
-                                
-                                # Esperamos a que la página inicie carga de forma resiliente
-                                try:
-                                    new_p.wait_for_load_state("domcontentloaded", timeout=45000)
-                                except:
-                                    pass 
-                                
-                                t_url = new_p.url if "Descargando.aspx" in new_p.url else None
-                                if not t_url:
-                                    iframe = new_p.locator("iframe[src*='Descargando.aspx']").first
-                                    # Espera generosa para el iframe generador
-                                    if iframe.is_visible() or iframe.wait_for(state="visible", timeout=30000):
-                                        t_url = iframe.get_attribute("src")
-                                
-                                if t_url:
-                                    if not t_url.startswith("http"): 
-                                        t_url = (new_p.url.rsplit('/', 1)[0] + '/' + t_url).replace("\\", "/")
-                                    
-                                    # Tiempo muy generoso para generación de PDF en servidores lentos
-                                    res = new_p.request.get(t_url, timeout=120000) 
-                                    if res.ok and len(res.body()) > 100:
-                                        with open(f_path, 'wb') as f: f.write(res.body())
-                                        
-                                        logger.log(f"  - Descarga completada. Tamaño: {len(res.body())} bytes")
-                                        
-                                        is_notif = False
-                                        if skip_notifications:
-                                            is_notif = self._is_notification(f_path, act_name=f_name)
-                                            logger.log(f"  - Check Notificación (Nuevo): {is_notif}")
-
-                                        if skip_notifications and is_notif:
-                                            print(f"  {self.C_YELLOW}○ Omitida (Notificación): {f_name}{self.C_END}")
-                                            logger.log(f"  - ELIMINADO (Filtro Notificación): {f_name}")
-                                            os.remove(f_path)
-                                        else:
-                                            print(f"  {self.C_GREEN}↓ Descargado:{self.C_END} {f_name}")
-                                            logger.log(f"  - CONSERVADO: {f_name}")
-                                            self.downloaded_docs.append({'date': act_date, 'name': f_name, 'type': 'actuacion'})
-                                        success = True
-                                        new_p.close()
-                                        break
-                                
-                                if new_p: new_p.close()
-                                raise Exception("No se pudo detectar el generador del PDF")
-                            except Exception as e:
-                                if new_p: 
-                                    try: new_p.close()
-                                    except: pass
-                                if act_attempt == max_act_retries - 1:
-                                    self.errors.append(f"Error final en Actuación '{f_name}' ({act_date}): {e}")
-                                    print(f"  {self.C_RED}⚠ Falló descarga de {f_name} tras {max_act_retries} intentos.{self.C_END}")
-                                else:
-                                    wait_retry = 3 + (act_attempt * 2)
-                                    print(f"  {self.C_YELLOW}! Reintentando descarga de {f_name} en {wait_retry}s... ({e}){self.C_END}")
-                                    time.sleep(wait_retry)
+                    pending, outcomes = self._collect_attachments(
+                        state, file_rows, act_name, act_date, skip_notifications, lambda f_row: page.locator(f"#{f_row.button_id}")
+                    )
+
+                    if engine is not None and pending:
+                        outcomes.update(self._download_attachments_parallel(context, engine, state, pending, act_date, skip_notifications))
+                    else:
+                        for att in pending:
+                            outcomes[att.name] = self._download_attachment(context, state, att, act_date, skip_notifications)
+
+                    # Una vista sin grilla ni adjuntos puede ser una carga fallida: no la damos por completa
+                    if files_grid_loaded or outcomes:
+                        state.manifest.record(row_key, act_date, act_name, outcomes)
+                except SessionExpired:
+                    raise
                 except Exception as e:
-                    self.errors.append(f"Error procesando lista de archivos en actuación {i}: {e}")
-                    logger.log(f"Error procesando lista de archivos en actuación {i} ('{act_name}'): {e}")
+                    if self._session_lost(page):
+                        raise SessionExpired(f"se perdió la vista del expediente en la actuación {i}") from e
+                    self._count("errores")
+                    state.errors.append(f"Error procesando lista de archivos en actuación {i}: {e}")
+                    logger.log("Error procesando lista de archivos en actuación %s ('%s'): %s", i, act_name, e, level=logging.ERROR)
 
                 page.click("#MainContent_btnRegresarActuacion")
                 # CRÍTICO: Esperar a que la tabla de actuaciones reaparezca totalmente antes de continuar
                 try:
                     page.wait_for_selector("#MainContent_grdActuaciones", timeout=15000)
                     # Pequeña pausa de estabilización del DOM
-                    time.sleep(0.5)
+                    self.pacing.pause("regresar")
                 except:
-                    logger.log("Advertencia: No se detectó regeneración de tabla de actuaciones.")
+                    logger.log("Advertencia: No se detectó regeneración de tabla de actuaciones.", level=logging.WARNING)
+
+            if unchanged:
+                print(f"  {self.C_CYAN}○ {unchanged} actuaciones sin cambios desde la última sincronización.{self.C_END}")
 
             # Lógica de paginación de TYBA (Números en la parte inferior)
             # Buscamos el siguiente número de página después de la actual
@@ -599,7 +3035,7 @@ class TybaDownloader:
                         if next_page_link.is_visible():
                             print(f"  {self.C_YELLOW}→ Avanzando a página {current_page_num + 1}...{self.C_END}")
                             next_page_link.click()
-                            time.sleep(2)
+                            self.pacing.pause("pagina")
                             page.wait_for_selector("#MainContent_grdActuaciones", timeout=10000)
                             continue # Seguimos en el while True
             except Exception:
@@ -608,38 +3044,1528 @@ class TybaDownloader:
             # Si no hay más páginas o hubo error, salimos
             break
 
-if __name__ == "__main__":
-    try:
-        os.system('cls' if os.name == 'nt' else 'clear')
-        C_CYAN = "\033[96m"
-        C_BLUE = "\033[94m"
-        C_BOLD = "\033[1m"
-        C_END = "\033[0m"
-        
-        title = "TYBA DOWNLO@DER"
-        print(f"\n{C_BLUE}{C_BOLD}{'='*60}")
-        print(f"{title:^60}")
-        print(f"{'='*60}{C_END}")
-        
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        notif_pref = input(f"{C_BOLD}¿Omitir notificaciones y citaciones? (s/n) [S]:{C_END} ").strip().lower()
-        skip_notif = notif_pref != 'n'
+    def _process_case_http(self, page: Page, context: BrowserContext, state, skip_notifications=False):
+        """Motor HTTP: recorre el detalle repitiendo los postbacks de ASP.NET sin el navegador.
+
+        El navegador solo ha resuelto la búsqueda (CAPTCHA y cookies); si el motor encuentra algo que no
+        sabe reproducir, lo que falte se hace con el flujo de Playwright tras recargar el detalle en el navegador.
+        """
+        actuaciones_done = False
+        session = None
+        try:
+            state.http.set_cookies(context.cookies())
+            session = PostbackSession(state.http, page.url, page.content())
+            self._process_actuaciones_http(session, context, state, skip_notifications)
+            actuaciones_done = True
+            self._process_archivos_http(session, context, state, skip_notifications)
+            return
+        except PostbackUnsupported as e:
+            print(f"\n  {self.C_YELLOW}! Motor HTTP: {e}. Se continúa con el navegador.{self.C_END}")
+            logger.log("Motor HTTP abandonado para %s: %s", state.radicado, e, level=logging.WARNING)
+            if session is not None and session.postbacks:
+                self._reopen_detail(page, context, state)
+
+        if not actuaciones_done:
+            # Las actuaciones ya registradas en el manifiesto no se vuelven a abrir
+            self._process_actuaciones(page, context, state, skip_notifications)
+        self._process_archivos(page, state, skip_notifications)
+
+    def _process_actuaciones_http(self, session, context: BrowserContext, state, skip_notifications=False):
+        self._phase("actuaciones")
+        print(f"\n{self.C_CYAN}[Pestaña: Actuaciones]{self.C_END}")
+        if not session.has_element("MainContent_grdActuaciones"):
+            raise PostbackUnsupported("no aparece la grilla de actuaciones")
+
+        seen_rows = {} # Huella -> ocurrencias (dos filas idénticas no deben compartir entrada del manifiesto)
+        page_num = 1
+        while True:
+            rows = session.grid("MainContent_grdActuaciones", "grdActuaciones_imgbConsultarGrilla")
+            count = len(rows)
+            unchanged = 0
+            print(f"  Analizando {count} actuaciones en esta página...")
+            logger.log("Procesando página %s de actuaciones por HTTP. Encontradas: %s", page_num, count)
+            page_started = time.perf_counter()
+
+            for n, row in enumerate(rows):
+                print(f"  > Procesando actuación {n+1}/{count} de esta página ({state.metrics.progress(n, count, page_started)})...", end="\r")
+                if not row.cells: continue
+                act_date, act_name, row_key, is_unchanged = self._check_actuacion_row(state, row, seen_rows, skip_notifications)
+                if is_unchanged:
+                    unchanged += 1
+                    continue
+
+                with state.metrics.span("detalle"):
+                    session.submit(row.button_id)
+                if not session.has_element("MainContent_btnRegresarActuacion"):
+                    raise PostbackUnsupported(f"el postback de '{act_name}' no devolvió la vista de detalle")
+                files_grid_loaded = session.has_element("MainContent_grdArchivosActuaciones")
+                file_rows = session.grid("MainContent_grdArchivosActuaciones", "grdArchivosActuaciones_imgDescargaArchivos")
+                logger.log("Actuación '%s': Encontrados %s archivos adjuntos (HTTP).", act_name, len(file_rows))
+                if not file_rows:
+                    print(f"  - No se encontraron archivos adjuntos.")
+
+                pending, outcomes = self._collect_attachments(
+                    state, file_rows, act_name, act_date, skip_notifications, lambda f_row: f_row.button_id
+                )
+                for att in pending:
+                    outcomes[att.name] = self._download_attachment(
+                        context, state, att, act_date, skip_notifications, resolve_url=lambda att=att: session.attachment_url(att.button)
+                    )
+                if files_grid_loaded or outcomes:
+                    state.manifest.record(row_key, act_date, act_name, outcomes)
+
+                session.submit("MainContent_btnRegresarActuacion")
+                if not session.has_element("MainContent_grdActuaciones"):
+                    raise PostbackUnsupported("no se pudo volver a la grilla de actuaciones")
+
+            if unchanged:
+                print(f"  {self.C_CYAN}○ {unchanged} actuaciones sin cambios desde la última sincronización.{self.C_END}")
+
+            target = session.pager_target("MainContent_grdActuaciones", page_num + 1)
+            if not target:
+                break
+            page_num += 1
+            print(f"  {self.C_YELLOW}→ Avanzando a página {page_num}...{self.C_END}")
+            self.pacing.pause("pagina")
+            session.postback(*target)
+
+    def _process_archivos_http(self, session, context: BrowserContext, state, skip_notifications=False):
+        self._phase("archivos")
+        print(f"\n{self.C_CYAN}[Pestaña: Archivos]{self.C_END}")
+        rows = session.grid("MainContent_grdArchivos", "grdArchivos_imgbConsultarGrillaArchivos")
+        if not rows:
+            print("  - Sin archivos disponibles.")
+            return
+        logger.log("Encontrados %s botones de descarga en Archivos (HTTP).", len(rows))
+        for row in rows:
+            if not row.visible: continue
+            self._download_archivo(context, state, row, lambda row=row: session.archivo_url(row.button_id), skip_notifications)
+
+    def _popup_generator_url(self, new_p: Page):
+        """Localiza la URL del generador Descargando.aspx dentro del popup de un adjunto."""
+        # Esperamos a que la página inicie carga de forma resiliente
+        try:
+            new_p.wait_for_load_state("domcontentloaded", timeout=45000)
+        except:
+            pass 
         
-        downloader = TybaDownloader(output_base_dir=script_dir, silent_mode=True)
+        t_url = new_p.url if "Descargando.aspx" in new_p.url else None
+        if not t_url:
+            iframe = new_p.locator("iframe[src*='Descargando.aspx']").first
+            # Espera generosa para el iframe generador
+            if not iframe.is_visible():
+                iframe.wait_for(state="visible", timeout=30000)
+            t_url = iframe.get_attribute("src")
         
-        while True:
-            radicado = input(f"\n{C_BOLD}Ingrese 23 dígitos del radicado (o 'q' para salir):{C_END} ").strip()
-            if not radicado: continue
-            if radicado.lower() == 'q': break
-                
+        if not t_url:
+            raise Exception("No se pudo detectar el generador del PDF")
+        if not t_url.startswith("http"): 
+            t_url = (new_p.url.rsplit('/', 1)[0] + '/' + t_url).replace("\\", "/")
+        return t_url
+
+    def _attachment_url(self, context: BrowserContext, f_btn):
+        """Abre el popup de un adjunto, extrae la URL del generador y lo cierra."""
+        new_p = None
+        try:
+            # Aseguramos que el botón sea visible en el viewport antes de click
+            f_btn.scroll_into_view_if_needed()
+            self.pacing.pause("clic") # Pequeña pausa para que el scroll termine
+            
+            # A veces el click necesita ser forzado o reintentado si el portal ignora el primero
+            with context.expect_page(timeout=60000) as new_p_info: 
+                f_btn.click(force=True, timeout=30000)
+            new_p = new_p_info.value
+            return self._popup_generator_url(new_p)
+        finally:
+            if new_p:
+                try: new_p.close()
+                except: pass
+
+    def _existing_ok(self, state, path, name):
+        """True si `path` ya está en disco y completo. Uno dañado se anota en el índice y se borra para volver a descargarlo."""
+        if not os.path.exists(path):
+            return False
+        problem = pdf_integrity_problem(path, self.verify_pages)
+        if problem is None:
+            return True
+        self._count("danados")
+        state.documents.flag_damaged(name, problem)
+        print(f"  {self.C_YELLOW}! Archivo dañado ({problem}), se vuelve a descargar: {name}{self.C_END}")
+        logger.log("Archivo dañado en disco: '%s' (%s). Se vuelve a descargar.", name, problem, level=logging.WARNING)
+        try: os.remove(path)
+        except OSError: pass
+        return False
+
+    def _store_document(self, path, digest=None):
+        """Con el almacén activado, guarda el PDF una sola vez por contenido y deja un enlace con su nombre."""
+        if not self.content_store: return
+        try:
+            if digest is None:
+                if self.content_store.is_linked(path): return
+                digest = _file_sha256(path)
+            self.content_store.adopt(path, digest)
+        except Exception as e:
+            logger.log("  - No se pudo enlazar '%s' al almacén: %s", os.path.basename(path), e, level=logging.WARNING)
+
+    def _notification_gate(self, state, name, skip_notifications=True):
+        """Callback `accept` para las descargas: clasifica el documento antes de escribirlo en su destino.
+
+        Con el filtro en segundo plano no hay callback: el archivo se escribe y se clasifica después.
+        """
+        if not skip_notifications or state.pipeline is not None:
+            return None
+        metrics = CaseMetrics.current() # el motor paralelo llama a accept desde otro hilo
+        def accept(source, digest):
+            is_notif = self._is_notification(source, act_name=name, digest=digest, metrics=metrics)
+            logger.log("  - Check Notificación (Nuevo): %s", is_notif)
+            return not is_notif
+        return accept
+
+    def _register_download(self, state, f_path, f_name, act_date, kept, digest=None, size=None):
+        """Anota en el índice un adjunto recién descargado (o que el filtro lo descartó).
+
+        Devuelve el resultado para el manifiesto: "kept" o "filtered".
+        """
+        self.pacing.success()
+        if not kept:
+            self._count("filtrados")
+            state.documents.add("actuacion", f_name, act_date, size=size, digest=digest, decision="filtrado")
+            print(f"  {self.C_YELLOW}○ Omitida (Notificación): {f_name}{self.C_END}")
+            logger.log("  - DESCARTADO sin escribir en disco (Filtro Notificación): %s", f_name)
+            return "filtered"
+        self._count("descargados")
+        print(f"  {self.C_GREEN}↓ Descargado:{self.C_END} {f_name}")
+        if state.pipeline is not None:
+            # Queda "kept" en el manifiesto; si el filtro la descarta, _drain_pipeline lo corrige
+            self._classify_later(state, "actuacion", f_name, act_date, f_path, size, digest)
+            return "kept"
+        logger.log("  - CONSERVADO: %s", f_name)
+        self._store_document(f_path, digest)
+        state.documents.add("actuacion", f_name, act_date, path=f_path, size=size, digest=digest)
+        return "kept"
+
+    def _classify_later(self, state, tab, name, date, path, size, digest):
+        """Filtro en segundo plano: registra el documento como pendiente y lo encola para clasificarlo.
+
+        No pasa al almacén hasta que el filtro lo conserva (_drain_pipeline): una notificación no deja copia en .almacen.
+        """
+        state.documents.add(tab, name, date, path=path, size=size, digest=digest, decision="pendiente")
+        logger.log("  - En cola del filtro: %s", name)
+        with self._span("cola_filtro"): # solo tarda si la cola está llena
+            state.pipeline.submit(path, (tab, name), name, digest)
+
+    def _drain_pipeline(self, state):
+        """Aplica los resultados del filtro en segundo plano: borra las notificaciones y completa el índice."""
+        if state.pipeline is None:
+            return
+        self._phase("filtro")
+        filtered = []
+        with self._span("filtro"):
+            for (tab, name), path, is_notif, reason in state.pipeline.drain():
+                logger.log("  - Filtro en segundo plano: '%s' -> %s (%s)", name, 'notificación' if is_notif else 'conservado', reason)
+                if not is_notif:
+                    record = state.documents.records.get((tab, name))
+                    self._store_document(path, record.sha256 if record else None)
+                    state.documents.resolve(tab, name, "conservado")
+                    continue
+                try: os.remove(path)
+                except OSError: pass
+                state.documents.resolve(tab, name, "filtrado")
+                filtered.append(name)
+                self._count("descargados", -1)
+                self._count("filtrados")
+                print(f"  {self.C_YELLOW}○ Retirada (Notificación): {name}{self.C_END}")
+        if filtered:
+            state.manifest.mark_filtered(filtered)
+
+    def _fetch_to_file(self, context: BrowserContext, state, url, path, timeout=120000, accept=None, require_pdf=False):
+        """Descarga `url` en `path` en streaming y con escritura atómica. Devuelve (tamaño, sha256, conservado).
+
+        Se usa el cliente HTTP del expediente con las cookies del contexto; si falla a nivel de
+        conexión se recurre al APIRequestContext de Playwright (que sí carga el cuerpo en memoria),
+        salvo que quede un .part reanudable. `accept` decide sobre los bytes antes de escribir el destino (ver HttpClient.download).
+        El tiempo (también el de los intentos fallidos) se anota como "descarga" en las métricas del expediente.
+        """
+        metrics = state.metrics
+        started = time.perf_counter()
+        try:
+            size, digest, kept = self._fetch_body(context, state, url, path, timeout, accept, require_pdf)
+        finally:
+            if metrics: metrics.add_time("descarga", time.perf_counter() - started)
+        if metrics:
+            metrics.file_done(os.path.basename(path), time.perf_counter() - started, size, "kept" if kept else "filtered")
+        return size, digest, kept
+
+    def _fetch_body(self, context: BrowserContext, state, url, path, timeout, accept, require_pdf):
+        try:
+            state.http.set_cookies(context.cookies())
+            return state.http.download(url, path, timeout=timeout / 1000, accept=accept, require_pdf=require_pdf)
+        except HttpStatusError:
+            raise
+        except Exception as e:
+            # Con un .part reanudable es mejor reintentar por HTTP que empezar de cero en Playwright
+            if os.path.exists(path + ".part.json"):
+                raise
+            logger.log("  - Cliente HTTP directo falló (%s); se usa el APIRequestContext.", e)
+
+        res = context.request.get(url, timeout=timeout)
+        if not res.ok:
+            raise HttpStatusError(f"Respuesta inválida del servidor (HTTP {res.status})", res.status)
+        body = res.body()
+        _check_body(len(body), body[:1024], require_pdf=require_pdf)
+        digest = hashlib.sha256(body).hexdigest()
+        if accept and not accept(body, digest):
+            return len(body), digest, False
+        _atomic_write(path, body)
+        return len(body), digest, True
+
+    def _download_attachment(self, context: BrowserContext, state, att, act_date, skip_notifications=False, resolve_url=None):
+        """Descarga un adjunto con reintentos. `resolve_url()` obtiene la URL del generador (por defecto, abriendo el popup)."""
+        # Vía rápida: si ya conocemos el patrón del generador no abrimos ninguna página
+        accept = self._notification_gate(state, att.name, skip_notifications)
+        fast_url = state.generator_urls.guess(att.row_html)
+        if fast_url:
             try:
-                downloader.download_case(radicado, skip_notifications=skip_notif)
+                started = time.perf_counter()
+                size, digest, kept = self._fetch_to_file(context, state, fast_url, att.path, accept=accept, require_pdf=True)
+                logger.log("  - Descarga directa (sin popup) completada. Tamaño: %s bytes", size, bytes=size,
+                           duracion_ms=round((time.perf_counter() - started) * 1000))
+                return self._register_download(state, att.path, att.name, act_date, kept, digest, size)
+            except SessionExpired:
+                raise
             except Exception as e:
-                print(f"\n{downloader.C_RED}Error: {e}{downloader.C_END}")
-                
-        print(f"\n{C_CYAN}Finalizado. ¡Hasta la próxima!{C_END}")
-        
+                logger.log("  - Vía rápida fallida para '%s': %s. Se usa el popup.", att.name, e)
+                state.generator_urls.reject()
+                try: os.remove(att.path)
+                except OSError: pass
+
+        # Reintentos para descargas de actuaciones
+        attempts = self.retry.attempts("adjunto")
+        def attempt(n):
+            logger.log("  - Intento de descarga %s/%s para '%s'", n+1, attempts, att.name)
+            with self._span("popup"):
+                t_url = resolve_url() if resolve_url else self._attachment_url(context, att.button)
+            state.generator_urls.learn(att.row_html, t_url)
+            
+            started = time.perf_counter()
+            result = self._fetch_to_file(context, state, t_url, att.path, accept=accept)
+            logger.log("  - Descarga completada. Tamaño: %s bytes", result[0], bytes=result[0],
+                       duracion_ms=round((time.perf_counter() - started) * 1000))
+            return result
+
+        def on_retry(e, n, wait):
+            print(f"  {self.C_YELLOW}! Reintentando descarga de {att.name} en {wait:.1f}s... ({e}){self.C_END}")
+            self._count("reintentos_adjunto")
+
+        try:
+            size, digest, kept = self.retry.call("adjunto", attempt, on_retry)
+        except (PostbackUnsupported, SessionExpired):
+            raise
+        except Exception as e:
+            self._count("errores")
+            state.errors.append(f"Error final en Actuación '{att.name}' ({act_date}): {e}")
+            print(f"  {self.C_RED}⚠ {self._failure_reason(e, 'adjunto')} en {att.name}.{self.C_END}")
+            return "error"
+        return self._register_download(state, att.path, att.name, act_date, kept, digest, size)
+
+    def _download_attachments_parallel(self, context: BrowserContext, engine, state, pending, act_date, skip_notifications=False):
+        """Abre a la vez los popups de todos los adjuntos y delega las descargas al motor paralelo.
+
+        Devuelve {nombre: resultado} como _download_attachment.
+        """
+        state.http.set_cookies(context.cookies())
+        futures = {}
+        fallback = []
+        outcomes = {}
+
+        # Los adjuntos cuyo generador ya sabemos deducir no necesitan popup
+        needs_popup = []
+        for att in pending:
+            fast_url = state.generator_urls.guess(att.row_html)
+            if fast_url:
+                accept = self._notification_gate(state, att.name, skip_notifications)
+                futures[engine.submit(state.http, fast_url, att.path, accept=accept, require_pdf=True)] = (att, True, time.perf_counter())
+                logger.log("  - En cola sin popup (motor paralelo): '%s'", att.name)
+            else:
+                needs_popup.append(att)
+
+        # Los popups se abren por tandas del tamaño del semáforo; el navegador los carga en paralelo
+        for start in range(0, len(needs_popup), engine.max_parallel):
+            popups = []
+            for att in needs_popup[start:start + engine.max_parallel]:
+                try:
+                    att.button.scroll_into_view_if_needed()
+                    with context.expect_page(timeout=60000) as new_p_info:
+                        att.button.click(force=True, timeout=30000)
+                    popups.append((att, new_p_info.value))
+                except Exception as e:
+                    logger.log("  - No se abrió el popup de '%s': %s", att.name, e)
+                    fallback.append(att)
+
+            for att, new_p in popups:
+                try:
+                    with self._span("popup"):
+                        t_url = self._popup_generator_url(new_p)
+                    state.generator_urls.learn(att.row_html, t_url)
+                    accept = self._notification_gate(state, att.name, skip_notifications)
+                    futures[engine.submit(state.http, t_url, att.path, accept=accept)] = (att, False, time.perf_counter())
+                    logger.log("  - En cola (motor paralelo): '%s'", att.name)
+                except Exception as e:
+                    logger.log("  - Sin URL de generador para '%s': %s", att.name, e)
+                    fallback.append(att)
+                finally:
+                    try: new_p.close()
+                    except: pass
+
+        # Recogemos los PDF a medida que el generador los va entregando
+        for fut in concurrent.futures.as_completed(futures):
+            att, guessed, submitted = futures[fut]
+            try:
+                size, digest, kept = fut.result()
+                # Con descargas simultáneas la latencia por archivo se mide desde que entró en cola
+                state.metrics.file_done(os.path.basename(att.path), time.perf_counter() - submitted, size, "kept" if kept else "filtered")
+                logger.log("  - Descarga completada (paralela). Tamaño: %s bytes", size)
+                outcomes[att.name] = self._register_download(state, att.path, att.name, act_date, kept, digest, size)
+            except Exception as e:
+                logger.log("  - Falló la descarga paralela de '%s': %s", att.name, e)
+                self.pacing.observe_error(e)
+                if guessed:
+                    state.generator_urls.reject()
+                    try: os.remove(att.path)
+                    except OSError: pass
+                fallback.append(att)
+
+        # Lo que el motor paralelo no pudo resolver pasa por el flujo secuencial con reintentos
+        for att in sorted(fallback, key=lambda a: a.index):
+            outcomes[att.name] = self._download_attachment(context, state, att, act_date, skip_notifications)
+        return outcomes
+
+# SERVICIO DE DESCARGA (COLA PERSISTENTE)
+class JobQueue:
+    """Cola persistente de expedientes por descargar (SQLite, .cola.sqlite3 en la carpeta base).
+
+    Un radicado solo puede estar una vez pendiente o en curso: volver a encolarlo reutiliza el trabajo
+    (y sube su prioridad si la nueva es mayor). Los trabajos en curso tienen un plazo que el servicio
+    renueva mientras trabaja; si el proceso muere, el plazo vence y el trabajo se vuelve a tomar.
+    Los fallos se reintentan con espera exponencial hasta `max_attempts` intentos.
+    """
+    LEASE = 300         # segundos de plazo de un trabajo en curso sin renovar
+    BACKOFF_BASE = 60   # espera tras el primer fallo (se duplica en cada intento)
+    BACKOFF_MAX = 3600
+    ACTIVE = ("pendiente", "en_curso")
+    _RADICADO_RE = re.compile(r"\d{23}")
+    _COLUMNS = ("id", "radicado", "priority", "skip_notifications", "state", "attempts", "max_attempts",
+                "not_before", "lease_until", "worker", "last_error", "created_at", "updated_at")
+
+    def __init__(self, db_path, max_attempts=4):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, radicado TEXT NOT NULL, priority INTEGER NOT NULL,
+            skip_notifications INTEGER NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL,
+            max_attempts INTEGER NOT NULL, not_before REAL NOT NULL, lease_until REAL, worker TEXT,
+            last_error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)""")
+        # Deduplicación: como mucho un trabajo activo por radicado, también entre procesos
+        self._db.execute("""CREATE UNIQUE INDEX IF NOT EXISTS jobs_active ON jobs (radicado)
+            WHERE state IN ('pendiente', 'en_curso')""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, priority, not_before)")
+        self._db.commit()
+
+    def _row(self, row):
+        if row is None: return None
+        job = dict(zip(self._COLUMNS, row))
+        job["skip_notifications"] = bool(job["skip_notifications"])
+        return job
+
+    def submit(self, radicado, priority=0, skip_notifications=True):
+        """Encola un radicado. Devuelve (id, nuevo); si ya estaba pendiente o en curso se reutiliza su trabajo."""
+        radicado = (radicado or "").strip()
+        if not self._RADICADO_RE.fullmatch(radicado):
+            raise ValueError(f"Radicado inválido (se esperan 23 dígitos): {radicado!r}")
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute("SELECT id, priority FROM jobs WHERE radicado = ? AND state IN (?, ?)",
+                                   (radicado,) + self.ACTIVE).fetchone()
+            if row:
+                if priority > row[1]:
+                    self._db.execute("UPDATE jobs SET priority = ?, updated_at = ? WHERE id = ?", (priority, now, row[0]))
+                return row[0], False
+            try:
+                cur = self._db.execute(
+                    "INSERT INTO jobs (radicado, priority, skip_notifications, state, attempts, max_attempts, "
+                    "not_before, created_at, updated_at) VALUES (?, ?, ?, 'pendiente', 0, ?, ?, ?, ?)",
+                    (radicado, priority, int(skip_notifications), self.max_attempts, now, now, now))
+            except sqlite3.IntegrityError:
+                # Otro proceso lo encoló entre la consulta y la inserción
+                row = self._db.execute("SELECT id FROM jobs WHERE radicado = ? AND state IN (?, ?)",
+                                       (radicado,) + self.ACTIVE).fetchone()
+                return row[0], False
+            return cur.lastrowid, True
+
+    def claim(self, worker):
+        """Toma el siguiente trabajo listo (mayor prioridad, luego el más antiguo) o None si no hay."""
+        now = time.time()
+        with self._lock, self._db:
+            # Trabajos de un servicio caído: se retoman, salvo que ya hayan agotado sus intentos
+            self._db.execute("UPDATE jobs SET state = 'fallido', last_error = 'Plazo vencido en el último intento', "
+                             "updated_at = ? WHERE state = 'en_curso' AND lease_until < ? AND attempts >= max_attempts",
+                             (now, now))
+            while True:
+                row = self._db.execute(
+                    "SELECT id FROM jobs WHERE (state = 'pendiente' AND not_before <= ?) OR (state = 'en_curso' AND lease_until < ?) "
+                    "ORDER BY priority DESC, id LIMIT 1", (now, now)).fetchone()
+                if row is None:
+                    return None
+                cur = self._db.execute(
+                    "UPDATE jobs SET state = 'en_curso', attempts = attempts + 1, worker = ?, lease_until = ?, updated_at = ? "
+                    "WHERE id = ? AND (state = 'pendiente' OR lease_until < ?)", (worker, now + self.LEASE, now, row[0], now))
+                if cur.rowcount == 1:
+                    return self._row(self._db.execute("SELECT * FROM jobs WHERE id = ?", (row[0],)).fetchone())
+
+    def heartbeat(self, worker):
+        """Renueva el plazo de los trabajos en curso de `worker`."""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("UPDATE jobs SET lease_until = ? WHERE state = 'en_curso' AND worker = ?", (now + self.LEASE, worker))
+
+    def finish(self, job_id, ok, error=None, permanent=False):
+        """Cierra un intento. Devuelve el nuevo estado: completo, pendiente (se reintentará) o fallido.
+
+        Con `permanent` el fallo no se reintenta (p. ej. el radicado no existe en el portal).
+        """
+        now = time.time()
+        with self._lock, self._db:
+            attempts, max_attempts = self._db.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if ok:
+                state, not_before = "completo", now
+            elif attempts < max_attempts and not permanent:
+                state = "pendiente"
+                delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** (attempts - 1))
+                not_before = now + delay * random.uniform(0.8, 1.2)
+            else:
+                state, not_before = "fallido", now
+            self._db.execute("UPDATE jobs SET state = ?, not_before = ?, lease_until = NULL, last_error = ?, updated_at = ? "
+                             "WHERE id = ?", (state, not_before, error, now, job_id))
+        return state
+
+    def release(self, worker):
+        """Devuelve a la cola, sin contar el intento, los trabajos en curso de `worker` (parada ordenada)."""
+        with self._lock, self._db:
+            self._db.execute("UPDATE jobs SET state = 'pendiente', attempts = MAX(attempts - 1, 0), lease_until = NULL, "
+                             "updated_at = ? WHERE state = 'en_curso' AND worker = ?", (time.time(), worker))
+
+    def get(self, job_id):
+        with self._lock:
+            return self._row(self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def list(self, state=None, limit=100):
+        query, params = "SELECT * FROM jobs", ()
+        if state:
+            query, params = query + " WHERE state = ?", (state,)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY id DESC LIMIT ?", params + (limit,)).fetchall()
+        return [self._row(r) for r in rows]
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class _JobApiHandler(http.server.BaseHTTPRequestHandler):
+    """API HTTP local del servicio: POST /trabajos, GET /trabajos[?estado=], GET /trabajos/<id>, GET /estado."""
+    daemon = None
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(parts.query))
+        path = parts.path.rstrip("/")
+        jobs = self.daemon.jobs
+        if path == "/estado":
+            return self._reply(200, {"trabajos": jobs.counts(), "servicio": self.daemon.worker_id})
+        if path == "/trabajos":
+            try:
+                limit = int(query.get("limite", 100))
+            except ValueError:
+                return self._reply(400, {"error": "limite debe ser un número"})
+            return self._reply(200, {"trabajos": jobs.list(query.get("estado"), limit)})
+        if path.startswith("/trabajos/") and path.rsplit("/", 1)[1].isdigit():
+            job = jobs.get(int(path.rsplit("/", 1)[1]))
+            return self._reply(200, job) if job else self._reply(404, {"error": "trabajo no encontrado"})
+        self._reply(404, {"error": "ruta desconocida"})
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path.rstrip("/") != "/trabajos":
+            return self._reply(404, {"error": "ruta desconocida"})
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            radicados = data.get("radicados") or [data.get("radicado")]
+            if not isinstance(radicados, list) or not all(isinstance(r, str) for r in radicados):
+                raise TypeError("radicados debe ser una lista de textos")
+            priority = int(data.get("prioridad", 0))
+            skip = not data.get("incluir_notificaciones", False)
+            # Se valida la lista entera antes de encolar: una petición rechazada no deja trabajos a medias
+            invalid = _invalid_radicados([r.strip() for r in radicados])
+            if invalid:
+                return self._reply(400, {"error": "Radicados inválidos (se esperan 23 dígitos); no se encoló ninguno",
+                                         "invalidos": invalid})
+            created = []
+            for radicado in radicados:
+                job_id, new = self.daemon.jobs.submit(radicado, priority, skip)
+                created.append({"id": job_id, "radicado": radicado, "nuevo": new})
+        except (ValueError, TypeError, AttributeError) as e:
+            return self._reply(400, {"error": str(e)})
+        self.daemon.wake()
+        self._reply(202, {"trabajos": created})
+
+class DownloadDaemon:
+    """Servicio de larga duración: un navegador compartido ya abierto y `concurrency` hilos que toman
+    expedientes de la cola persistente. Los trabajos se encolan por la API HTTP local o con `encolar`.
+    """
+    HEARTBEAT = 60 # segundos entre renovaciones del plazo de los trabajos en curso
+
+    def __init__(self, downloader, jobs, concurrency=2, port=8765, poll_interval=5.0):
+        self.downloader = downloader
+        self.jobs = jobs
+        self.concurrency = max(1, int(concurrency))
+        self.port = port
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._wake = threading.Condition()
+        self._browser_lost = threading.Event()
+        self._browser_generation = 0
+
+    def wake(self):
+        with self._wake:
+            self._wake.notify_all()
+
+    def _idle(self):
+        with self._wake:
+            self._wake.wait(self.poll_interval)
+
+    def _start_api(self):
+        handler = type("JobApiHandler", (_JobApiHandler,), {"daemon": self})
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", self.port), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="tyba-api", daemon=True).start()
+        return server
+
+    def _announce(self, server):
+        d = self.downloader
+        print(f"{d.C_CYAN}{d.C_BOLD}>>> Servicio de descarga iniciado ({self.concurrency} en paralelo){d.C_END}")
+        if server:
+            print(f"  API local: http://127.0.0.1:{server.server_address[1]}/trabajos")
+        print(f"  Cola: {self.jobs.db_path} {self.jobs.counts()}")
+        logger.log("Servicio iniciado: %s, concurrencia %s.", self.worker_id, self.concurrency, level=logging.INFO)
+
+    def run(self):
+        d = self.downloader
+        server = self._start_api() if self.port else None
+        self._announce(server)
+
+        with BrowserPool(self.downloader) as pool:
+            threads = [threading.Thread(target=self._worker, args=(pool,), name=f"tyba-servicio-{n}")
+                       for n in range(self.concurrency)]
+            for t in threads: t.start()
+            try:
+                last_beat = time.monotonic()
+                while not self._stop.is_set():
+                    # Pausas cortas: en Windows Ctrl+C no interrumpe una espera larga
+                    time.sleep(1)
+                    if time.monotonic() - last_beat >= self.HEARTBEAT:
+                        self.jobs.heartbeat(self.worker_id)
+                        last_beat = time.monotonic()
+                    if self._browser_lost.is_set():
+                        # El navegador compartido murió: la API síncrona obliga a relanzarlo en este hilo
+                        print(f"{d.C_YELLOW}! Navegador caído, se relanza.{d.C_END}")
+                        logger.log("Navegador compartido caído; se relanza.", level=logging.WARNING)
+                        pool.close()
+                        pool.start()
+                        self._browser_generation += 1
+                        self._browser_lost.clear()
+            except KeyboardInterrupt:
+                print(f"\n{d.C_YELLOW}Deteniendo: se terminan los expedientes en curso (Ctrl+C otra vez para salir ya)...{d.C_END}")
+            finally:
+                self._stop.set()
+                self.wake()
+                for t in threads: t.join()
+                if server: server.shutdown()
+                self.jobs.release(self.worker_id)
+                logger.log("Servicio detenido.", level=logging.INFO)
+
+    def _connect(self, pool):
+        """Conexión del hilo al navegador compartido; espera mientras se relanza. None si el servicio se detiene."""
+        while not self._stop.is_set():
+            if not self._browser_lost.is_set():
+                try:
+                    return pool.connect() + (self._browser_generation,)
+                except Exception as e:
+                    logger.log("No se pudo conectar al navegador compartido: %s", e, level=logging.WARNING)
+            time.sleep(2)
+        return None
+
+    def _worker(self, pool):
+        conn = self._connect(pool)
+        try:
+            while conn and not self._stop.is_set():
+                pw, browser, generation = conn
+                if generation != self._browser_generation or not browser.is_connected():
+                    # Conexión perdida: se pide el relanzamiento (si nadie lo pidió ya) y se reconecta
+                    pool.disconnect(pw, browser)
+                    if generation == self._browser_generation:
+                        self._browser_lost.set()
+                    conn = self._connect(pool)
+                    continue
+                job = self.jobs.claim(self.worker_id)
+                if job is None:
+                    self._idle()
+                    continue
+                self._run_job(job, browser)
+        finally:
+            if conn: pool.disconnect(*conn[:2])
+
+    def _run_job(self, job, browser):
+        d = self.downloader
+        print(f"\n{d.C_CYAN}Trabajo #{job['id']}: {job['radicado']} (intento {job['attempts']}/{job['max_attempts']}){d.C_END}")
+        try:
+            state = self.downloader.download_case(job["radicado"], job["skip_notifications"], browser=browser)
+            ok, permanent = state.completed, state.permanent_error
+            error = "; ".join(state.errors[:3]) or (None if ok else "El expediente no se completó (ver registro.jsonl)")
+        except Exception as e:
+            ok, error, permanent = False, str(e), RetryPolicy.classify(e) == RetryPolicy.PERMANENT
+            logger.log("Error no controlado en el trabajo #%s: %s", job['id'], traceback.format_exc(), level=logging.ERROR)
+        outcome = self.jobs.finish(job["id"], ok, error, permanent)
+        color = d.C_GREEN if outcome == "completo" else d.C_YELLOW if outcome == "pendiente" else d.C_RED
+        print(f"{color}Trabajo #{job['id']} ({job['radicado']}): {outcome}{d.C_END}")
+        logger.log("Trabajo #%s (%s) -> %s", job['id'], job['radicado'], outcome, level=logging.INFO if ok else logging.WARNING)
+
+# VIGILANCIA DE EXPEDIENTES
+class Watchlist:
+    """Lista de radicados vigilados (SQLite, .vigilancia.sqlite3 en la carpeta base).
+
+    Guarda por radicado la huella de las filas más recientes de grdActuaciones y cuándo toca la siguiente
+    revisión. Un radicado recién dado de alta se revisa en la siguiente pasada (así `vigilar --una-vez` toma
+    su huella inicial) y cada revisión programa la siguiente a `interval` segundos (por defecto un día) con
+    ±25 % de variación, de modo que las consultas se reparten a lo largo del intervalo. Expone la misma interfaz que JobQueue (claim, heartbeat, release,
+    counts) para que el monitor reutilice la maquinaria de DownloadDaemon.
+    """
+    LEASE = 1800        # segundos de plazo de una revisión en curso sin renovar
+    JITTER = 0.25
+    RETRY_BASE = 600    # espera tras la primera revisión fallida (se duplica en cada fallo seguido)
+    _RADICADO_RE = re.compile(r"\d{23}")
+    _COLUMNS = ("radicado", "skip_notifications", "fingerprints", "next_check", "lease_until", "worker",
+                "checks", "changes", "failures", "last_error", "last_check", "last_change", "added_at")
+
+    def __init__(self, db_path, interval=24 * 3600):
+        self.db_path = db_path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS watch (
+            radicado TEXT PRIMARY KEY, skip_notifications INTEGER NOT NULL, fingerprints TEXT,
+            next_check REAL NOT NULL, lease_until REAL, worker TEXT, checks INTEGER NOT NULL DEFAULT 0,
+            changes INTEGER NOT NULL DEFAULT 0, failures INTEGER NOT NULL DEFAULT 0, last_error TEXT,
+            last_check REAL, last_change REAL, added_at REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS watch_due ON watch (next_check)")
+        self._db.commit()
+
+    def _row(self, row):
+        if row is None: return None
+        item = dict(zip(self._COLUMNS, row))
+        item["skip_notifications"] = bool(item["skip_notifications"])
+        item["fingerprints"] = json.loads(item["fingerprints"]) if item["fingerprints"] else None
+        return item
+
+    def add(self, radicado, skip_notifications=True):
+        """Da de alta un radicado. Devuelve False si ya estaba vigilado."""
+        radicado = (radicado or "").strip()
+        if not self._RADICADO_RE.fullmatch(radicado):
+            raise ValueError(f"Radicado inválido (se esperan 23 dígitos): {radicado!r}")
+        now = time.time()
+        with self._lock, self._db:
+            cur = self._db.execute("INSERT OR IGNORE INTO watch (radicado, skip_notifications, next_check, added_at) "
+                                   "VALUES (?, ?, ?, ?)", (radicado, int(skip_notifications), now, now))
+            return cur.rowcount == 1
+
+    def remove(self, radicado):
+        with self._lock, self._db:
+            return self._db.execute("DELETE FROM watch WHERE radicado = ?", (radicado.strip(),)).rowcount == 1
+
+    def claim(self, worker):
+        """Toma el radicado cuya revisión está más atrasada, o None si ninguno toca todavía."""
+        now = time.time()
+        with self._lock, self._db:
+            while True:
+                row = self._db.execute("SELECT radicado FROM watch WHERE next_check <= ? AND (lease_until IS NULL OR lease_until < ?) "
+                                       "ORDER BY next_check LIMIT 1", (now, now)).fetchone()
+                if row is None:
+                    return None
+                cur = self._db.execute("UPDATE watch SET lease_until = ?, worker = ? WHERE radicado = ? "
+                                       "AND (lease_until IS NULL OR lease_until < ?)", (now + self.LEASE, worker, row[0], now))
+                if cur.rowcount == 1:
+                    return self._row(self._db.execute("SELECT * FROM watch WHERE radicado = ?", (row[0],)).fetchone())
+
+    def record(self, radicado, fingerprints=None, changed=False, error=None):
+        """Cierra una revisión y programa la siguiente. Sin `fingerprints` se conserva la huella anterior
+        (revisión fallida, o cambio cuya descarga no terminó: se volverá a detectar)."""
+        now = time.time()
+        with self._lock, self._db:
+            failures = self._db.execute("SELECT failures FROM watch WHERE radicado = ?", (radicado,)).fetchone()
+            if failures is None:
+                return # Se quitó de la lista mientras se revisaba
+            if error is None:
+                failures, delay = 0, self.interval * random.uniform(1 - self.JITTER, 1 + self.JITTER)
+            else:
+                failures = failures[0] + 1
+                delay = min(self.interval, self.RETRY_BASE * 2 ** (failures - 1)) * random.uniform(0.8, 1.2)
+            self._db.execute(
+                "UPDATE watch SET fingerprints = COALESCE(?, fingerprints), next_check = ?, lease_until = NULL, worker = NULL, "
+                "checks = checks + 1, changes = changes + ?, failures = ?, last_error = ?, last_check = ?, "
+                "last_change = CASE WHEN ? THEN ? ELSE last_change END WHERE radicado = ?",
+                (json.dumps(fingerprints) if fingerprints is not None else None, now + delay, int(changed), failures,
+                 error, now, int(changed), now, radicado))
+
+    def heartbeat(self, worker):
+        with self._lock, self._db:
+            self._db.execute("UPDATE watch SET lease_until = ? WHERE worker = ?", (time.time() + self.LEASE, worker))
+
+    def release(self, worker):
+        """Libera, sin contarlas, las revisiones en curso de `worker` (parada ordenada)."""
+        with self._lock, self._db:
+            self._db.execute("UPDATE watch SET lease_until = NULL, worker = NULL WHERE worker = ?", (worker,))
+
+    def list(self, limit=100):
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM watch ORDER BY next_check LIMIT ?", (limit,)).fetchall()
+        return [self._row(r) for r in rows]
+
+    def counts(self):
+        now = time.time()
+        with self._lock:
+            total, due, failing = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(next_check <= ?), 0), COALESCE(SUM(failures > 0), 0) FROM watch", (now,)).fetchone()
+        return {"vigilados": total, "pendientes": due, "con_fallos": failing}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class RateLimiter:
+    """Límite global de consultas al portal: `per_hour` por hora de media, con separación al azar entre ellas."""
+    def __init__(self, per_hour):
+        self.interval = 3600.0 / per_hour if per_hour else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self, stop=None):
+        """Espera el turno del llamante. Devuelve False si `stop` se activó mientras esperaba."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval * random.uniform(0.5, 1.5)
+        delay = slot - now
+        if delay > 0:
+            if stop is None:
+                time.sleep(delay)
+            elif stop.wait(delay):
+                return False
+        return True
+
+class ChangeFeed:
+    """Registro de cambios en JSON Lines (un evento por línea, solo se agrega al final)."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, event, radicado, **fields):
+        record = {"fecha": time.strftime('%Y-%m-%dT%H:%M:%S%z'), "evento": event, "radicado": radicado}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        return record
+
+class WatchMonitor(DownloadDaemon):
+    """Vigila radicados: revisa solo la primera página de actuaciones y descarga los expedientes que cambiaron.
+
+    Cada revisión resuelve la búsqueda (o reutiliza la sesión guardada), lee las `rows` filas más recientes
+    de grdActuaciones y las compara con la huella guardada. Si aparecen filas nuevas se anota el cambio en
+    el registro JSONL y, salvo `download=False`, se descarga el expediente (el manifiesto hace que solo se
+    abran las actuaciones nuevas). Las revisiones de todos los hilos respetan un único RateLimiter.
+    """
+    def __init__(self, downloader, watchlist, feed, concurrency=1, per_hour=60, download=True, once=False, rows=10):
+        super().__init__(downloader, watchlist, concurrency=concurrency, port=0, poll_interval=30.0)
+        self.feed = feed
+        self.limiter = RateLimiter(per_hour)
+        self.download = download
+        self.once = once
+        self.rows = rows
+        self._busy = 0 # revisiones en curso (para saber cuándo termina --una-vez)
+        self._busy_lock = threading.Lock()
+
+    def _announce(self, server):
+        d = self.downloader
+        print(f"{d.C_CYAN}{d.C_BOLD}>>> Vigilancia iniciada ({self.concurrency} en paralelo){d.C_END}")
+        print(f"  Lista: {self.jobs.db_path} {self.jobs.counts()}")
+        print(f"  Cambios: {self.feed.path}")
+        logger.log("Vigilancia iniciada: %s, concurrencia %s.", self.worker_id, self.concurrency, level=logging.INFO)
+
+    def _idle(self):
+        if self.once:
+            # Con --una-vez se termina cuando no queda ninguna revisión pendiente ni en curso
+            with self._busy_lock:
+                if self._busy == 0:
+                    self._stop.set()
+                    return
+            time.sleep(1)
+            return
+        super()._idle()
+
+    def _run_job(self, item, browser):
+        with self._busy_lock:
+            self._busy += 1
+        try:
+            self._check(item, browser)
+        finally:
+            with self._busy_lock:
+                self._busy -= 1
+
+    def _check(self, item, browser):
+        d = self.downloader
+        radicado = item["radicado"]
+        if not self.limiter.wait(self._stop):
+            return # Parada: run() libera la revisión
+        try:
+            rows = d.peek_actuaciones(browser, radicado, self.rows)
+        except Exception as e:
+            self.jobs.record(radicado, error=str(e))
+            print(f"{d.C_RED}✗ {radicado}: no se pudo revisar ({e}){d.C_END}")
+            logger.log("Vigilancia: revisión fallida de %s: %s", radicado, traceback.format_exc(), level=logging.WARNING)
+            return
+
+        fingerprints = [CaseManifest.fingerprint(r.cells) for r in rows]
+        summary = lambda r: {"fecha": r.date, "descripcion": r.description}
+        if item["fingerprints"] is None:
+            self.feed.emit("alta", radicado, actuaciones=[summary(r) for r in rows[:1]])
+            self.jobs.record(radicado, fingerprints)
+            print(f"{d.C_CYAN}○ {radicado}: huella inicial guardada ({len(rows)} actuaciones recientes).{d.C_END}")
+            return
+        known = set(item["fingerprints"])
+        new_rows = [r for r, fp in zip(rows, fingerprints) if fp not in known]
+        if not new_rows:
+            self.jobs.record(radicado, fingerprints)
+            print(f"  {radicado}: sin cambios.")
+            logger.log("Vigilancia: %s sin cambios.", radicado)
+            return
+
+        print(f"{d.C_GREEN}{d.C_BOLD}★ {radicado}: {len(new_rows)} actuaciones nuevas.{d.C_END}")
+        download = None
+        if self.download:
+            try:
+                state = d.download_case(radicado, item["skip_notifications"], browser=browser)
+                counters = state.metrics.report(state)["contadores"] if state.metrics else {}
+                download = {"completa": state.completed, "documentos_nuevos": counters.get("descargados", 0),
+                            "errores": len(state.errors)}
+            except Exception as e:
+                download = {"completa": False, "error": str(e)}
+                logger.log("Vigilancia: error descargando %s: %s", radicado, traceback.format_exc(), level=logging.ERROR)
+        self.feed.emit("nuevas_actuaciones", radicado, actuaciones=[summary(r) for r in new_rows], descarga=download)
+        # Si la descarga no terminó se conserva la huella anterior: la próxima revisión volverá a detectar el cambio
+        done = download is None or download["completa"]
+        self.jobs.record(radicado, fingerprints if done else None, changed=True,
+                         error=None if done else download.get("error", "Descarga incompleta"))
+
+# RECLASIFICACIÓN FUERA DE LÍNEA
+_WORKER = {} # Estado de cada proceso del pool: reglas compiladas y caché de decisiones
+
+def _reclassify_init(db_path):
+    """Inicializador del pool: las reglas se compilan una vez por proceso, no en cada archivo."""
+    _WORKER["rules"] = NotificationRules()
+    _WORKER["cache"] = None
+    if db_path and os.path.exists(db_path):
+        try: _WORKER["cache"] = FilterDecisionCache(db_path)
+        except Exception: pass
+
+def _reclassify_file(path, name=None, digest=None):
+    """Clasifica un PDF ya descargado. Devuelve (ruta, es_notificación, motivo).
+
+    Sin `name` se juzga por el nombre del archivo, que es el nombre saneado con que se descargó.
+    """
+    trace = []
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    try:
+        is_notif = classify_notification(path, name, _WORKER.get("rules"), _WORKER.get("cache"), digest,
+                                         log=lambda msg, *args: trace.append(msg % args))
+    except Exception as e:
+        return path, False, f"Error: {e}"
+    return path, is_notif, trace[-1].replace("[Filtro]", "").strip() if trace else ""
+
+def _iter_case_dirs(base_dir):
+    for entry in sorted(os.scandir(base_dir), key=lambda e: e.name):
+        if entry.is_dir() and not entry.name.startswith("."):
+            yield entry.path
+
+def _prune_doc_list(case_dir, removed_names):
+    """Quita de lista.txt las líneas de los documentos retirados, conservando el resto del formato."""
+    list_path = os.path.join(case_dir, "lista.txt")
+    try:
+        with open(list_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return
+    kept = [l for l in lines if not (" | " in l and l.split(" | ", 1)[1].rstrip("\n") in removed_names)]
+    if len(kept) != len(lines):
+        _atomic_write(list_path, "".join(kept).encode("utf-8"))
+
+def _prune_doc_index(case_dir, removed_names):
+    """Marca como filtrados en indice.json / indice.csv los documentos retirados."""
+    try:
+        with open(os.path.join(case_dir, "indice.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        registry = DocumentRegistry.load(case_dir)
+        if registry is not None:
+            registry.damaged = {d["nombre"]: d["motivo"] for d in meta.get("danados", [])}
+        if registry is not None and registry.mark_filtered(removed_names):
+            registry.export(meta.get("radicado", os.path.basename(case_dir)), meta.get("fecha_auto_admite", "Sin fecha"),
+                            meta.get("errores", []))
+    except (OSError, ValueError) as e:
+        print(f"  No se pudo actualizar el índice de {case_dir}: {e}")
+
+def reclassify_expedientes(base_dir, action="simular", workers=None):
+    """Vuelve a aplicar el filtro de notificaciones a todos los PDF ya descargados bajo `base_dir`.
+
+    `action`: "simular" (solo informa), "cuarentena" (mueve a .cuarentena) o "eliminar".
+    """
+    C_CYAN, C_YELLOW, C_GREEN, C_BOLD, C_END = "\033[96m", "\033[93m", "\033[92m", "\033[1m", "\033[0m"
+    base_dir = os.path.abspath(base_dir)
+    files = []
+    for case_dir in _iter_case_dirs(base_dir):
+        files += [os.path.join(case_dir, n) for n in sorted(os.listdir(case_dir)) if n.lower().endswith(".pdf")]
+    print(f"{C_CYAN}{C_BOLD}>>> Reclasificando {len(files)} PDF en {base_dir} (acción: {action}){C_END}")
+    if not files:
+        return {}
+
+    db_path = os.path.join(base_dir, ".filtro_cache.sqlite3")
+    removed = {} # carpeta del caso -> [nombres]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_reclassify_init, initargs=(db_path,)) as pool:
+        for done, (path, is_notif, reason) in enumerate(pool.map(_reclassify_file, files, chunksize=16), 1):
+            print(f"  > {done}/{len(files)} analizados...", end="\r")
+            if not is_notif: continue
+            case_dir, file_name = os.path.split(path)
+            removed.setdefault(case_dir, []).append(os.path.splitext(file_name)[0])
+            print(f"\r  {C_YELLOW}○ {os.path.basename(case_dir)}/{file_name}{C_END}  {reason}")
+
+    total = sum(len(v) for v in removed.values())
+    for case_dir, names in removed.items():
+        if action == "simular": continue
+        for name in names:
+            path = os.path.join(case_dir, f"{name}.pdf")
+            try:
+                if action == "cuarentena":
+                    target_dir = os.path.join(base_dir, ".cuarentena", os.path.basename(case_dir))
+                    os.makedirs(target_dir, exist_ok=True)
+                    shutil.move(path, os.path.join(target_dir, f"{name}.pdf"))
+                else:
+                    os.remove(path)
+            except OSError as e:
+                print(f"  No se pudo retirar {path}: {e}")
+        _prune_doc_list(case_dir, set(names))
+        CaseManifest(case_dir).mark_filtered(names)
+        _prune_doc_index(case_dir, set(names))
+
+    verb = {"simular": "se retirarían", "cuarentena": "movidos a cuarentena", "eliminar": "eliminados"}[action]
+    print(f"\n{C_GREEN}{C_BOLD}✓ {total} de {len(files)} documentos {verb} en {len(removed)} expedientes.{C_END}")
+    return removed
+
+# BÚSQUEDA DE TEXTO COMPLETO
+def _extract_pdf_text(path):
+    """Extrae el texto de todas las páginas de un PDF (en un proceso del pool). Devuelve (ruta, texto, error)."""
+    try:
+        reader = PdfReader(path)
+        return path, "\n".join(page.extract_text() or "" for page in reader.pages), None
+    except Exception as e:
+        return path, "", str(e)
+
+class TextIndex:
+    """Índice de texto completo (SQLite FTS5) de los PDF conservados en todos los expedientes.
+
+    Guarda, por archivo, radicado, nombre, fecha de la actuación, tamaño y fecha de modificación: al
+    actualizar solo se vuelven a extraer los PDF nuevos o cambiados, y se quitan los que ya no existen.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS archivos (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE, radicado TEXT, name TEXT, date TEXT,
+                size INTEGER, mtime_ns INTEGER, pages_text INTEGER, error TEXT, indexed_at REAL)""")
+            # remove_diacritics: "notificacion" encuentra "notificación"
+            self._db.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS texto USING fts5(
+                name, body, tokenize = 'unicode61 remove_diacritics 2')""")
+
+    @staticmethod
+    def _case_documents(case_dir):
+        """PDF conservados del expediente -> fecha de la actuación (según indice.json, o lista.txt si no hay índice)."""
+        pdfs = {os.path.splitext(n)[0] for n in os.listdir(case_dir) if n.lower().endswith(".pdf")}
+        registry = DocumentRegistry.load(case_dir)
+        if registry is not None:
+            dates = {r.name: r.date for r in registry.kept()}
+        else:
+            dates = {}
+            try:
+                with open(os.path.join(case_dir, "lista.txt"), "r", encoding="utf-8") as f:
+                    for line in f:
+                        if " | " in line:
+                            date, name = line.rstrip("\n").split(" | ", 1)
+                            dates.setdefault(name, date.strip())
+            except OSError:
+                pass
+        return {name: dates.get(name, "N/A") for name in pdfs}
+
+    def update(self, base_dir, workers=None, progress=None):
+        """Indexa los PDF nuevos o modificados bajo `base_dir`. Devuelve (indexados, sin_cambios, retirados, errores)."""
+        known = {path: (doc_id, size, mtime_ns) for doc_id, path, size, mtime_ns
+                 in self._db.execute("SELECT id, path, size, mtime_ns FROM archivos")}
+        pending = {} # ruta -> (radicado, nombre, fecha, tamaño, mtime_ns)
+        seen = set()
+        for case_dir in _iter_case_dirs(base_dir):
+            radicado = os.path.basename(case_dir)
+            for name, date in self._case_documents(case_dir).items():
+                path = os.path.join(case_dir, f"{name}.pdf")
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                old = known.get(path)
+                if old is not None and old[1] == st.st_size and old[2] == st.st_mtime_ns:
+                    # Sin cambios en el archivo; la fecha puede haberse corregido en el índice del caso
+                    self._db.execute("UPDATE archivos SET date = ? WHERE id = ? AND date != ?", (date, old[0], date))
+                    continue
+                pending[path] = (radicado, name, date, st.st_size, st.st_mtime_ns)
+
+        removed = [known[p][0] for p in known if p not in seen]
+        with self._db:
+            for doc_id in removed:
+                self._db.execute("DELETE FROM archivos WHERE id = ?", (doc_id,))
+                self._db.execute("DELETE FROM texto WHERE rowid = ?", (doc_id,))
+
+        indexed = errors = 0
+        if pending:
+            # La extracción de texto (pypdf) es CPU: se reparte entre procesos; la escritura queda en este
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                for done, (path, text, error) in enumerate(pool.map(_extract_pdf_text, list(pending), chunksize=4), 1):
+                    radicado, name, date, size, mtime_ns = pending[path]
+                    old = known.get(path)
+                    if old is not None:
+                        self._db.execute("DELETE FROM texto WHERE rowid = ?", (old[0],))
+                    cur = self._db.execute(
+                        "INSERT INTO archivos (path, radicado, name, date, size, mtime_ns, pages_text, error, indexed_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET radicado = excluded.radicado, "
+                        "name = excluded.name, date = excluded.date, size = excluded.size, mtime_ns = excluded.mtime_ns, "
+                        "pages_text = excluded.pages_text, error = excluded.error, indexed_at = excluded.indexed_at",
+                        (path, radicado, name, date, size, mtime_ns, int(bool(text.strip())), error, time.time()))
+                    doc_id = old[0] if old is not None else cur.lastrowid
+                    self._db.execute("INSERT INTO texto (rowid, name, body) VALUES (?, ?, ?)", (doc_id, name, text))
+                    if error: errors += 1
+                    else: indexed += 1
+                    if done % 50 == 0:
+                        self._db.commit()
+                    if progress: progress(done, len(pending))
+        self._db.commit()
+        return indexed, len(seen) - len(pending), len(removed), errors
+
+    def search(self, query, limit=20, radicado=None):
+        """Documentos que coinciden con `query` (sintaxis FTS5), ordenados por relevancia (bm25), con un fragmento."""
+        sql = ("SELECT a.radicado, a.name, a.date, snippet(texto, 1, '[', ']', ' … ', 16), bm25(texto, 4.0, 1.0) AS rank "
+               "FROM texto JOIN archivos a ON a.id = texto.rowid WHERE texto MATCH ?")
+        params = [query]
+        if radicado:
+            sql += " AND a.radicado = ?"
+            params.append(radicado)
+        sql += " ORDER BY rank LIMIT ?"
+        try:
+            rows = self._db.execute(sql, params + [limit]).fetchall()
+        except sqlite3.OperationalError:
+            # Texto libre con signos que FTS5 no acepta (un NIT con guion, puntos...): se busca como frase
+            params[0] = '"' + query.replace('"', '""') + '"'
+            rows = self._db.execute(sql, params + [limit]).fetchall()
+        return [{"radicado": r[0], "nombre": r[1], "fecha": r[2], "fragmento": " ".join(r[3].split()),
+                 "puntaje": round(-r[4], 3)} for r in rows]
+
+    def counts(self):
+        docs, cases, empty = self._db.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT radicado), COUNT(*) - COALESCE(SUM(pages_text), 0) FROM archivos").fetchone()
+        return {"documentos": docs, "expedientes": cases, "sin_texto": empty}
+
+    def close(self):
+        self._db.close()
+
+def index_expedientes(base_dir, workers=None):
+    """Actualiza el índice de texto completo (.texto.sqlite3) con los PDF de todos los expedientes bajo `base_dir`."""
+    C_CYAN, C_YELLOW, C_GREEN, C_BOLD, C_END = "\033[96m", "\033[93m", "\033[92m", "\033[1m", "\033[0m"
+    base_dir = os.path.abspath(base_dir)
+    print(f"{C_CYAN}{C_BOLD}>>> Indexando texto de los expedientes en {base_dir}{C_END}")
+    index = TextIndex(os.path.join(base_dir, ".texto.sqlite3"))
+    try:
+        started = time.perf_counter()
+        indexed, unchanged, removed, errors = index.update(
+            base_dir, workers, progress=lambda done, total: print(f"  > {done}/{total} extraídos...", end="\r"))
+        counts = index.counts()
+    finally:
+        index.close()
+    print(f"\n{C_GREEN}{C_BOLD}✓ {indexed} indexados, {unchanged} sin cambios, {removed} retirados "
+          f"en {time.perf_counter() - started:.1f}s.{C_END}")
+    if errors:
+        print(f"  {C_YELLOW}⚠ {errors} PDF no se pudieron leer.{C_END}")
+    print(f"  Índice: {counts['documentos']} documentos de {counts['expedientes']} expedientes "
+          f"({counts['sin_texto']} sin texto extraíble, p. ej. escaneados).")
+
+def search_expedientes(base_dir, query, limit=20, radicado=None):
+    C_CYAN, C_YELLOW, C_BOLD, C_END = "\033[96m", "\033[93m", "\033[1m", "\033[0m"
+    db_path = os.path.join(os.path.abspath(base_dir), ".texto.sqlite3")
+    if not os.path.exists(db_path):
+        print("No hay índice de texto. Ejecute primero el subcomando 'indexar'.")
+        return []
+    index = TextIndex(db_path)
+    try:
+        started = time.perf_counter()
+        hits = index.search(query, limit, radicado)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    finally:
+        index.close()
+    for hit in hits:
+        print(f"{C_CYAN}{C_BOLD}{hit['radicado']}{C_END}  {hit['fecha']:<10}  {hit['nombre']}  ({hit['puntaje']})")
+        print(f"    {hit['fragmento']}")
+    print(f"{C_YELLOW}{len(hits)} resultados en {elapsed_ms:.1f} ms.{C_END}")
+    return hits
+
+def _invalid_radicados(radicados):
+    """Los radicados que no tienen el formato del portal (23 dígitos)."""
+    return [r for r in radicados if not TybaDownloader.RADICADO_RE.fullmatch(r)]
+
+def _read_radicados(path):
+    """Lee un archivo de radicados: uno por línea, ignora líneas vacías y comentarios (#)."""
+    radicados = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                radicados.append(line)
+    return radicados
+
+def _add_download_options(p):
+    """Opciones del descargador comunes a `lote` y `servicio`."""
+    p.add_argument("-o", "--salida", help="Carpeta base de descarga (por defecto la del script).")
+    p.add_argument("--incluir-notificaciones", action="store_true", help="No filtrar notificaciones y citaciones.")
+    p.add_argument("--filtro-por-nombre", action="store_true",
+                   help="No descarga los documentos cuyo nombre ya los identifica como notificación (modo agresivo).")
+    p.add_argument("--motor", choices=["sync", "async", "http"], default="sync",
+                   help="Motor: 'async' descarga en paralelo los adjuntos de cada actuación; 'http' recorre el "
+                        "expediente sin navegador tras la búsqueda.")
+    p.add_argument("--descargas-paralelas", type=int, default=4, metavar="N",
+                   help="Máximo de adjuntos simultáneos por actuación con --motor async (por defecto 4).")
+    p.add_argument("--completo", action="store_true",
+                   help="Ignora el manifiesto y revisa todas las actuaciones aunque no hayan cambiado.")
+    p.add_argument("--almacen-unico", action="store_true",
+                   help="Guarda cada PDF una sola vez por contenido (.almacen) y lo enlaza en cada expediente.")
+    p.add_argument("--ritmo", choices=sorted(PacingController.PRESETS), default="normal",
+                   help="Ritmo inicial de las pausas (se adapta solo según la respuesta del portal).")
+    p.add_argument("--ttl-sesion", type=float, default=20, metavar="MIN",
+                   help="Minutos durante los que se reutiliza una búsqueda ya resuelta (0 desactiva la caché).")
+    p.add_argument("--perfil", choices=sorted(BrowserProfile.PRESETS), default="visible",
+                   help="visible (por defecto, ventana fuera de pantalla), ligero o minimo (sin pantalla y sin "
+                        "imágenes, fuentes ni rastreadores; minimo tampoco carga hojas de estilo).")
+    p.add_argument("--sin-slow-mo", action="store_true", help="Desactiva la ralentización de cada acción del navegador.")
+    p.add_argument("--filtro-paralelo", type=int, default=0, metavar="N",
+                   help="Clasifica las notificaciones en N procesos en segundo plano mientras sigue la descarga "
+                        "(por defecto 0: el filtro se aplica en línea antes de guardar cada PDF).")
+    p.add_argument("--verificar-paginas", action="store_true",
+                   help="Además de la cabecera y el final, cuenta las páginas de cada PDF ya descargado (más lento).")
+    p.add_argument("--metricas-prom", metavar="RUTA",
+                   help="Archivo .prom donde volcar las métricas de los expedientes (colector textfile de node_exporter).")
+
+def _downloader_from_args(args, script_dir):
+    return TybaDownloader(output_base_dir=args.salida or script_dir, silent_mode=True,
+                          session_ttl=args.ttl_sesion * 60, engine=args.motor,
+                          max_parallel_downloads=args.descargas_paralelas, full_resync=args.completo,
+                          content_store=args.almacen_unico, name_prefilter=args.filtro_por_nombre,
+                          pacing=args.ritmo, metrics_textfile=args.metricas_prom, profile=args.perfil,
+                          slow_mo=False if args.sin_slow_mo else None, verify_pages=args.verificar_paginas,
+                          classify_workers=args.filtro_paralelo)
+
+def _watchlist(args, script_dir, **kwargs):
+    base_dir = os.path.abspath(args.salida or script_dir)
+    os.makedirs(base_dir, exist_ok=True)
+    return Watchlist(os.path.join(base_dir, ".vigilancia.sqlite3"), **kwargs)
+
+def _job_queue(args, script_dir, **kwargs):
+    base_dir = os.path.abspath(args.salida or script_dir)
+    os.makedirs(base_dir, exist_ok=True)
+    return JobQueue(os.path.join(base_dir, ".cola.sqlite3"), **kwargs)
+
+def _build_arg_parser():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Descarga expedientes de TYBA. Sin argumentos se inicia el modo interactivo."
+    )
+    parser.add_argument("--log-nivel", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="DEBUG",
+                        help="Nivel mínimo de debug_log.txt y de registro.jsonl de cada expediente (por defecto DEBUG).")
+    sub = parser.add_subparsers(dest="comando")
+
+    lote = sub.add_parser("lote", help="Descarga varios radicados en paralelo sobre un navegador compartido.")
+    lote.add_argument("radicados", nargs="*", help="Radicados de 23 dígitos.")
+    lote.add_argument("-a", "--archivo", help="Archivo con un radicado por línea.")
+    lote.add_argument("-c", "--concurrencia", type=int, default=3, help="Expedientes simultáneos (por defecto 3).")
+    _add_download_options(lote)
+
+    serv = sub.add_parser("servicio", help="Servicio de larga duración: descarga los radicados de la cola persistente.")
+    serv.add_argument("-c", "--concurrencia", type=int, default=2, help="Expedientes simultáneos (por defecto 2).")
+    serv.add_argument("--puerto", type=int, default=8765,
+                      help="Puerto de la API HTTP local para encolar y consultar trabajos (0 la desactiva; por defecto 8765).")
+    serv.add_argument("--intentos", type=int, default=4,
+                      help="Intentos por expediente antes de darlo por fallido (por defecto 4).")
+    _add_download_options(serv)
+
+    enc = sub.add_parser("encolar", help="Añade radicados a la cola del servicio.")
+    enc.add_argument("radicados", nargs="*", help="Radicados de 23 dígitos.")
+    enc.add_argument("-a", "--archivo", help="Archivo con un radicado por línea.")
+    enc.add_argument("-o", "--salida", help="Carpeta base de descarga del servicio (por defecto la del script).")
+    enc.add_argument("-p", "--prioridad", type=int, default=0, help="Prioridad (mayor se atiende antes; por defecto 0).")
+    enc.add_argument("--incluir-notificaciones", action="store_true", help="No filtrar notificaciones y citaciones.")
+
+    cola = sub.add_parser("cola", help="Muestra el estado de la cola del servicio.")
+    cola.add_argument("-o", "--salida", help="Carpeta base de descarga del servicio (por defecto la del script).")
+    cola.add_argument("--estado", choices=["pendiente", "en_curso", "completo", "fallido"], help="Filtra por estado.")
+    cola.add_argument("-n", "--limite", type=int, default=30, help="Trabajos a listar (por defecto 30).")
+    vig = sub.add_parser("vigilar", help="Vigila radicados y descarga solo los que tienen actuaciones nuevas.")
+    vig.add_argument("radicados", nargs="*", help="Radicados de 23 dígitos que se añaden a la lista de vigilancia.")
+    vig.add_argument("-a", "--archivo", help="Archivo con un radicado por línea para añadir a la lista.")
+    vig.add_argument("-c", "--concurrencia", type=int, default=1, help="Revisiones simultáneas (por defecto 1).")
+    vig.add_argument("--intervalo", type=float, default=24, metavar="HORAS",
+                     help="Cada cuánto se revisa cada radicado, repartido a lo largo del intervalo (por defecto 24).")
+    vig.add_argument("--por-hora", type=int, default=60, metavar="N",
+                     help="Máximo de revisiones por hora entre todos los hilos (por defecto 60; 0 sin límite).")
+    vig.add_argument("--filas", type=int, default=10, metavar="N",
+                     help="Actuaciones más recientes que se comparan con la huella guardada (por defecto 10).")
+    vig.add_argument("--cambios", metavar="RUTA", help="Registro JSONL de cambios (por defecto cambios.jsonl en la carpeta base).")
+    vig.add_argument("--solo-avisar", action="store_true", help="Anota los cambios sin descargar los expedientes.")
+    vig.add_argument("--una-vez", action="store_true", help="Hace las revisiones pendientes y termina (para cron).")
+    vig.add_argument("--solo-agregar", action="store_true", help="Añade los radicados a la lista sin iniciar la vigilancia.")
+    _add_download_options(vig)
+
+    vis = sub.add_parser("vigilancia", help="Muestra o edita la lista de radicados vigilados.")
+    vis.add_argument("-o", "--salida", help="Carpeta base de descarga (por defecto la del script).")
+    vis.add_argument("--quitar", nargs="+", metavar="RADICADO", help="Deja de vigilar estos radicados.")
+    vis.add_argument("-n", "--limite", type=int, default=30, help="Radicados a listar (por defecto 30).")
+
+    rec = sub.add_parser("reclasificar", help="Vuelve a aplicar el filtro de notificaciones a los PDF ya descargados.")
+    rec.add_argument("base", nargs="?", help="Carpeta con las carpetas de expedientes (por defecto la del script).")
+    rec.add_argument("--accion", choices=["simular", "cuarentena", "eliminar"], default="simular",
+                     help="simular (por defecto) solo informa; cuarentena mueve a .cuarentena; eliminar borra.")
+    rec.add_argument("-p", "--procesos", type=int, default=None, help="Procesos de análisis (por defecto, uno por CPU).")
+
+    idx = sub.add_parser("indexar", help="Actualiza el índice de texto completo de los PDF ya descargados.")
+    idx.add_argument("base", nargs="?", help="Carpeta con las carpetas de expedientes (por defecto la del script).")
+    idx.add_argument("-p", "--procesos", type=int, default=None, help="Procesos de extracción (por defecto, uno por CPU).")
+
+    bus = sub.add_parser("buscar", help="Busca en el texto de los documentos indexados.")
+    bus.add_argument("consulta", help='Palabras o expresión FTS5, p. ej. "RESUELVE AND embargo" o \'"900123456"\'.')
+    bus.add_argument("-o", "--salida", help="Carpeta base de descarga (por defecto la del script).")
+    bus.add_argument("-r", "--radicado", help="Limita la búsqueda a un expediente.")
+    bus.add_argument("-n", "--limite", type=int, default=20, help="Resultados a mostrar (por defecto 20).")
+
+    cache = sub.add_parser("limpiar-cache-filtro", help="Invalida la caché de decisiones del filtro de notificaciones.")
+    cache.add_argument("-o", "--salida", help="Carpeta base de descarga (por defecto la del script).")
+    cache.add_argument("--todo", action="store_true",
+                       help="Borra todas las decisiones, no solo las de versiones anteriores de las reglas.")
+    return parser
+
+def _run_cli(args):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    logger.configure(level=args.log_nivel)
+    if args.comando is None:
+        _interactive()
+        return 0
+    if args.comando == "lote":
+        radicados = list(args.radicados)
+        if args.archivo:
+            radicados += _read_radicados(args.archivo)
+        if not radicados:
+            print("No se indicaron radicados (use argumentos o --archivo).")
+            return 2
+        # Un radicado mal escrito solo fallaría tras abrir el navegador y resolver el CAPTCHA
+        invalid = _invalid_radicados(radicados)
+        if invalid:
+            print(f"Radicados inválidos (se esperan 23 dígitos): {', '.join(repr(r) for r in invalid)}")
+            return 2
+        downloader = _downloader_from_args(args, script_dir)
+        try:
+            states = downloader.download_batch(
+                radicados, skip_notifications=not args.incluir_notificaciones, concurrency=args.concurrencia
+            )
+        finally:
+            downloader.close()
+        return 0 if all(st is not None and st.completed for st in states) else 1
+    if args.comando == "servicio":
+        jobs = _job_queue(args, script_dir, max_attempts=args.intentos)
+        downloader = _downloader_from_args(args, script_dir)
+        try:
+            DownloadDaemon(downloader, jobs, concurrency=args.concurrencia, port=args.puerto).run()
+        finally:
+            downloader.close()
+            jobs.close()
+        return 0
+    if args.comando == "encolar":
+        radicados = list(args.radicados)
+        if args.archivo:
+            radicados += _read_radicados(args.archivo)
+        if not radicados:
+            print("No se indicaron radicados (use argumentos o --archivo).")
+            return 2
+        jobs = _job_queue(args, script_dir)
+        status = 0
+        for radicado in radicados:
+            try:
+                job_id, new = jobs.submit(radicado, args.prioridad, not args.incluir_notificaciones)
+                print(f"{'Encolado' if new else 'Ya estaba en cola'}: {radicado} (trabajo #{job_id})")
+            except ValueError as e:
+                print(e)
+                status = 2
+        jobs.close()
+        return status
+    if args.comando == "cola":
+        jobs = _job_queue(args, script_dir)
+        print(f"Cola: {jobs.db_path}")
+        print("  " + (", ".join(f"{k}: {v}" for k, v in sorted(jobs.counts().items())) or "(vacía)"))
+        for job in jobs.list(args.estado, args.limite):
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job["updated_at"]))
+            line = f"  #{job['id']:<5} {job['radicado']}  {job['state']:<9} intentos {job['attempts']}/{job['max_attempts']}  prioridad {job['priority']}  {when}"
+            if job["state"] == "pendiente" and job["not_before"] > time.time():
+                line += f"  (reintento a las {time.strftime('%H:%M:%S', time.localtime(job['not_before']))})"
+            print(line)
+            if job["last_error"] and job["state"] != "completo":
+                print(f"         {job['last_error'][:200]}")
+        jobs.close()
+        return 0
+    if args.comando == "vigilar":
+        radicados = list(args.radicados)
+        if args.archivo:
+            radicados += _read_radicados(args.archivo)
+        watchlist = _watchlist(args, script_dir, interval=args.intervalo * 3600)
+        added = existing = 0
+        for radicado in radicados:
+            try:
+                if watchlist.add(radicado, not args.incluir_notificaciones): added += 1
+                else: existing += 1
+            except ValueError as e:
+                print(e)
+        if radicados:
+            print(f"Añadidos a la vigilancia: {added} (ya vigilados: {existing}).")
+        try:
+            if not args.solo_agregar:
+                base_dir = os.path.abspath(args.salida or script_dir)
+                feed = ChangeFeed(args.cambios or os.path.join(base_dir, "cambios.jsonl"))
+                downloader = _downloader_from_args(args, script_dir)
+                try:
+                    WatchMonitor(downloader, watchlist, feed, concurrency=args.concurrencia, per_hour=args.por_hora,
+                                 download=not args.solo_avisar, once=args.una_vez, rows=args.filas).run()
+                finally:
+                    downloader.close()
+        finally:
+            watchlist.close()
+        return 0
+    if args.comando == "vigilancia":
+        watchlist = _watchlist(args, script_dir)
+        for radicado in args.quitar or []:
+            print(f"{'Quitado' if watchlist.remove(radicado) else 'No estaba vigilado'}: {radicado}")
+        print(f"Vigilancia: {watchlist.db_path}")
+        print("  " + ", ".join(f"{k}: {v}" for k, v in watchlist.counts().items()))
+        fmt = lambda ts: time.strftime('%Y-%m-%d %H:%M', time.localtime(ts)) if ts else "-"
+        for item in watchlist.list(args.limite):
+            line = f"  {item['radicado']}  próxima {fmt(item['next_check'])}  última {fmt(item['last_check'])}  " \
+                   f"cambios {item['changes']} (último {fmt(item['last_change'])})"
+            if item["failures"]:
+                line += f"  fallos seguidos {item['failures']}: {(item['last_error'] or '')[:120]}"
+            print(line)
+        watchlist.close()
+        return 0
+    if args.comando == "reclasificar":
+        reclassify_expedientes(args.base or script_dir, action=args.accion, workers=args.procesos)
+        return 0
+    if args.comando == "indexar":
+        index_expedientes(args.base or script_dir, workers=args.procesos)
+        return 0
+    if args.comando == "buscar":
+        return 0 if search_expedientes(args.salida or script_dir, args.consulta, args.limite, args.radicado) else 1
+    if args.comando == "limpiar-cache-filtro":
+        db_path = os.path.join(os.path.abspath(args.salida or script_dir), ".filtro_cache.sqlite3")
+        if not os.path.exists(db_path):
+            print("No hay caché de decisiones del filtro.")
+            return 0
+        cache = FilterDecisionCache(db_path)
+        removed = cache.invalidate(everything=args.todo)
+        cache.close()
+        print(f"Decisiones eliminadas: {removed} (versión actual de las reglas: {FILTRO_VERSION}).")
+        return 0
+    return 0
+
+def _interactive():
+    os.system('cls' if os.name == 'nt' else 'clear')
+    C_CYAN = "\033[96m"
+    C_BLUE = "\033[94m"
+    C_BOLD = "\033[1m"
+    C_END = "\033[0m"
+    
+    title = "TYBA DOWNLO@DER"
+    print(f"\n{C_BLUE}{C_BOLD}{'='*60}")
+    print(f"{title:^60}")
+    print(f"{'='*60}{C_END}")
+    
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    
+    notif_pref = input(f"{C_BOLD}¿Omitir notificaciones y citaciones? (s/n) [S]:{C_END} ").strip().lower()
+    skip_notif = notif_pref != 'n'
+    
+    downloader = TybaDownloader(output_base_dir=script_dir, silent_mode=True)
+    
+    while True:
+        radicado = input(f"\n{C_BOLD}Ingrese 23 dígitos del radicado (o 'q' para salir):{C_END} ").strip()
+        if not radicado: continue
+        if radicado.lower() == 'q': break
+            
+        try:
+            downloader.download_case(radicado, skip_notifications=skip_notif)
+        except Exception as e:
+            print(f"\n{downloader.C_RED}Error: {e}{downloader.C_END}")
+            
+    print(f"\n{C_CYAN}Finalizado. ¡Hasta la próxima!{C_END}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(_run_cli(_build_arg_parser().parse_args()))
+    try:
+        _interactive()
     except Exception:
         error_msg = traceback.format_exc()
         print(f"\n\033[91m!!! ERROR CRÍTICO !!!\033[0m\n{error_msg}")
@@ -0,0 +1,474 @@
+# Servidor local que imita las páginas de TYBA de las que depende tyba_downloader.py.
+# Sirve para medir y probar el descargador sin tocar el portal de la Rama Judicial:
+# los expedientes son sintéticos (deterministas por radicado y semilla) y la latencia,
+# los errores del generador, los cortes de conexión y los fallos de CAPTCHA son configurables.
+#
+#   python tyba_mock_server.py --puerto 8080 --latencia 0.1 --fallos 0.05
+#
+# Solo usa la biblioteca estándar.
+import base64
+import hashlib
+import html
+import http.server
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+PORTAL_PATH = "/Justicia21/Administracion/Ciudadanos/"
+
+# Nombres de actuación y primeras líneas del documento que genera cada una
+ACTUACIONES_SUSTANCIALES = [
+    ("AUTO QUE DECRETA PRUEBAS", "AUTO INTERLOCUTORIO. RESUELVE: PRIMERO. DECRETAR LAS PRUEBAS SOLICITADAS"),
+    ("AUTO FIJA FECHA AUDIENCIA", "AUTO. SE ORDENA FIJAR FECHA PARA AUDIENCIA INICIAL"),
+    ("MEMORIAL", "MEMORIAL. SOLICITUD DEL APODERADO DE LA PARTE DEMANDANTE"),
+    ("CONTESTACION DE LA DEMANDA", "CONTESTACION DE LA DEMANDA Y EXCEPCIONES DE MERITO"),
+    ("SENTENCIA", "SENTENCIA DE PRIMERA INSTANCIA. RESUELVE: PRIMERO. DECLARAR"),
+    ("RECURSO DE REPOSICION", "RECURSO DE REPOSICION CONTRA EL AUTO ANTERIOR"),
+]
+ACTUACIONES_NOTIFICACION = [
+    ("NOTIFICACION PERSONAL", "NOTIFICACION PERSONAL. POR MEDIO DEL PRESENTE SE HACE SABER"),
+    ("CITACION PARA NOTIFICACION", "FORMATO DE CITACION. DIRECCION DE NOTIFICACION. GUIA NO 123"),
+    ("FIJACION ESTADO", "NOTIFICACION POR ESTADO. SECRETARIA DEL JUZGADO"),
+    ("ENVIO DE COMUNICACION", "ACUSE DE RECIBO. REPORTE DE CORREO ELECTRONICO"),
+]
+ARCHIVOS = ["DEMANDA", "PODER", "ANEXOS DE LA DEMANDA", "ACTA DE REPARTO"]
+
+def make_pdf(lines, size_kb=0):
+    """PDF mínimo con `lines` en la primera página (texto extraíble) y páginas de relleno hasta `size_kb`."""
+    def page_stream(text_lines):
+        body = ["BT /F1 11 Tf 56 780 Td 14 TL"]
+        for line in text_lines:
+            safe = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            body.append(f"({safe}) Tj T*")
+        body.append("ET")
+        return "\n".join(body).encode("latin-1", "replace")
+
+    streams = [page_stream(lines)]
+    filler = ["Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor."] * 50
+    while sum(len(s) for s in streams) < size_kb * 1024:
+        streams.append(page_stream(filler))
+
+    n_pages = len(streams)
+    # 1: catálogo, 2: páginas, 3: fuente, luego (página, contenido) por cada página
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(n_pages))
+    objs = [b"<< /Type /Catalog /Pages 2 0 R >>",
+            f"<< /Type /Pages /Kids [{kids}] /Count {n_pages} >>".encode(),
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i, stream in enumerate(streams):
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Contents {5 + 2 * i} 0 R "
+                    f"/Resources << /Font << /F1 3 0 R >> >> >>".encode())
+        objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, xref)
+    return out
+
+class MockConfig:
+    """Parámetros del servidor simulado. Las probabilidades van de 0 a 1."""
+    def __init__(self, actuaciones=12, por_pagina=10, adjuntos=2, archivos=2, notificaciones=0.3, pdf_kb=40,
+                 latencia=0.05, latencia_pdf=0.2, fallos=0.0, cortes=0.0, captcha=0.0, id_en_fila=True, semilla=1):
+        self.actuaciones = actuaciones # Actuaciones por expediente
+        self.por_pagina = por_pagina # Filas por página de grdActuaciones
+        self.adjuntos = adjuntos # Adjuntos por actuación
+        self.archivos = min(archivos, len(ARCHIVOS)) # Documentos de la pestaña Archivos
+        self.notificaciones = notificaciones # Proporción de actuaciones que son notificaciones
+        self.pdf_kb = pdf_kb # Tamaño aproximado de cada PDF
+        self.latencia = latencia # Segundos por petición (±50 %)
+        self.latencia_pdf = latencia_pdf # Segundos adicionales del generador de PDF
+        self.fallos = fallos # Probabilidad de que el generador responda con error
+        self.cortes = cortes # Probabilidad de cortar la conexión a mitad de un PDF
+        self.captcha = captcha # Probabilidad de "El valor de la Capcha no coincide" en cada búsqueda
+        self.id_en_fila = id_en_fila # La fila del adjunto lleva el id del documento (permite la vía sin popup)
+        self.semilla = semilla
+
+class MockCase:
+    """Expediente sintético: actuaciones (más recientes primero) con sus adjuntos y documentos de Archivos."""
+    def __init__(self, radicado, config):
+        rnd = random.Random(f"{config.semilla}:{radicado}")
+        self.radicado = radicado
+        self.docs = {} # id -> (líneas de la primera página)
+        self.actuaciones = []
+        day = 0
+        for i in range(config.actuaciones):
+            day += rnd.randint(1, 20)
+            if i == 0:
+                name, text = "AUTO ADMITE DEMANDA", "AUTO INTERLOCUTORIO. RESUELVE: ADMITIR LA DEMANDA"
+            elif rnd.random() < config.notificaciones:
+                name, text = rnd.choice(ACTUACIONES_NOTIFICACION)
+            else:
+                name, text = rnd.choice(ACTUACIONES_SUSTANCIALES)
+            date = time.strftime("%d/%m/%Y", time.gmtime(1577836800 + day * 86400))
+            files = []
+            for j in range(config.adjuntos):
+                doc_id = self._doc_id(f"a{i}-{j}")
+                self.docs[doc_id] = [text, f"RADICADO {radicado}", f"{name} - ANEXO {j + 1}"]
+                files.append((doc_id, f"{name} {i + 1}-{j + 1}"))
+            self.actuaciones.append({"fecha": date, "nombre": name, "adjuntos": files})
+        self.actuaciones.reverse()
+        self.archivos = []
+        for k in range(config.archivos):
+            doc_id = self._doc_id(f"d{k}")
+            self.docs[doc_id] = [f"{ARCHIVOS[k]}. PRETENSIONES", f"RADICADO {radicado}"]
+            self.archivos.append((doc_id, ARCHIVOS[k]))
+
+    def _doc_id(self, key):
+        return hashlib.sha1(f"{self.radicado}:{key}".encode()).hexdigest()[:16]
+
+class MockTyba:
+    """Servidor HTTP en un hilo. `url` es la de frmConsulta.aspx (el `base_url` del descargador)."""
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or MockConfig()
+        self.host = host
+        self.port = port
+        self.stats = {} # Contadores de lo servido (búsquedas, detalles, pdf, fallos...)
+        self._cases = {}
+        self._lock = threading.Lock()
+        self._rnd = random.Random(self.config.semilla)
+        self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self._server.server_address[1]}{PORTAL_PATH}frmConsulta.aspx"
+
+    def start(self):
+        mock = self
+        class Handler(_MockHandler):
+            server_mock = mock
+        self._server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def case(self, radicado):
+        with self._lock:
+            if radicado not in self._cases:
+                self._cases[radicado] = MockCase(radicado, self.config)
+            return self._cases[radicado]
+
+    def document(self, doc_id):
+        """Primera página del documento `doc_id` de cualquier expediente ya consultado (None si no existe)."""
+        with self._lock:
+            for case in self._cases.values():
+                if doc_id in case.docs:
+                    return case.docs[doc_id]
+        return None
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def chance(self, p):
+        if p <= 0: return False
+        with self._lock:
+            return self._rnd.random() < p
+
+    def delay(self, extra=0.0):
+        with self._lock:
+            factor = self._rnd.uniform(0.5, 1.5)
+        seconds = self.config.latencia * factor + extra
+        if seconds > 0: time.sleep(seconds)
+
+def _encode_state(state):
+    return base64.b64encode(json.dumps(state).encode()).decode()
+
+def _decode_state(value):
+    try:
+        return json.loads(base64.b64decode(value))
+    except Exception:
+        return {}
+
+_POSTBACK_JS = """<script type="text/javascript">
+var theForm = document.forms['form1'];
+function __doPostBack(eventTarget, eventArgument) {
+    if (!theForm.onsubmit || (theForm.onsubmit() != false)) {
+        theForm.__EVENTTARGET.value = eventTarget;
+        theForm.__EVENTARGUMENT.value = eventArgument;
+        theForm.submit();
+    }
+}
+</script>"""
+
+class _MockHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_mock = None
+
+    def log_message(self, *args):
+        pass
+
+    # --- Respuestas ---
+    def _send(self, body, status=200, ctype="text/html; charset=utf-8", headers=None):
+        if isinstance(body, str): body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _session_cookie(self):
+        if "ASP.NET_SessionId=" in (self.headers.get("Cookie") or ""):
+            return {}
+        sid = hashlib.sha1(f"{time.time()}:{id(self)}".encode()).hexdigest()[:24]
+        return {"Set-Cookie": f"ASP.NET_SessionId={sid}; path=/; HttpOnly"}
+
+    def _page(self, state, body, script=""):
+        parts = [
+            "<!DOCTYPE html><html><head><title>Consulta de Procesos - TYBA</title></head><body>",
+            '<form method="post" action="./frmConsulta.aspx" id="form1">',
+            '<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />',
+            '<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />',
+            f'<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{_encode_state(state)}" />',
+            '<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="mock" />',
+            _POSTBACK_JS, body, "</form>",
+        ]
+        if script: parts.append(f'<script type="text/javascript">{script}</script>')
+        parts.append("</body></html>")
+        self._send("\n".join(parts), headers=self._session_cookie())
+
+    def _search_form(self, error=""):
+        body = ['<div id="MainContent_pnlBusqueda">',
+                '<input name="ctl00$MainContent$txtCodigoProceso" type="text" maxlength="23" id="MainContent_txtCodigoProceso" />',
+                '<img id="MainContent_imgCaptcha" src="Captcha.aspx" alt="captcha" />',
+                '<input type="submit" name="ctl00$MainContent$btnConsultar" value="Consultar" id="MainContent_btnConsultar" />']
+        if error: body.append(f'<span id="MainContent_lblError" style="color:red">{error}</span>')
+        body.append("</div>")
+        self._page({"v": "buscar"}, "\n".join(body))
+
+    def _results(self, radicado):
+        body = ('<table id="MainContent_grdProceso"><tr><th></th><th>Código Proceso</th><th>Despacho</th></tr>'
+                f'<tr><td><input type="image" name="ctl00$MainContent$grdProceso$ctl02$imgbConsultarGrilla" '
+                f'id="MainContent_grdProceso_imgbConsultarGrilla_0" src="img/lupa.png" /></td>'
+                f'<td>{radicado}</td><td>JUZGADO CIVIL DEL CIRCUITO</td></tr></table>')
+        self._page({"v": "resultado", "r": radicado}, body)
+
+    def _detail(self, radicado, page_num=1, viewer=None, open_popup=None, actuacion=None):
+        mock = self.server_mock
+        case = mock.case(radicado)
+        state = {"v": "detalle", "r": radicado, "p": page_num}
+        body = [f'<h3 id="MainContent_lblProceso">Proceso {radicado}</h3>',
+                '<ul class="nav nav-tabs"><li><a href="#Actuaciones" data-toggle="tab">Actuaciones</a></li>',
+                '<li><a href="#Archivos" data-toggle="tab">Archivos</a></li></ul>',
+                '<div class="tab-content"><div class="tab-pane active" id="Actuaciones">']
+        if actuacion is None:
+            per_page = mock.config.por_pagina
+            rows = case.actuaciones[(page_num - 1) * per_page:page_num * per_page]
+            body.append('<table id="MainContent_grdActuaciones"><tr><th></th><th>Fecha Actuación</th>'
+                        '<th>Actuación</th><th>Fecha Registro</th></tr>')
+            for k, act in enumerate(rows):
+                body.append(f'<tr><td><input type="image" name="ctl00$MainContent$grdActuaciones$ctl{k + 2:02d}$imgbConsultarGrilla" '
+                            f'id="MainContent_grdActuaciones_imgbConsultarGrilla_{k}" src="img/lupa.png" /></td>'
+                            f'<td>{act["fecha"]}</td><td>{html.escape(act["nombre"])}</td><td>{act["fecha"]}</td></tr>')
+            pages = (len(case.actuaciones) + per_page - 1) // per_page
+            if pages > 1:
+                links = []
+                for p in range(1, pages + 1):
+                    if p == page_num:
+                        links.append(f"<td><span>{p}</span></td>")
+                    else:
+                        links.append(f"<td><a href=\"javascript:__doPostBack(&#39;ctl00$MainContent$grdActuaciones&#39;,&#39;Page${p}&#39;)\">{p}</a></td>")
+                body.append(f'<tr class="Paginacion"><td colspan="4"><table><tr>{"".join(links)}</tr></table></td></tr>')
+            body.append("</table>")
+        else:
+            act = case.actuaciones[actuacion]
+            state.update(v="actuacion", a=actuacion)
+            body.append(f'<span id="MainContent_lblActuacion">{html.escape(act["nombre"])} ({act["fecha"]})</span>')
+            body.append('<input type="submit" name="ctl00$MainContent$btnRegresarActuacion" value="Regresar" id="MainContent_btnRegresarActuacion" />')
+            body.append('<table id="MainContent_grdArchivosActuaciones"><tr><th></th><th>Nombre</th></tr>')
+            for j, (doc_id, name) in enumerate(act["adjuntos"]):
+                hidden = (f'<input type="hidden" id="MainContent_grdArchivosActuaciones_hfIdDocumento_{j}" value="{doc_id}" />'
+                          if mock.config.id_en_fila else "")
+                body.append(f'<tr><td><input type="image" name="ctl00$MainContent$grdArchivosActuaciones$ctl{j + 2:02d}$imgDescargaArchivos" '
+                            f'id="MainContent_grdArchivosActuaciones_imgDescargaArchivos_{j}" src="img/pdf.png" />{hidden}</td>'
+                            f'<td>{html.escape(name)}</td></tr>')
+            body.append("</table>")
+        body.append('</div><div class="tab-pane" id="Archivos">')
+        body.append('<table id="MainContent_grdArchivos"><tr><th></th><th>Descripción</th></tr>')
+        for k, (doc_id, name) in enumerate(case.archivos):
+            body.append(f'<tr><td><input type="image" name="ctl00$MainContent$grdArchivos$ctl{k + 2:02d}$imgbConsultarGrillaArchivos" '
+                        f'id="MainContent_grdArchivos_imgbConsultarGrillaArchivos_{k}" src="img/pdf.png" /></td>'
+                        f'<td>{html.escape(name)}<br/>Folios: {k + 1}</td></tr>')
+        body.append("</table>")
+        if viewer:
+            body.append(f'<iframe id="MainContent_IframeViewPDF" src="Documento.aspx?idDocumento={viewer}" width="100%" height="600"></iframe>')
+            body.append('<input type="image" name="ctl00$MainContent$imbCerrarVistaPDF" id="MainContent_imbCerrarVistaPDF" src="img/cerrar.png" />')
+        body.append("</div></div>")
+        script = f"window.open('Visor.aspx?idDocumento={open_popup}','_blank');" if open_popup else ""
+        self._page(state, "\n".join(body), script)
+
+    def _pdf(self, doc_id):
+        mock = self.server_mock
+        mock.delay(mock.config.latencia_pdf)
+        if "ASP.NET_SessionId=" not in (self.headers.get("Cookie") or ""):
+            mock.count("sin_sesion")
+            return self._send("<html><body>La sesión ha expirado.</body></html>")
+        lines = mock.document(doc_id)
+        if lines is None:
+            return self._send("<html><body>Documento no encontrado.</body></html>", status=404)
+        if mock.chance(mock.config.fallos):
+            mock.count("fallos")
+            return self._send("<html><body>Error generando el documento.</body></html>", status=500)
+
+        data = make_pdf(lines, mock.config.pdf_kb)
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()[:16]
+        start = 0
+        m = re.match(r"bytes=(\d+)-$", self.headers.get("Range") or "")
+        if m and int(m.group(1)) < len(data) and self.headers.get("If-Range") in (None, etag):
+            start = int(m.group(1))
+            mock.count("rangos")
+        body = data[start:]
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        if start: self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.end_headers()
+        if len(body) > 1 and mock.chance(mock.config.cortes):
+            mock.count("cortes")
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+        mock.count("pdf")
+
+    # --- Rutas ---
+    def do_GET(self):
+        mock = self.server_mock
+        parts = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(parts.query))
+        page = parts.path.rsplit("/", 1)[-1].lower()
+        if page in ("descargando.aspx", "documento.aspx"):
+            return self._pdf(query.get("idDocumento", ""))
+        mock.delay()
+        if page == "frmconsulta.aspx":
+            return self._search_form()
+        if page == "visor.aspx":
+            # Popup del adjunto: el PDF lo entrega el generador dentro de un iframe
+            doc_id = html.escape(query.get("idDocumento", ""))
+            return self._send(f'<html><body><iframe src="Descargando.aspx?idDocumento={doc_id}" width="100%" height="100%"></iframe></body></html>')
+        if page.endswith(".png"):
+            return self._send(b"", ctype="image/png")
+        self._send("<html><body>No encontrado</body></html>", status=404)
+
+    def do_POST(self):
+        mock = self.server_mock
+        length = int(self.headers.get("Content-Length") or 0)
+        form = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode("utf-8", "replace"), keep_blank_values=True))
+        mock.delay()
+        state = _decode_state(form.get("__VIEWSTATE", ""))
+        radicado = state.get("r")
+        page_num = state.get("p", 1)
+
+        if "ctl00$MainContent$btnConsultar" in form:
+            mock.count("busquedas")
+            radicado = form.get("ctl00$MainContent$txtCodigoProceso", "").strip()
+            if mock.chance(mock.config.captcha):
+                mock.count("captcha_fallidos")
+                return self._search_form("El valor de la Capcha no coincide")
+            if not re.fullmatch(r"\d{23}", radicado):
+                return self._search_form("El código del proceso debe tener 23 dígitos")
+            return self._results(radicado)
+        if not radicado:
+            return self._search_form()
+
+        target = form.get("__EVENTTARGET", "")
+        if target.endswith("grdActuaciones") and form.get("__EVENTARGUMENT", "").startswith("Page$"):
+            mock.count("paginas")
+            return self._detail(radicado, int(form["__EVENTARGUMENT"].split("$", 1)[1]))
+        for key in form:
+            m = re.search(r"\$ctl(\d+)\$(\w+)\.x$", key)
+            if not m: continue
+            row, button = int(m.group(1)) - 2, m.group(2)
+            if "grdProceso" in key:
+                return self._detail(radicado)
+            if button == "imgbConsultarGrilla":
+                mock.count("detalles")
+                return self._detail(radicado, page_num, actuacion=(page_num - 1) * mock.config.por_pagina + row)
+            if button == "imgDescargaArchivos" and state.get("v") == "actuacion":
+                doc_id = mock.case(radicado).actuaciones[state["a"]]["adjuntos"][row][0]
+                mock.count("popups")
+                return self._detail(radicado, page_num, actuacion=state["a"], open_popup=doc_id)
+            if button == "imgbConsultarGrillaArchivos":
+                return self._detail(radicado, page_num, viewer=mock.case(radicado).archivos[row][0])
+        if "ctl00$MainContent$btnRegresarActuacion" in form or "ctl00$MainContent$imbCerrarVistaPDF.x" in form:
+            return self._detail(radicado, page_num)
+        if not target:
+            # Postback sin control (el formulario reenviado tal cual): se vuelve a pintar la vista del ViewState
+            mock.count("repintados")
+            if state.get("v") == "resultado":
+                return self._results(radicado)
+            return self._detail(radicado, page_num, actuacion=state.get("a") if state.get("v") == "actuacion" else None)
+        self._send("<html><body>Error de postback</body></html>", status=500)
+
+def _build_arg_parser():
+    import argparse
+    parser = argparse.ArgumentParser(description="Servidor local que imita TYBA para pruebas y mediciones.")
+    parser.add_argument("--puerto", type=int, default=8080)
+    add_mock_arguments(parser)
+    return parser
+
+def add_mock_arguments(parser):
+    """Opciones del expediente sintético y de las fallas simuladas (compartidas con tyba_bench.py)."""
+    defaults = MockConfig()
+    group = parser.add_argument_group("servidor simulado")
+    group.add_argument("--actuaciones", type=int, default=defaults.actuaciones, help="Actuaciones por expediente.")
+    group.add_argument("--por-pagina", type=int, default=defaults.por_pagina, help="Filas por página de actuaciones.")
+    group.add_argument("--adjuntos", type=int, default=defaults.adjuntos, help="Adjuntos por actuación.")
+    group.add_argument("--archivos", type=int, default=defaults.archivos, help="Documentos de la pestaña Archivos.")
+    group.add_argument("--notificaciones", type=float, default=defaults.notificaciones,
+                       help="Proporción de actuaciones que son notificaciones (0-1).")
+    group.add_argument("--pdf-kb", type=int, default=defaults.pdf_kb, help="Tamaño aproximado de cada PDF.")
+    group.add_argument("--latencia", type=float, default=defaults.latencia, help="Segundos por petición (±50 %%).")
+    group.add_argument("--latencia-pdf", type=float, default=defaults.latencia_pdf,
+                       help="Segundos adicionales del generador de PDF.")
+    group.add_argument("--fallos", type=float, default=defaults.fallos, help="Probabilidad de error del generador.")
+    group.add_argument("--cortes", type=float, default=defaults.cortes,
+                       help="Probabilidad de cortar la conexión a mitad de un PDF.")
+    group.add_argument("--captcha", type=float, default=defaults.captcha,
+                       help="Probabilidad de error de CAPTCHA en cada búsqueda.")
+    group.add_argument("--sin-id-en-fila", action="store_true",
+                       help="No incluir el id del documento en la fila del adjunto (obliga a abrir el popup).")
+    group.add_argument("--semilla", type=int, default=defaults.semilla)
+
+def config_from_args(args):
+    return MockConfig(actuaciones=args.actuaciones, por_pagina=args.por_pagina, adjuntos=args.adjuntos,
+                      archivos=args.archivos, notificaciones=args.notificaciones, pdf_kb=args.pdf_kb,
+                      latencia=args.latencia, latencia_pdf=args.latencia_pdf, fallos=args.fallos, cortes=args.cortes,
+                      captcha=args.captcha, id_en_fila=not args.sin_id_en_fila, semilla=args.semilla)
+
+if __name__ == "__main__":
+    args = _build_arg_parser().parse_args()
+    mock = MockTyba(config_from_args(args), port=args.puerto).start()
+    print(f"Servidor TYBA simulado en {mock.url} (Ctrl+C para detener)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.close()
+        print(json.dumps(mock.stats, indent=1))